@@ -1,12 +1,34 @@
 const SERVER_ORIGIN = import.meta.env.VITE_API_BASE_URL; // Flask base URL
 
-export async function fetchChatLogs(robotId) {
-  const url = robotId
-    ? `http://${SERVER_ORIGIN}/api/chat-logs?robot_id=${encodeURIComponent(robotId)}`
-    : `http://${SERVER_ORIGIN}/api/chat-logs`;
+// One page of logs, newest first: { logs, next_after }. Pass next_after back as `after` for older entries.
+// from/to are dates or datetimes; bare dates are whole days in tz (server default when omitted).
+export async function fetchChatLogs(robotId, { after, limit, from, to, tz } = {}) {
+  const params = new URLSearchParams();
+  if (robotId) params.set("robot_id", robotId);
+  if (after) params.set("after", after);
+  if (limit) params.set("limit", limit);
+  if (from) params.set("from", from);
+  if (to) params.set("to", to);
+  if (tz) params.set("tz", tz);
+  const url = `http://${SERVER_ORIGIN}/api/chat-logs?${params.toString()}`;
   const response = await fetch(url);
   if (!response.ok) {
     throw new Error('Failed to fetch chat logs');
   }
   return await response.json();
-}
\ No newline at end of file
+}
+
+// Turns per day in tz from the analytics rollups: [{ bucket, count }], bucket is the local midnight as ISO.
+export async function fetchChatLogDays(robotId, { from, to, tz } = {}) {
+  const params = new URLSearchParams({ robot_id: robotId, granularity: "day", top: "0" });
+  if (from) params.set("from", from);
+  if (to) params.set("to", to);
+  if (tz) params.set("tz", tz);
+  const url = `http://${SERVER_ORIGIN}/api/chat-logs/analytics?${params.toString()}`;
+  const response = await fetch(url);
+  if (!response.ok) {
+    throw new Error('Failed to fetch chat log days');
+  }
+  const data = await response.json();
+  return data.series;
+}
@@ -12,6 +12,13 @@ export const ragApi = {
     return await res.json();
   },
 
+  async getKnowledge(id) {
+    const url = `http://${SERVER_ORIGIN}/rag/knowledge/${encodeURIComponent(id)}`;
+    const res = await fetch(url);
+    if (!res.ok) throw new Error('Failed to load document');
+    return await res.json();
+  },
+
   async uploadKnowledge({ userId, robotId, file, filename }) {
     const url = `http://${SERVER_ORIGIN}/rag/knowledge`;
     const form = new FormData();
@@ -24,9 +31,28 @@ export const ragApi = {
       const err = await res.json().catch(() => ({}));
       throw new Error(err.error || 'Failed to upload knowledge');
     }
+    const { job_id } = await res.json();
+    return await ragApi.waitForJob(job_id);
+  },
+
+  async getJob(jobId) {
+    const url = `http://${SERVER_ORIGIN}/rag/knowledge/jobs/${encodeURIComponent(jobId)}`;
+    const res = await fetch(url);
+    if (!res.ok) throw new Error('Failed to fetch upload status');
     return await res.json();
   },
 
+  // Uploads are processed in the background; poll until the job finishes
+  async waitForJob(jobId, { intervalMs = 1500, onProgress } = {}) {
+    for (;;) {
+      const job = await ragApi.getJob(jobId);
+      if (onProgress) onProgress(job);
+      if (job.status === 'done') return job.result;
+      if (job.status === 'failed') throw new Error(job.error || 'Failed to process knowledge');
+      await new Promise((resolve) => setTimeout(resolve, intervalMs));
+    }
+  },
+
   async deleteKnowledge(id) {
     const url = `http://${SERVER_ORIGIN}/rag/knowledge/${encodeURIComponent(id)}`;
     const res = await fetch(url, { method: 'DELETE' });
@@ -1,5 +1,5 @@
 import React, { useState, useMemo, useEffect, useRef } from "react";
-import { fetchChatLogs } from "../API/ChatLogsApi";
+import { fetchChatLogs, fetchChatLogDays } from "../API/ChatLogsApi";
 
 // --- Mock API & Data ---
 const mockChatLogs = [
@@ -84,6 +84,22 @@ const formatDate = (dateString) => {
   });
 };
 
+/**
+ * Formats a date as the local calendar day the chat-log API filters on (e.g., 2024-06-28).
+ * @param {Date} date - The date.
+ * @returns {string} - The YYYY-MM-DD day.
+ */
+const toLocalDay = (date) => {
+  const month = String(date.getMonth() + 1).padStart(2, "0");
+  const day = String(date.getDate()).padStart(2, "0");
+  return `${date.getFullYear()}-${month}-${day}`;
+};
+
+// Browser timezone, so the server's days match the dates shown here
+const TIMEZONE = Intl.DateTimeFormat().resolvedOptions().timeZone;
+// How far back the date picker looks for days with conversations (the analytics API allows up to a year)
+const PICKER_DAYS = 366;
+
 // --- React Components ---
 
 /**
@@ -318,10 +334,18 @@ export default function App({ robot }) {
   const [error, setError] = useState(null);
   const [filterDate, setFilterDate] = useState("all");
   const [isPickerOpen, setIsPickerOpen] = useState(false);
+  const [nextAfter, setNextAfter] = useState(null);
+  const [isLoadingOlder, setIsLoadingOlder] = useState(false);
+  const [activityDays, setActivityDays] = useState([]);
   const chatContainerRef = useRef(null);
+  const keepScrollRef = useRef(false);
 
-  // Auto-scroll to bottom when logs change
+  // Auto-scroll to bottom when logs change (not when older pages are prepended)
   useEffect(() => {
+    if (keepScrollRef.current) {
+      keepScrollRef.current = false;
+      return;
+    }
     if (chatContainerRef.current && logs.length > 0) {
       const scrollToBottom = () => {
         chatContainerRef.current.scrollTop =
@@ -333,22 +357,78 @@ export default function App({ robot }) {
     }
   }, [logs, filterDate]);
 
+  // A picked date is queried on the server, so days beyond the loaded pages are reachable
+  const dateRange = useMemo(() => {
+    if (filterDate === "all") return { tz: TIMEZONE };
+    const day = toLocalDay(new Date(filterDate));
+    return { from: day, to: day, tz: TIMEZONE };
+  }, [filterDate]);
+
+  // Days with conversations for the date picker
   useEffect(() => {
-    fetchChatLogs(robot?.robotId)
+    setActivityDays([]);
+    if (!robot?.robotId) return;
+    const first = new Date();
+    first.setDate(first.getDate() - (PICKER_DAYS - 1));
+    fetchChatLogDays(robot.robotId, { from: toLocalDay(first), to: toLocalDay(new Date()), tz: TIMEZONE })
+      .then((series) => {
+        setActivityDays(
+          series
+            .filter((entry) => entry.count > 0)
+            .map((entry) => {
+              const [year, month, day] = entry.bucket.slice(0, 10).split("-").map(Number);
+              return new Date(year, month - 1, day).toISOString();
+            })
+        );
+      })
+      .catch((err) => {
+        // The picker falls back to the dates of the loaded logs
+        console.error("Fetch Error:", err);
+      });
+  }, [robot?.robotId]);
+
+  useEffect(() => {
+    let cancelled = false; // ignore a response that arrives after another date was picked
+    setIsLoading(true);
+    fetchChatLogs(robot?.robotId, dateRange)
       .then((data) => {
-        setLogs(data);
+        if (cancelled) return;
+        setError(null);
+        setLogs(data.logs);
+        setNextAfter(data.next_after);
         setIsLoading(false);
       })
       .catch((err) => {
+        if (cancelled) return;
         console.error("Fetch Error:", err);
         setError("Failed to load chat logs. Displaying sample data.");
         setLogs(mockChatLogs); // fallback
+        setNextAfter(null);
         setIsLoading(false);
       });
-  }, [robot?.robotId]);
+    return () => {
+      cancelled = true;
+    };
+  }, [robot?.robotId, dateRange]);
+
+  const loadOlder = () => {
+    setIsLoadingOlder(true);
+    fetchChatLogs(robot?.robotId, { ...dateRange, after: nextAfter })
+      .then((data) => {
+        keepScrollRef.current = true;
+        setLogs((prev) => [...prev, ...data.logs]);
+        setNextAfter(data.next_after);
+      })
+      .catch((err) => {
+        console.error("Fetch Error:", err);
+        setError("Failed to load older chat logs.");
+      })
+      .finally(() => setIsLoadingOlder(false));
+  };
 
+  // The fallback sample data is not filtered by the server
   const filteredLogs = useMemo(() => {
-    if (filterDate === "all") {
+    if (filterDate === "all" || logs !== mockChatLogs) {
       return logs;
     }
     const selectedDate = new Date(filterDate);
@@ -359,11 +439,14 @@ export default function App({ robot }) {
   }, [logs, filterDate]);
 
   const availableDates = useMemo(() => {
-    const dates = new Set(logs.map((log) => new Date(log.time).toDateString()));
+    const dates = new Set([
+      ...activityDays.map((isoDate) => new Date(isoDate).toDateString()),
+      ...logs.map((log) => new Date(log.time).toDateString()),
+    ]);
     return Array.from(dates)
       .map((dateStr) => new Date(dateStr).toISOString())
       .sort((a, b) => new Date(b) - new Date(a));
-  }, [logs]);
+  }, [activityDays, logs]);
 
   const groupedLogs = useMemo(() => {
     return filteredLogs.reduce((acc, log) => {
@@ -372,8 +455,8 @@ export default function App({ robot }) {
         acc[date] = [];
       }
       // Create separate entries for input and response to treat them as distinct messages
-      acc[date].push({ ...log, type: "input", msgId: `${log.id}-input` });
-      acc[date].push({ ...log, type: "response", msgId: `${log.id}-response` });
+      acc[date].push({ ...log, type: "input", msgId: `${log._id ?? log.id}-input` });
+      acc[date].push({ ...log, type: "response", msgId: `${log._id ?? log.id}-response` });
       return acc;
     }, {});
   }, [filteredLogs]);
@@ -454,6 +537,17 @@ export default function App({ robot }) {
         </div>
 
         <div ref={chatContainerRef} className="flex-1 p-4 overflow-y-auto">
+          {!isLoading && nextAfter && (
+            <div className="flex justify-center mb-4">
+              <button
+                onClick={loadOlder}
+                disabled={isLoadingOlder}
+                className="px-4 py-2 text-sm rounded-full bg-gray-100 text-gray-700 hover:bg-gray-200 disabled:opacity-50"
+              >
+                {isLoadingOlder ? "Loading..." : "Load older messages"}
+              </button>
+            </div>
+          )}
           {isLoading ? (
             <Loader />
           ) : Object.keys(groupedLogs).length > 0 ? (
@@ -53,6 +53,18 @@ const RagManager = ({ robot }) => {
     }
   };
 
+  // The list only carries metadata; fetch the full text when a document is opened
+  const handlePreview = async (item) => {
+    try {
+      setError(null);
+      setPreviewItem(item);
+      const doc = await ragApi.getKnowledge(item._id);
+      setPreviewItem((current) => (current?._id === item._id ? doc : current));
+    } catch (err) {
+      setError(err.message || "Failed to load document");
+    }
+  };
+
   const handleDelete = async (id) => {
     try {
       setError(null);
@@ -132,7 +144,7 @@ const RagManager = ({ robot }) => {
                       <div>
                         <button
                           type="button"
-                          onClick={() => setPreviewItem(item)}
+                          onClick={() => handlePreview(item)}
                           className="font-medium text-indigo-600 hover:underline text-left"
                           title="View document content"
                         >
@@ -176,7 +188,9 @@ const RagManager = ({ robot }) => {
             </div>
             <div className="p-5 overflow-auto">
               <div className="text-sm text-gray-800 whitespace-pre-wrap">
-                {previewItem.full_text || "No content available."}
+                {previewItem.full_text === undefined
+                  ? "Loading..."
+                  : previewItem.full_text || "No content available."}
               </div>
             </div>
           </div>
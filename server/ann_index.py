@@ -0,0 +1,192 @@
+# --- Approximate nearest-neighbour backends for RobotVectorIndex ---
+# An ANN index only proposes candidate row labels; RobotVectorIndex re-scores them exactly against its matrix.
+import json
+import logging
+import os
+from typing import Dict, List
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class HnswAnnIndex:
+    """HNSW graph via hnswlib (optional dependency: pip install hnswlib)."""
+    name = "hnsw"
+
+    def __init__(self, dim: int, M: int = 16, ef_construction: int = 200, ef_search: int = 64, capacity: int = 1024, path: str | None = None):
+        import hnswlib
+        self.dim = dim
+        self.ef_search = ef_search
+        self.index = hnswlib.Index(space="ip", dim=dim)  # rows are L2-normalized, so inner product == cosine
+        if path is None:
+            self.index.init_index(max_elements=max(capacity, 16), ef_construction=ef_construction, M=M, allow_replace_deleted=True)
+        else:
+            self.index.load_index(path, allow_replace_deleted=True)
+        self.index.set_ef(ef_search)
+        self.live = 0
+
+    def __len__(self) -> int:
+        return self.live
+
+    def add(self, vectors: np.ndarray, labels: np.ndarray) -> None:
+        if len(labels) == 0:
+            return
+        needed = self.index.get_current_count() + len(labels)
+        if needed > self.index.get_max_elements():
+            self.index.resize_index(max(needed, 2 * self.index.get_max_elements()))
+        self.index.add_items(vectors, labels, replace_deleted=True)
+        self.live += len(labels)
+
+    def remove(self, labels: np.ndarray) -> None:
+        for label in labels:
+            self.index.mark_deleted(int(label))
+        self.live -= len(labels)
+
+    def candidates(self, query: np.ndarray, n: int) -> np.ndarray:
+        n = min(n, self.live)
+        if n <= 0:
+            return np.empty(0, dtype=np.int64)
+        self.index.set_ef(max(self.ef_search, n))
+        labels, _ = self.index.knn_query(query, k=n)
+        return labels[0].astype(np.int64)
+
+    def save(self, path: str) -> None:
+        self.index.save_index(path)
+
+    @classmethod
+    def load(cls, path: str, dim: int, live: int, **params) -> "HnswAnnIndex":
+        ann = cls(dim, path=path, **params)
+        ann.live = live
+        return ann
+
+
+class IvfAnnIndex:
+    """Inverted file over spherical k-means centroids (numpy only). Probes the nprobe closest lists."""
+    name = "ivf"
+    MIN_TRAIN = 256  # below this there is nothing to gain; candidates() returns None and search stays exact
+
+    def __init__(self, dim: int, nprobe: int = 8, nlist: int | None = None):
+        self.dim = dim
+        self.nprobe = nprobe
+        self.nlist = nlist
+        self.centroids: np.ndarray | None = None
+        self.lists: List[set] = []
+        self.assignment: Dict[int, int] = {}  # label -> list
+        self._untrained: Dict[int, np.ndarray] = {}  # vectors seen before training
+
+    def __len__(self) -> int:
+        return len(self.assignment) + len(self._untrained)
+
+    def _train(self, vectors: np.ndarray, iterations: int = 10) -> None:
+        nlist = self.nlist or max(1, int(np.sqrt(len(vectors))))
+        rng = np.random.default_rng(0)
+        centroids = vectors[rng.choice(len(vectors), nlist, replace=False)].copy()
+        for _ in range(iterations):
+            assign = np.argmax(vectors @ centroids.T, axis=1)
+            for c in range(nlist):
+                members = vectors[assign == c]
+                if len(members):
+                    centroid = members.sum(axis=0)
+                    centroids[c] = centroid / (np.linalg.norm(centroid) or 1.0)
+        self.centroids = centroids.astype(np.float32)
+        self.lists = [set() for _ in range(nlist)]
+
+    def _assign(self, vectors: np.ndarray, labels: np.ndarray) -> None:
+        for label, c in zip(labels.tolist(), np.argmax(vectors @ self.centroids.T, axis=1).tolist()):
+            self.lists[c].add(label)
+            self.assignment[label] = c
+
+    def add(self, vectors: np.ndarray, labels: np.ndarray) -> None:
+        if self.centroids is not None:
+            self._assign(vectors, labels)
+            return
+        self._untrained.update(zip(labels.tolist(), vectors))
+        if len(self._untrained) >= self.MIN_TRAIN:
+            pending_labels = np.fromiter(self._untrained.keys(), dtype=np.int64, count=len(self._untrained))
+            pending = np.vstack(list(self._untrained.values()))
+            self._untrained = {}
+            self._train(pending)
+            self._assign(pending, pending_labels)
+
+    def remove(self, labels: np.ndarray) -> None:
+        for label in labels.tolist():
+            self._untrained.pop(label, None)
+            c = self.assignment.pop(label, None)
+            if c is not None:
+                self.lists[c].discard(label)
+
+    def candidates(self, query: np.ndarray, n: int) -> np.ndarray | None:
+        if self.centroids is None:
+            return None
+        probes = np.argsort(self.centroids @ query)[::-1][:self.nprobe]
+        found = [label for c in probes for label in self.lists[c]]
+        return np.fromiter(found, dtype=np.int64, count=len(found))
+
+    def save(self, path: str) -> None:
+        labels = np.fromiter(self.assignment.keys(), dtype=np.int64, count=len(self.assignment))
+        lists = np.fromiter(self.assignment.values(), dtype=np.int64, count=len(self.assignment))
+        with open(path, "wb") as f:  # np.savez would append .npz to a bare path
+            np.savez(f, centroids=self.centroids if self.centroids is not None else np.empty((0, self.dim), np.float32),
+                     labels=labels, lists=lists)
+
+    @classmethod
+    def load(cls, path: str, dim: int, live: int, **params) -> "IvfAnnIndex":
+        ann = cls(dim, **params)
+        with np.load(path) as data:
+            if len(data["centroids"]) == 0:
+                raise ValueError("IVF index was saved before training")
+            ann.centroids = data["centroids"]
+            ann.lists = [set() for _ in range(len(ann.centroids))]
+            for label, c in zip(data["labels"].tolist(), data["lists"].tolist()):
+                ann.lists[c].add(label)
+                ann.assignment[label] = c
+        return ann
+
+
+ANN_BACKENDS = {HnswAnnIndex.name: HnswAnnIndex, IvfAnnIndex.name: IvfAnnIndex}
+
+
+def make_ann(backend: str, dim: int, capacity: int = 1024, **params):
+    """New empty ANN index, or None for exact search."""
+    if backend == "exact":
+        return None
+    if backend not in ANN_BACKENDS:
+        raise ValueError(f"Unknown vector index backend: {backend}")
+    if backend == "hnsw":
+        params["capacity"] = capacity
+    return ANN_BACKENDS[backend](dim, **params)
+
+
+def save_ann(ann, path_prefix: str, keys: Dict[int, str]) -> None:
+    """Write the ANN structure plus a label -> chunk key manifest. The old manifest is removed first and the new one
+    written last, so a manifest only ever describes the structure file next to it."""
+    os.makedirs(os.path.dirname(path_prefix) or ".", exist_ok=True)
+    try:
+        os.remove(f"{path_prefix}.json")
+    except FileNotFoundError:
+        pass
+    data_path = f"{path_prefix}.{ann.name}"
+    ann.save(f"{data_path}.tmp")
+    os.replace(f"{data_path}.tmp", data_path)
+    manifest = {"backend": ann.name, "dim": ann.dim, "keys": {str(label): key for label, key in keys.items()}}
+    with open(f"{path_prefix}.json.tmp", "w", encoding="utf-8") as f:
+        json.dump(manifest, f)
+    os.replace(f"{path_prefix}.json.tmp", f"{path_prefix}.json")
+
+
+def load_ann(backend: str, dim: int, path_prefix: str, **params):
+    """Return (ann, {chunk key: label}) from disk, or (None, None) when missing or built for another backend/dimension."""
+    try:
+        with open(f"{path_prefix}.json", "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        if manifest.get("backend") != backend or manifest.get("dim") != dim:
+            return None, None
+        keys = {key: int(label) for label, key in manifest["keys"].items()}
+        ann = ANN_BACKENDS[backend].load(f"{path_prefix}.{backend}", dim, len(keys), **params)
+        return ann, keys
+    except FileNotFoundError:
+        return None, None
+    except Exception as e:
+        logger.warning(f"Could not load ANN index {path_prefix}: {e}; rebuilding")
+        return None, None
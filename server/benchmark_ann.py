@@ -0,0 +1,84 @@
+# --- ANN vs exact retrieval benchmark ---
+# Compares exact scoring with the ANN backends of ann_index.py on stored chunk vectors (or a synthetic clustered
+# corpus): build time, recall@k against exact top-k, and mean/p95 query latency.
+#
+#   python benchmark_ann.py [--backends hnsw ivf] [--k 3] [--synthetic 100000 --dim 1024]
+import argparse
+import os
+import random
+import time
+
+import numpy as np
+
+from ann_index import make_ann
+from benchmark_embedding_dims import load_corpus
+from vector_index import RobotVectorIndex
+
+
+def synthetic_corpus(n: int, dim: int, clusters: int = 200) -> list[dict]:
+    rng = np.random.default_rng(0)
+    centers = rng.standard_normal((clusters, dim)).astype(np.float32)
+    vectors = centers[rng.integers(0, clusters, n)] + 0.5 * rng.standard_normal((n, dim)).astype(np.float32)
+    return [{"chunk_id": str(i), "content": "", "embedding": v} for i, v in enumerate(vectors)]
+
+
+def run(index: RobotVectorIndex, queries: list[np.ndarray], k: int) -> tuple[list[set], np.ndarray]:
+    results, latencies = [], []
+    for q in queries:
+        start = time.perf_counter()
+        hits = index.search(q, k)
+        latencies.append((time.perf_counter() - start) * 1000)
+        results.append({row.chunk_id for row, _ in hits})
+    return results, np.asarray(latencies)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recall@k and latency of ANN backends against exact search")
+    parser.add_argument("--backends", nargs="+", default=["hnsw", "ivf"])
+    parser.add_argument("--k", type=int, default=3)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--model", default=os.getenv("EMBEDDING_MODEL", "text-embedding-3-large"))
+    parser.add_argument("--dim", type=int, default=int(os.getenv("EMBEDDING_DIMENSIONS", 0)) or None, help="truncate vectors (Matryoshka)")
+    parser.add_argument("--limit", type=int, default=200000)
+    parser.add_argument("--synthetic", type=int, help="use N random clustered vectors instead of MongoDB")
+    parser.add_argument("--hnsw-m", type=int, default=int(os.getenv("HNSW_M", 16)))
+    parser.add_argument("--hnsw-ef-construction", type=int, default=int(os.getenv("HNSW_EF_CONSTRUCTION", 200)))
+    parser.add_argument("--hnsw-ef-search", type=int, default=int(os.getenv("HNSW_EF_SEARCH", 64)))
+    parser.add_argument("--ivf-nprobe", type=int, default=int(os.getenv("IVF_NPROBE", 8)))
+    args = parser.parse_args()
+
+    chunks = synthetic_corpus(args.synthetic, args.dim or 1024) if args.synthetic else load_corpus(args.model, args.limit)
+    if not chunks:
+        print(f"No stored vectors for model {args.model}")
+        return
+    corpus = [{"_id": "corpus", "chunks": chunks}]
+    exact = RobotVectorIndex.from_documents(corpus, args.dim)
+    rng = random.Random(0)
+    # Perturbed corpus vectors, so queries are near but not identical to stored chunks
+    queries = [exact.matrix[rng.randrange(len(exact))] + np.float32(0.05) * np.random.default_rng(i).standard_normal(exact.dim).astype(np.float32)
+               for i in range(args.queries)]
+    baseline, latencies = run(exact, queries, args.k)
+
+    params = {
+        "hnsw": {"M": args.hnsw_m, "ef_construction": args.hnsw_ef_construction, "ef_search": args.hnsw_ef_search},
+        "ivf": {"nprobe": args.ivf_nprobe},
+    }
+    print(f"{len(exact)} chunks x {exact.dim} dims, {len(queries)} queries, k={args.k}\n")
+    print(f"{'backend':<8} {'build s':>8} {'recall@' + str(args.k):>10} {'mean ms':>8} {'p95 ms':>8}")
+    print(f"{'exact':<8} {0:>8.2f} {1:>10.3f} {latencies.mean():>8.3f} {np.percentile(latencies, 95):>8.3f}")
+    for backend in args.backends:
+        index = RobotVectorIndex.from_documents(corpus, args.dim)
+        start = time.perf_counter()
+        try:
+            index.attach_ann(make_ann(backend, index.dim, capacity=len(index), **params[backend]))
+        except ImportError as e:
+            print(f"{backend:<8} unavailable: {e}")
+            continue
+        build_s = time.perf_counter() - start
+        results, latencies = run(index, queries, args.k)
+        recall = sum(len(r & b) for r, b in zip(results, baseline)) / sum(len(b) for b in baseline)
+        print(f"{backend:<8} {build_s:>8.2f} {recall:>10.3f} {latencies.mean():>8.3f} {np.percentile(latencies, 95):>8.3f}")
+
+
+if __name__ == "__main__":
+    main()
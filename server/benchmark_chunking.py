@@ -0,0 +1,69 @@
+# --- Chunking benchmark ---
+# Compares the legacy character chunker, the recursive splitter ingest_database.py used, and the shared
+# token-aware chunker on a directory of PDFs. Counts tokens locally; no embedding API calls are made.
+#
+#   python benchmark_chunking.py [pdf_dir] [--price-per-million 0.13]
+import argparse
+import os
+import time
+from typing import Callable, List
+
+import fitz  # PyMuPDF for PDF text extraction
+
+from chunking import DEFAULT_MAX_TOKENS, DEFAULT_OVERLAP_TOKENS, chunk_text_by_chars, count_tokens, iter_chunks
+
+
+def load_pages(path: str) -> List[str]:
+    with fitz.open(path) as doc:
+        return [page.get_text("text") for page in doc]
+
+
+def recursive_splitter() -> Callable[[List[str]], List[str]] | None:
+    try:
+        from langchain_text_splitters import RecursiveCharacterTextSplitter
+    except ImportError:
+        return None
+    splitter = RecursiveCharacterTextSplitter(chunk_size=500, chunk_overlap=150, length_function=len, is_separator_regex=False)
+    return lambda pages: [c for page in pages for c in splitter.split_text(page)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare chunk counts and embedding cost of the RAG chunkers")
+    parser.add_argument("pdf_dir", nargs="?", default="data")
+    parser.add_argument("--max-tokens", type=int, default=int(os.getenv("CHUNK_MAX_TOKENS", DEFAULT_MAX_TOKENS)))
+    parser.add_argument("--overlap-tokens", type=int, default=int(os.getenv("CHUNK_OVERLAP_TOKENS", DEFAULT_OVERLAP_TOKENS)))
+    parser.add_argument("--price-per-million", type=float, default=0.13, help="USD per 1M embedding tokens (text-embedding-3-large)")
+    args = parser.parse_args()
+
+    files = sorted(f for f in os.listdir(args.pdf_dir) if f.lower().endswith(".pdf"))
+    if not files:
+        print(f"No PDFs found in {args.pdf_dir}")
+        return
+    documents = [load_pages(os.path.join(args.pdf_dir, f)) for f in files]
+    source_tokens = sum(count_tokens("\n".join(pages)) for pages in documents)
+
+    strategies = {
+        "chars 500/100 (old upload path)": lambda pages: chunk_text_by_chars("\n".join(pages).strip(), 500, 100),
+        f"tokens {args.max_tokens}/{args.overlap_tokens} (shared chunker)": lambda pages: [
+            c.content for c in iter_chunks(enumerate(pages, 1), args.max_tokens, args.overlap_tokens)
+        ],
+    }
+    recursive = recursive_splitter()
+    if recursive is not None:
+        strategies["recursive 500/150 (old ingest_database.py)"] = recursive
+
+    print(f"{len(files)} PDFs, {sum(len(p) for p in documents)} pages, {source_tokens} source tokens\n")
+    print(f"{'strategy':<45} {'chunks':>8} {'tokens':>10} {'max':>6} {'overhead':>9} {'cost $':>9} {'ms':>8}")
+    for name, chunker in strategies.items():
+        start = time.perf_counter()
+        chunks = [c for pages in documents for c in chunker(pages)]
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        tokens = [count_tokens(c) for c in chunks]
+        total = sum(tokens)
+        overhead = total / source_tokens - 1 if source_tokens else 0.0
+        cost = total / 1_000_000 * args.price_per_million
+        print(f"{name:<45} {len(chunks):>8} {total:>10} {max(tokens, default=0):>6} {overhead:>8.1%} {cost:>9.4f} {elapsed_ms:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
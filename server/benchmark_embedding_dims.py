@@ -0,0 +1,85 @@
+# --- Reduced-dimension recall benchmark ---
+# Measures how well truncated (Matryoshka) embeddings reproduce full-dimension retrieval on stored chunk vectors:
+# recall@k against the full-size top-k, index memory and scoring time per query for each candidate dimension.
+# Queries are sampled chunk vectors (the chunk itself is excluded), or real questions from --questions
+# (one embedding API call for the whole file).
+#
+#   python benchmark_embedding_dims.py [--dims 256 512 1024] [--k 3] [--questions questions.txt]
+import argparse
+import os
+import random
+import time
+
+import numpy as np
+from dotenv import find_dotenv, load_dotenv
+from pymongo import MongoClient
+
+from embedding_format import decode_embedding
+from vector_index import RobotVectorIndex
+
+load_dotenv(find_dotenv(), override=True)
+
+
+def load_corpus(model: str, limit: int) -> list[dict]:
+    client = MongoClient(os.getenv("MONGODB_URI"))
+    store = client[os.getenv("MONGODB_DBNAME", "michi_robot")][os.getenv("EMBEDDINGS_COLLECTION", "chunk_embeddings")]
+    chunks = []
+    for doc in store.find({"model": model}, {"embedding": 1, "dtype": 1, "scale": 1}).limit(limit):
+        vec = decode_embedding(doc)
+        if vec is not None:
+            chunks.append({"chunk_id": doc["_id"], "content": "", "embedding": vec})
+    client.close()
+    return chunks
+
+
+def embed_questions(path: str, model: str) -> list[np.ndarray]:
+    from langchain_openai import OpenAIEmbeddings
+    with open(path, encoding="utf-8") as f:
+        questions = [line.strip() for line in f if line.strip()]
+    return [np.asarray(v, dtype=np.float32) for v in OpenAIEmbeddings(model=model).embed_documents(questions)]
+
+
+def top_ids(index: RobotVectorIndex, query: np.ndarray, k: int, exclude: str | None) -> list[str]:
+    return [row.chunk_id for row, _ in index.search(query, k + 1) if row.chunk_id != exclude][:k]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recall of reduced-dimension embeddings against the full-size baseline")
+    parser.add_argument("--model", default=os.getenv("EMBEDDING_MODEL", "text-embedding-3-large"), help="full-size vectors to read from the store")
+    parser.add_argument("--dims", type=int, nargs="+", default=[256, 512, 1024])
+    parser.add_argument("--k", type=int, default=3)
+    parser.add_argument("--queries", type=int, default=200, help="chunk vectors sampled as queries")
+    parser.add_argument("--questions", help="text file with one question per line, embedded once at full size")
+    parser.add_argument("--limit", type=int, default=50000, help="max chunk vectors to load")
+    args = parser.parse_args()
+
+    chunks = load_corpus(args.model, args.limit)
+    if not chunks:
+        print(f"No stored vectors for model {args.model}")
+        return
+    corpus = [{"_id": "corpus", "chunks": chunks}]
+    full = RobotVectorIndex.from_documents(corpus)
+    if args.questions:
+        queries = [(q, None) for q in embed_questions(args.questions, args.model)]
+    else:
+        sample = random.Random(0).sample(chunks, min(args.queries, len(chunks)))
+        queries = [(c["embedding"], c["chunk_id"]) for c in sample]
+    baseline = [top_ids(full, q, args.k, exclude) for q, exclude in queries]
+
+    print(f"{len(full)} chunks, {len(queries)} queries, full dimension {full.dim}\n")
+    print(f"{'dim':>6} {'recall@' + str(args.k):>10} {'memory MB':>10} {'ms/query':>9}")
+    for dim in sorted(set(args.dims + [full.dim])):
+        if dim > full.dim:
+            continue
+        index = full if dim == full.dim else RobotVectorIndex.from_documents(corpus, dim)
+        hits = 0
+        start = time.perf_counter()
+        for (q, exclude), expected in zip(queries, baseline):
+            hits += len(set(top_ids(index, q[:dim], args.k, exclude)) & set(expected))
+        elapsed_ms = (time.perf_counter() - start) * 1000 / len(queries)
+        recall = hits / sum(len(e) for e in baseline) if baseline else 0.0
+        print(f"{dim:>6} {recall:>10.3f} {index.matrix.nbytes / 1e6:>10.1f} {elapsed_ms:>9.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -2,35 +2,58 @@
 import asyncio
 import aiofiles
 from quart import Quart, request, jsonify, Response 
-from motor.motor_asyncio import AsyncIOMotorClient
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorGridFSBucket
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError
+from gridfs.errors import NoFile
+from pymongo.monitoring import ConnectionPoolListener
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
 
 # --- Standard library imports ---
 import os
 import json
 import logging
-import tempfile
-from contextlib import asynccontextmanager 
 from pathlib import Path
 import time
 import datetime
-from typing import Generator, Tuple, List, AsyncGenerator
+from typing import Generator, Tuple, List, AsyncIterator
+import io
 import uuid
 import pytz
+import hashlib
+import shutil
+import random
+import re
+import threading
+import socket
+import contextvars
+from collections import OrderedDict, Counter
 
 # --- Third-party library imports ---
-from rapidfuzz import fuzz
+import numpy as np
+from rapidfuzz import fuzz, process
 from langchain_openai import ChatOpenAI, OpenAIEmbeddings
 from langchain_core.documents import Document
 from dotenv import load_dotenv
-import fitz  # PyMuPDF for PDF text extraction
 from elevenlabs.client import ElevenLabs
 # --- Use AsyncOpenAI client ---
 from openai import AsyncOpenAI, OpenAIError 
 import paho.mqtt.client as mqtt
 from pydub import AudioSegment
+from pydub.silence import detect_leading_silence
 from quart_cors import cors # Use quart_cors for cross origin server
 from gtts import gTTS  # Fallback only for ElevenLabs TTS
 
+# --- Local modules ---
+from vector_index import RobotVectorIndex
+from ann_index import load_ann, make_ann, save_ann
+from lexical_index import BM25Index, query_terms
+from pdf_extraction import aiter_pdf_pages
+from chunking import Chunk, StreamingChunker, count_tokens
+from chat_analytics import rollup_updates, summarize_hours, top_questions_pipeline
+from embedding_format import content_hash, decode_embedding, encode_embedding, model_key, query_dimensions
+
 
 # --- Centralized Configuration Class ---
 class Config:
@@ -53,7 +76,120 @@ class Config:
     MONGODB_URI = os.getenv("MONGODB_URI")
     MONGODB_DBNAME = os.getenv("MONGODB_DBNAME", "michi_robot")
     MONGODB_COLLECTION = os.getenv("MONGODB_COLLECTION", "chat_logs")
+    # Buffered chat-log writer: entries are queued and written with insert_many every batch/interval
+    CHAT_LOG_QUEUE_SIZE = int(os.getenv("CHAT_LOG_QUEUE_SIZE", 1000))
+    CHAT_LOG_BATCH_SIZE = int(os.getenv("CHAT_LOG_BATCH_SIZE", 50))
+    CHAT_LOG_FLUSH_INTERVAL = float(os.getenv("CHAT_LOG_FLUSH_INTERVAL", 2.0))
+    CHAT_LOG_OVERFLOW = os.getenv("CHAT_LOG_OVERFLOW", "drop").lower()  # drop | block (wait up to CHAT_LOG_BLOCK_TIMEOUT, then drop)
+    CHAT_LOG_BLOCK_TIMEOUT = float(os.getenv("CHAT_LOG_BLOCK_TIMEOUT", 1.0))
+    # /api/chat-logs: page size (default / upper bound) and the timezone log times are rendered in
+    CHAT_LOGS_PAGE_SIZE = int(os.getenv("CHAT_LOGS_PAGE_SIZE", 100))
+    CHAT_LOGS_MAX_PAGE_SIZE = int(os.getenv("CHAT_LOGS_MAX_PAGE_SIZE", 1000))
+    CHAT_LOGS_TIMEZONE = os.getenv("CHAT_LOGS_TIMEZONE", "Asia/Jakarta")
+    # Hourly/daily rollups maintained by the chat-log writer for /api/chat-logs/analytics
+    CHAT_LOG_ROLLUP_COLLECTION = os.getenv("CHAT_LOG_ROLLUP_COLLECTION", "chat_log_rollups")
+    CHAT_ANALYTICS_DEFAULT_DAYS = int(os.getenv("CHAT_ANALYTICS_DEFAULT_DAYS", 7))
+    CHAT_ANALYTICS_MAX_DAYS = int(os.getenv("CHAT_ANALYTICS_MAX_DAYS", 366))
     VECTOR_DB_COLLECTION = os.getenv("VECTOR_DB_COLLECTION", "vector_db")
+    # Shared MongoDB client / connection pool (timeouts in ms; 0 socket timeout = none)
+    MONGODB_MAX_POOL_SIZE = int(os.getenv("MONGODB_MAX_POOL_SIZE", 50))
+    MONGODB_MIN_POOL_SIZE = int(os.getenv("MONGODB_MIN_POOL_SIZE", 0))
+    MONGODB_MAX_IDLE_TIME_MS = int(os.getenv("MONGODB_MAX_IDLE_TIME_MS", 300000))
+    MONGODB_CONNECT_TIMEOUT_MS = int(os.getenv("MONGODB_CONNECT_TIMEOUT_MS", 10000))
+    MONGODB_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv("MONGODB_SERVER_SELECTION_TIMEOUT_MS", 10000))
+    MONGODB_SOCKET_TIMEOUT_MS = int(os.getenv("MONGODB_SOCKET_TIMEOUT_MS", 0))
+    MONGODB_WAIT_QUEUE_TIMEOUT_MS = int(os.getenv("MONGODB_WAIT_QUEUE_TIMEOUT_MS", 0))
+    MONGODB_READ_PREFERENCE = os.getenv("MONGODB_READ_PREFERENCE", "primary")
+    EMBEDDINGS_COLLECTION = os.getenv("EMBEDDINGS_COLLECTION", "chunk_embeddings")  # content-addressed chunk vectors
+    EMBEDDING_STORAGE_DTYPE = os.getenv("EMBEDDING_STORAGE_DTYPE", "float32").lower()  # float32 | float16 | int8
+    EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "text-embedding-3-large")
+    EMBEDDING_DIMENSIONS = int(os.getenv("EMBEDDING_DIMENSIONS", 0)) or None  # e.g. 256/512/1024; empty or 0 = full size
+
+    # Wake-word detection: "cloud" (Whisper) or "local" (silence gate + offline STT, Whisper only when uncertain)
+    WAKEWORD_MODE = os.getenv("WAKEWORD_MODE", "cloud").lower()
+    WAKEWORD_LOCAL_BACKEND = os.getenv("WAKEWORD_LOCAL_BACKEND", "vosk")
+    WAKEWORD_LOCAL_MODEL = os.getenv("WAKEWORD_LOCAL_MODEL", "models/vosk-model-small-en-us-0.15")
+    WAKEWORD_CLOUD_FALLBACK = os.getenv("WAKEWORD_CLOUD_FALLBACK", "YES").upper() == "YES"
+    WAKEWORD_SILENCE_DBFS = float(os.getenv("WAKEWORD_SILENCE_DBFS", -45))
+    WAKEWORD_MIN_SPEECH_MS = int(os.getenv("WAKEWORD_MIN_SPEECH_MS", 150))
+    WAKEWORD_LOCAL_ACCEPT = float(os.getenv("WAKEWORD_LOCAL_ACCEPT", 90))
+    WAKEWORD_LOCAL_REJECT = float(os.getenv("WAKEWORD_LOCAL_REJECT", 60))
+
+    # Trim/downmix/resample/re-encode /process_input audio before Whisper
+    AUDIO_PREPROCESS = os.getenv("AUDIO_PREPROCESS", "YES").upper() == "YES"
+    AUDIO_PREPROCESS_SILENCE_DBFS = float(os.getenv("AUDIO_PREPROCESS_SILENCE_DBFS", -40))
+    AUDIO_PREPROCESS_PADDING_MS = int(os.getenv("AUDIO_PREPROCESS_PADDING_MS", 200))
+    AUDIO_PREPROCESS_FORMAT = os.getenv("AUDIO_PREPROCESS_FORMAT", "mp3")
+    AUDIO_PREPROCESS_BITRATE = os.getenv("AUDIO_PREPROCESS_BITRATE", "32k")
+
+    # Batched document embedding for RAG uploads
+    EMBED_BATCH_TOKENS = int(os.getenv("EMBED_BATCH_TOKENS", 20000))
+    EMBED_BATCH_CHUNKS = int(os.getenv("EMBED_BATCH_CHUNKS", 128))
+    EMBED_CONCURRENCY = int(os.getenv("EMBED_CONCURRENCY", 2))
+    EMBED_MAX_RETRIES = int(os.getenv("EMBED_MAX_RETRIES", 4))
+    EMBED_BATCH_TIMEOUT = float(os.getenv("EMBED_BATCH_TIMEOUT", 60))
+
+    # Background RAG ingestion jobs
+    RAG_JOBS_COLLECTION = os.getenv("RAG_JOBS_COLLECTION", "rag_jobs")
+    RAG_INGEST_WORKERS = int(os.getenv("RAG_INGEST_WORKERS", 2))
+    PDF_PROCESS_WORKERS = int(os.getenv("PDF_PROCESS_WORKERS", 2))
+    RAG_JOB_LEASE_SECONDS = int(os.getenv("RAG_JOB_LEASE_SECONDS", 120))  # a running job whose owner missed heartbeats this long is taken over
+    PDF_PAGES_PER_TASK = int(os.getenv("PDF_PAGES_PER_TASK", 8))
+
+    # Token-aware chunking (shared with ingest_database.py)
+    CHUNK_MAX_TOKENS = int(os.getenv("CHUNK_MAX_TOKENS", 128))
+    CHUNK_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", 32))
+
+    # Per-robot retrieval index: "exact" scoring, or an ANN backend ("hnsw" needs hnswlib, "ivf" is numpy only)
+    VECTOR_INDEX_BACKEND = os.getenv("VECTOR_INDEX_BACKEND", "exact").lower()
+    VECTOR_INDEX_PATH = os.getenv("VECTOR_INDEX_PATH", "vector_indexes")  # persisted ANN indexes; empty = rebuild on load
+    VECTOR_ANN_MIN_CHUNKS = int(os.getenv("VECTOR_ANN_MIN_CHUNKS", 5000))
+    HNSW_M = int(os.getenv("HNSW_M", 16))
+    HNSW_EF_CONSTRUCTION = int(os.getenv("HNSW_EF_CONSTRUCTION", 200))
+    HNSW_EF_SEARCH = int(os.getenv("HNSW_EF_SEARCH", 64))
+    IVF_NPROBE = int(os.getenv("IVF_NPROBE", 8))
+
+    # Hybrid retrieval: BM25 over chunk text fused with vector results (reciprocal rank fusion)
+    HYBRID_RETRIEVAL = os.getenv("HYBRID_RETRIEVAL", "YES").upper() == "YES"
+    HYBRID_CANDIDATES = int(os.getenv("HYBRID_CANDIDATES", 4))  # per-ranker candidates = k * this
+    HYBRID_RRF_K = int(os.getenv("HYBRID_RRF_K", 60))
+    HYBRID_KEYWORD_MAX_TERMS = int(os.getenv("HYBRID_KEYWORD_MAX_TERMS", 3))  # keyword-only retrieval (no query embedding) up to this many terms
+    KEYWORD_RELEVANCE_THRESHOLD = float(os.getenv("KEYWORD_RELEVANCE_THRESHOLD", 0.5))  # query-term coverage a keyword-only hit needs
+
+    # Follow vector_db change streams so multiple replicas keep retrieval indexes in sync (needs a replica set)
+    VECTOR_CHANGE_STREAM = os.getenv("VECTOR_CHANGE_STREAM", "NO").upper() == "YES"
+
+    # Query embedding cache (empty path = memory only)
+    QUERY_CACHE_SIZE = int(os.getenv("QUERY_CACHE_SIZE", 2048))
+    QUERY_CACHE_TTL = float(os.getenv("QUERY_CACHE_TTL", 7 * 24 * 3600))
+    QUERY_CACHE_PATH = os.getenv("QUERY_CACHE_PATH", "")
+
+    # Semantic response cache for "talk" answers
+    RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "YES").upper() == "YES"
+    RESPONSE_CACHE_THRESHOLD = float(os.getenv("RESPONSE_CACHE_THRESHOLD", 0.95))
+    RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", 1000))
+    RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", 3600))
+    RESPONSE_CACHE_ROBOT_QUOTA = int(os.getenv("RESPONSE_CACHE_ROBOT_QUOTA", 200))
+    RESPONSE_CACHE_AUDIO_BUDGET_MB = float(os.getenv("RESPONSE_CACHE_AUDIO_BUDGET_MB", 32))  # TTS audio kept with cached answers
+
+    # Local intent fast path (fuzzy phrase tables, optional embedding centroids) before the LLM
+    INTENT_FAST_PATH = os.getenv("INTENT_FAST_PATH", "YES").upper() == "YES"
+    INTENT_FUZZY_THRESHOLD = float(os.getenv("INTENT_FUZZY_THRESHOLD", 0.88))
+    INTENT_CENTROID_ENABLED = os.getenv("INTENT_CENTROID_ENABLED", "NO").upper() == "YES"
+    INTENT_CENTROID_THRESHOLD = float(os.getenv("INTENT_CENTROID_THRESHOLD", 0.55))
+    INTENT_CENTROID_MARGIN = float(os.getenv("INTENT_CENTROID_MARGIN", 0.08))
+
+    # Start retrieval alongside intent classification and discard it for non-"talk" intents
+    SPECULATIVE_RETRIEVAL = os.getenv("SPECULATIVE_RETRIEVAL", "YES").upper() == "YES"
+
+    # Stream LLM sentences into TTS and serve /audio_response while synthesis is still running
+    STREAMING_TTS = os.getenv("STREAMING_TTS", "NO").upper() == "YES"
+    STREAMING_MIN_SENTENCE_CHARS = int(os.getenv("STREAMING_MIN_SENTENCE_CHARS", 20))
+
+    # In-memory response audio store (spills least-recently-used audio to disk above the budget)
+    AUDIO_STORE_BUDGET_MB = float(os.getenv("AUDIO_STORE_BUDGET_MB", 64))
+    AUDIO_STORE_TTL = float(os.getenv("AUDIO_STORE_TTL", 900))
+    AUDIO_SPILL_FOLDER = os.getenv("AUDIO_SPILL_FOLDER", os.path.join(UPLOAD_FOLDER, "audio_spill"))
 
 # --- Logging Configuration ---
 logging.basicConfig(
@@ -77,9 +213,27 @@ openai_client = AsyncOpenAI(api_key=Config.OPENAI_API_KEY)
 elevenlabs_client = ElevenLabs(api_key=Config.ELEVENLABS_API_KEY)
 
 # Timer class for measuring execution time
+# Per-turn latency breakdown (stage -> ms) logged with the chat entry; tasks spawned within a turn share the dict
+turn_timings: contextvars.ContextVar[dict | None] = contextvars.ContextVar("turn_timings", default=None)
+turn_started: contextvars.ContextVar[float | None] = contextvars.ContextVar("turn_started", default=None)
+
+def begin_turn() -> None:
+    """Start collecting stage timings for the current request (and the tasks it spawns)."""
+    turn_timings.set({})
+    turn_started.set(time.time())
+
+def turn_latency() -> dict:
+    """Stage timings of the current turn plus its total so far, in ms."""
+    timings = dict(turn_timings.get() or {})
+    started = turn_started.get()
+    if started is not None:
+        timings["total"] = round((time.time() - started) * 1000, 1)
+    return timings
+
 class Timer:
-    def __init__(self, process_name: str):
+    def __init__(self, process_name: str, metric: str | None = None):
         self.process_name = process_name
+        self.metric = metric  # also add the duration to turn_timings under this stage name
         self.start_time = None
 
     def __enter__(self):
@@ -90,57 +244,961 @@ class Timer:
     def __exit__(self, exc_type, exc_val, exc_tb):
         duration = time.time() - self.start_time
         logger.info(f"Process '{self.process_name}' completed in {duration:.2f} seconds")
+        timings = turn_timings.get()
+        if self.metric is not None and timings is not None:
+            timings[self.metric] = round(timings.get(self.metric, 0.0) + duration * 1000, 1)
 
 # Main application class
 class Main:
     def __init__(self):
         with Timer("Main initialization"):
             self.llm = ChatOpenAI(temperature=Config.LLM_TEMPERATURE, model=Config.LLM_MODEL) # LLM Model
-            self.embeddings_model = OpenAIEmbeddings(model="text-embedding-3-large") # Embedding Model
-            self.retriever = MongoEmbeddingRetriever(self.embeddings_model) # Retriever backed by MongoDB-stored embeddings
-            self.intent_classifier = IntentClassifier(self.llm) # Intent classifier setup
-            self.mqtt_client = MQTTClient(Config.MQTT_BROKER, Config.MQTT_PORT, Config.MQTT_TOPIC) # MQTT client setup
-            self.mqtt_client.connect() # MQTT connection setup
-            self.current_audio_files = {}
+            self.embeddings_model = OpenAIEmbeddings(model=Config.EMBEDDING_MODEL, dimensions=Config.EMBEDDING_DIMENSIONS) # Embedding Model
+            self.mongo = MongoConnection() # One MongoDB client/pool for every component, opened in before_serving
+            self.query_cache = QueryEmbeddingCache(self.embeddings_model, Config.QUERY_CACHE_SIZE, Config.QUERY_CACHE_TTL, Config.QUERY_CACHE_PATH) # Cached query embeddings
+            self.embedding_store = EmbeddingStore(self.mongo, model_key(Config.EMBEDDING_MODEL, Config.EMBEDDING_DIMENSIONS)) # Chunk vectors shared across documents by content hash
+            self.retriever = MongoEmbeddingRetriever(
+                self.mongo, self.query_cache, self.embedding_store, query_dimensions(Config.EMBEDDING_MODEL, Config.EMBEDDING_DIMENSIONS), Config.EMBEDDING_MODEL
+            ) # Retriever backed by MongoDB-stored embeddings
+            self.response_cache = SemanticResponseCache(
+                Config.RESPONSE_CACHE_THRESHOLD, Config.RESPONSE_CACHE_SIZE, Config.RESPONSE_CACHE_TTL, Config.RESPONSE_CACHE_ROBOT_QUOTA,
+                int(Config.RESPONSE_CACHE_AUDIO_BUDGET_MB * 1024 * 1024)
+            ) if Config.RESPONSE_CACHE_ENABLED else None # Answers (and their TTS) for near-identical questions
+            self.document_embedder = BatchedEmbedder(self.embeddings_model) # Batched, bounded document embedding; finished batches are stored as they complete
+            self.intent_classifier = IntentClassifier(self.llm, self.query_cache) # Intent classifier setup
+            self.mqtt_client = MQTTClient(Config.MQTT_BROKER, Config.MQTT_PORT, Config.MQTT_TOPIC) # MQTT client setup, connected in before_serving
+            self.audio_store = AudioResponseStore(int(Config.AUDIO_STORE_BUDGET_MB * 1024 * 1024), Config.AUDIO_STORE_TTL, Config.AUDIO_SPILL_FOLDER) # robot_id -> latest response audio
+            self.audio_streams: dict[str, StreamingAudioBuffer] = {}  # robot_id -> in-progress streamed response
+            self.wakeword_detector = LocalWakeWordDetector(Config.WAKEWORD_LOCAL_BACKEND, Config.WAKEWORD_LOCAL_MODEL) if Config.WAKEWORD_MODE == "local" else None
+            self.audio_preprocessor = AudioPreprocessor() if Config.AUDIO_PREPROCESS else None
+            self.speculation_stats = {"started": 0, "used": 0, "cancelled": 0, "discarded": 0, "wasted_seconds": 0.0}
 
             try:
-                self.db_logger = MongoLogger()
+                self.db_logger = MongoLogger(
+                    self.mongo, Config.CHAT_LOG_QUEUE_SIZE, Config.CHAT_LOG_BATCH_SIZE, Config.CHAT_LOG_FLUSH_INTERVAL,
+                    Config.CHAT_LOG_OVERFLOW, Config.CHAT_LOG_BLOCK_TIMEOUT
+                )
             except Exception as e:
                 logger.warning(f"Could not initialize DatabaseLogger. Continuing without DB logging. Error: {e}")
                 self.db_logger = None
 
             try:
-                self.knowledge_store = VectorKnowledgeStore()
+                self.knowledge_store = VectorKnowledgeStore(self.mongo)
             except Exception as e:
                 logger.warning(f"Could not initialize VectorKnowledgeStore. Continuing without RAG store. Error: {e}")
                 self.knowledge_store = None
 
-            
+            self.ingestion_queue = RagIngestionQueue(
+                self.knowledge_store, self.document_embedder, self.embedding_store, self.retriever
+            ) if self.knowledge_store is not None else None
+
+
+
+class QueryEmbeddingCache:
+    """Bounded LRU + TTL cache in front of embeddings_model.aembed_query, keyed on (model, normalized text)."""
+
+    def __init__(self, embeddings_model: OpenAIEmbeddings, max_size: int = 2048, ttl: float = 7 * 24 * 3600, persist_path: str = ""):
+        self.embeddings_model = embeddings_model
+        self.model_name = model_key(getattr(embeddings_model, "model", "unknown"), getattr(embeddings_model, "dimensions", None))
+        self.max_size = max_size
+        self.ttl = ttl
+        self.persist_path = persist_path
+        self._entries: OrderedDict[str, Tuple[float, List[float]]] = OrderedDict()  # key -> (stored_at, vector)
+        self._inflight: dict[str, asyncio.Task] = {}  # coalesces concurrent misses for the same key
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def normalize(text: str) -> str:
+        text = re.sub(r"\s+", " ", text.strip().lower())
+        return text.rstrip(" ?!.,")
+
+    def _key(self, text: str) -> str:
+        return f"{self.model_name}::{self.normalize(text)}"
+
+    def _get(self, key: str) -> List[float] | None:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        stored_at, vector = entry
+        if time.time() - stored_at > self.ttl:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return vector
+
+    def _put(self, key: str, vector: List[float], stored_at: float | None = None) -> None:
+        self._entries[key] = (stored_at or time.time(), vector)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def peek(self, text: str) -> List[float] | None:
+        """Cached vector without embedding on a miss (not counted in hit/miss stats)."""
+        return self._get(self._key(text))
+
+    async def aembed_query(self, text: str) -> List[float]:
+        key = self._key(text)
+        vector = self._get(key)
+        if vector is not None:
+            self.hits += 1
+            return vector
+        task = self._inflight.get(key)
+        if task is not None:
+            self.hits += 1
+        else:
+            self.misses += 1
+            # The request runs in its own task, so a cancelled caller (e.g. a client that disconnected) does not
+            # cancel it for the other callers waiting on the same key; every caller only shields its own wait
+            task = asyncio.create_task(self._afetch(key, text))
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())  # retrieved even if every caller left
+            self._inflight[key] = task
+        return await asyncio.shield(task)
+
+    async def _afetch(self, key: str, text: str) -> List[float]:
+        try:
+            vector = await self.embeddings_model.aembed_query(text)
+            self._put(key, vector)
+            return vector
+        finally:
+            self._inflight.pop(key, None)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+        }
+
+    def load(self) -> None:
+        """Load persisted entries, skipping expired ones and other models. Blocking; run it off the event loop."""
+        if not self.persist_path:
+            return
+        try:
+            with np.load(self.persist_path) as data:
+                keys, stored, vectors = data["keys"], data["stored_at"], data["vectors"]
+        except FileNotFoundError:
+            return
+        except Exception as e:
+            logger.warning(f"Could not load query embedding cache from {self.persist_path}: {e}")
+            return
+        now = time.time()
+        for key, stored_at, vector in zip(keys.tolist(), stored.tolist(), vectors):
+            if key.startswith(f"{self.model_name}::") and now - stored_at <= self.ttl:
+                self._put(key, vector.tolist(), stored_at)
+        logger.info(f"Loaded {len(self._entries)} cached query embeddings from {self.persist_path}")
+
+    def save(self) -> None:
+        """Persist as float32 arrays (npz) rather than JSON text: ~12 KB per 3072-dim vector instead of ~60 KB."""
+        if not self.persist_path:
+            return
+        entries = list(self._entries.items())  # one model, so every vector has the same size
+        tmp_path = f"{self.persist_path}.tmp"
+        with open(tmp_path, "wb") as f:  # np.savez would append .npz to a bare path
+            np.savez(
+                f,
+                keys=np.array([k for k, _ in entries], dtype=str),
+                stored_at=np.array([t for _, (t, _) in entries], dtype=np.float64),
+                vectors=np.array([v for _, (_, v) in entries], dtype=np.float32) if entries else np.empty((0, 0), np.float32),
+            )
+        os.replace(tmp_path, self.persist_path)  # atomic so a crash never leaves a torn file
+        logger.info(f"Saved {len(entries)} cached query embeddings to {self.persist_path}")
+
+class CachedResponse:
+    """A stored answer plus the ElevenLabs audio synthesized for it (attached after TTS, dropped first when over budget)."""
+    __slots__ = ("entry_id", "robot_id", "query_vec", "chunk_ids", "answer", "audio", "created_at")
+
+    def __init__(self, entry_id: int, robot_id: str, query_vec: np.ndarray, chunk_ids: frozenset, answer: str):
+        self.entry_id = entry_id
+        self.robot_id = robot_id
+        self.query_vec = query_vec
+        self.chunk_ids = chunk_ids
+        self.answer = answer
+        self.audio: bytes | None = None
+        self.created_at = time.time()
+
+class SemanticResponseCache:
+    """Per-robot answer cache: a hit needs cosine(query) >= threshold and the same retrieved chunk ids."""
+
+    def __init__(self, threshold: float = 0.95, max_entries: int = 1000, ttl: float = 3600, per_robot_quota: int = 200,
+                 audio_budget: int = 32 * 1024 * 1024):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.per_robot_quota = per_robot_quota
+        self.audio_budget = audio_budget
+        self.audio_bytes = 0
+        self._entries: OrderedDict[int, CachedResponse] = OrderedDict()  # global LRU order
+        self._by_robot: dict[str, OrderedDict[int, CachedResponse]] = {}  # per-robot LRU order
+        self._next_id = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.audio_evictions = 0
+
+    def _evict(self, entry_id: int) -> None:
+        entry = self._entries.pop(entry_id, None)
+        if entry is None:
+            return
+        if entry.audio is not None:
+            self.audio_bytes -= len(entry.audio)
+        robot_entries = self._by_robot.get(entry.robot_id)
+        if robot_entries is not None:
+            robot_entries.pop(entry_id, None)
+            if not robot_entries:
+                del self._by_robot[entry.robot_id]
+        self.evictions += 1
+
+    def lookup(self, robot_id: str, query_vec, chunk_ids: frozenset) -> CachedResponse | None:
+        robot_entries = self._by_robot.get(robot_id)
+        if not robot_entries:
+            self.misses += 1
+            return None
+        now = time.time()
+        for entry_id in [i for i, e in robot_entries.items() if now - e.created_at > self.ttl]:
+            self._evict(entry_id)
+        candidates = [(i, e) for i, e in self._by_robot.get(robot_id, {}).items() if e.chunk_ids == chunk_ids]
+        if not candidates:
+            self.misses += 1
+            return None
+        q = np.asarray(query_vec, dtype=np.float32)
+        q_norm = float(np.linalg.norm(q))
+        if q_norm == 0:
+            self.misses += 1
+            return None
+        scores = np.stack([e.query_vec for _, e in candidates]) @ (q / q_norm)
+        best = int(np.argmax(scores))
+        if scores[best] < self.threshold:
+            self.misses += 1
+            return None
+        entry_id, entry = candidates[best]
+        self._entries.move_to_end(entry_id)
+        self._by_robot[robot_id].move_to_end(entry_id)
+        self.hits += 1
+        logger.info(f"Response cache hit for {robot_id} (similarity {scores[best]:.3f})")
+        return entry
+
+    def store(self, robot_id: str, query_vec, chunk_ids: frozenset, answer: str) -> CachedResponse | None:
+        q = np.asarray(query_vec, dtype=np.float32)
+        q_norm = float(np.linalg.norm(q))
+        if q_norm == 0:
+            return None
+        entry_id = self._next_id
+        self._next_id += 1
+        entry = CachedResponse(entry_id, robot_id, q / q_norm, chunk_ids, answer)
+        self._entries[entry_id] = entry
+        robot_entries = self._by_robot.setdefault(robot_id, OrderedDict())
+        robot_entries[entry_id] = entry
+        while len(robot_entries) > self.per_robot_quota:
+            self._evict(next(iter(robot_entries)))
+        while len(self._entries) > self.max_entries:
+            self._evict(next(iter(self._entries)))
+        return entry
+
+    def attach_audio(self, entry: CachedResponse, audio: bytes) -> None:
+        """Keep an answer's TTS audio within the byte budget, dropping the audio (not the answer) of the least recently
+        used entries first; audio larger than the whole budget is not kept."""
+        if len(audio) > self.audio_budget or self._entries.get(entry.entry_id) is not entry:
+            return  # too large, or evicted while its audio was being synthesized
+        if entry.audio is not None:
+            self.audio_bytes -= len(entry.audio)
+        entry.audio = audio
+        self.audio_bytes += len(audio)
+        for victim in self._entries.values():
+            if self.audio_bytes <= self.audio_budget:
+                break
+            if victim is not entry and victim.audio is not None:
+                self.audio_bytes -= len(victim.audio)
+                victim.audio = None
+                self.audio_evictions += 1
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "robots": len(self._by_robot),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "audio_bytes": self.audio_bytes,
+            "audio_budget": self.audio_budget,
+            "audio_evictions": self.audio_evictions,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+        }
+
+class AudioEntry:
+    """One stored response: bytes in memory, or a spill file path once evicted from the memory budget."""
+    __slots__ = ("data", "path", "size", "etag", "created_at")
+
+    def __init__(self, data: bytes):
+        self.data: bytes | None = data
+        self.path: str | None = None
+        self.size = len(data)
+        self.etag = f'"{hashlib.sha1(data).hexdigest()[:20]}"'
+        self.created_at = time.time()
+
+class AudioResponseStore:
+    """Keyed response-audio store: byte-budget LRU in memory, spilling to disk only when over budget.
+
+    Any object with aput/aget/aread/aremove/aclose can stand in for it (a budget of 0 keeps everything on disk).
+    """
+
+    def __init__(self, memory_budget: int = 64 * 1024 * 1024, ttl: float = 900, spill_folder: str = "uploads/audio_spill"):
+        self.memory_budget = memory_budget
+        self.ttl = ttl
+        # Other workers and replicas on this host spill into the same folder, so each process owns one subfolder
+        self.spill_root = spill_folder
+        self.spill_folder = os.path.join(spill_folder, f"{os.getpid()}-{uuid.uuid4().hex[:8]}")
+        self._entries: OrderedDict[str, AudioEntry] = OrderedDict()
+        self.memory_bytes = 0
+        self.spills = 0
+        self._swept = False
+
+    def _sweep_stale(self) -> None:
+        """Delete subfolders left by processes that did not shut down cleanly: untouched for longer than the TTL,
+        so any audio in them has expired everywhere."""
+        cutoff = time.time() - self.ttl
+        try:
+            folders = [e for e in os.scandir(self.spill_root) if e.is_dir() and e.path != self.spill_folder]
+        except FileNotFoundError:
+            return
+        for folder in folders:
+            try:
+                if folder.stat().st_mtime < cutoff:
+                    shutil.rmtree(folder.path, ignore_errors=True)
+            except OSError:
+                pass
+
+    async def _adrop(self, entry: AudioEntry) -> None:
+        if entry.data is not None:
+            self.memory_bytes -= entry.size
+        if entry.path is not None:
+            try:
+                await asyncio.to_thread(os.remove, entry.path)
+            except OSError as e:
+                logger.warning(f"Failed to delete spilled audio {entry.path}: {e}")
+
+    async def _aspill(self, entry: AudioEntry) -> None:
+        if not self._swept:
+            self._swept = True
+            await asyncio.to_thread(self._sweep_stale)
+        os.makedirs(self.spill_folder, exist_ok=True)
+        path = os.path.join(self.spill_folder, f"{uuid.uuid4().hex}.mp3")
+        async with aiofiles.open(path, "wb") as f:
+            await f.write(entry.data)
+        entry.path, entry.data = path, None
+        self.memory_bytes -= entry.size
+        self.spills += 1
+
+    async def _apurge_expired(self) -> None:
+        now = time.time()
+        for key in [k for k, e in self._entries.items() if now - e.created_at > self.ttl]:
+            await self._adrop(self._entries.pop(key))
+
+    async def aput(self, key: str, data: bytes) -> AudioEntry:
+        await self._apurge_expired()
+        old = self._entries.pop(key, None)
+        if old is not None:
+            await self._adrop(old)
+        entry = AudioEntry(data)
+        self._entries[key] = entry
+        self.memory_bytes += entry.size
+        # Spill least-recently-used in-memory entries (oldest first) until back under budget
+        for victim in list(self._entries.values()):
+            if self.memory_bytes <= self.memory_budget:
+                break
+            if victim.data is not None:
+                await self._aspill(victim)
+        return entry
+
+    async def aget(self, key: str) -> AudioEntry | None:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if time.time() - entry.created_at > self.ttl:
+            await self._adrop(self._entries.pop(key))
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    async def aread(self, entry: AudioEntry, start: int = 0, end: int | None = None) -> bytes:
+        """Returns bytes [start, end) of an entry from memory or its spill file (FileNotFoundError if it is gone)."""
+        end = entry.size if end is None else end
+        data = entry.data
+        if data is not None:
+            return data[start:end]
+        async with aiofiles.open(entry.path, "rb") as f:
+            await f.seek(start)
+            return await f.read(end - start)
+
+    async def aremove(self, key: str) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            await self._adrop(entry)
+
+    async def aclose(self) -> None:
+        self._entries.clear()
+        self.memory_bytes = 0
+        await asyncio.to_thread(shutil.rmtree, self.spill_folder, True)
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "memory_bytes": self.memory_bytes,
+            "memory_budget": self.memory_budget,
+            "spilled_entries": sum(1 for e in self._entries.values() if e.data is None),
+            "spills": self.spills,
+        }
+
+class BatchedEmbedder:
+    """Embeds document chunks in token/size-bounded batches with shared concurrency and per-batch retry."""
+
+    def __init__(self, embeddings_model: OpenAIEmbeddings, max_batch_tokens: int | None = None, max_batch_chunks: int | None = None,
+                 concurrency: int | None = None, max_retries: int | None = None, timeout: float | None = None):
+        self.embeddings_model = embeddings_model
+        self.max_batch_tokens = max_batch_tokens or Config.EMBED_BATCH_TOKENS
+        self.max_batch_chunks = max_batch_chunks or Config.EMBED_BATCH_CHUNKS
+        self.max_retries = max_retries if max_retries is not None else Config.EMBED_MAX_RETRIES
+        self.timeout = timeout or Config.EMBED_BATCH_TIMEOUT
+        # Shared by every upload, so ingestion can never hold more than this many embedding requests in flight
+        self._semaphore = asyncio.Semaphore(concurrency or Config.EMBED_CONCURRENCY)
+
+    def make_batches(self, texts: List[str]) -> List[Tuple[int, int]]:
+        """Split into [start, end) ranges bounded by max_batch_chunks and max_batch_tokens."""
+        batches: List[Tuple[int, int]] = []
+        start, tokens = 0, 0
+        for i, text in enumerate(texts):
+            n = count_tokens(text)
+            if i > start and (i - start >= self.max_batch_chunks or tokens + n > self.max_batch_tokens):
+                batches.append((start, i))
+                start, tokens = i, 0
+            tokens += n
+        if start < len(texts):
+            batches.append((start, len(texts)))
+        return batches
+
+    async def _aembed_batch(self, texts: List[str]) -> List[List[float]]:
+        for attempt in range(self.max_retries + 1):
+            try:
+                async with self._semaphore:
+                    return await asyncio.wait_for(self.embeddings_model.aembed_documents(texts), self.timeout)
+            except (OpenAIError, asyncio.TimeoutError) as e:
+                if attempt == self.max_retries:
+                    raise
+                delay = min(2 ** attempt, 30) + random.uniform(0, 1)
+                logger.warning(f"Embedding batch of {len(texts)} chunks failed ({e!r}); retry {attempt + 1}/{self.max_retries} in {delay:.1f}s")
+                await asyncio.sleep(delay)
+
+    async def aembed_documents(self, texts: List[str], progress_callback=None, batch_callback=None) -> List[List[float]]:
+        """Embed all texts in order. batch_callback(start, vectors) is awaited as each batch completes (e.g. to persist
+        it, so an interrupted upload resumes from there), then progress_callback(done_batches, total_batches)."""
+        batches = self.make_batches(texts)
+        done: dict[int, List[List[float]]] = {}
+
+        async def run(i: int, start: int, end: int):
+            done[i] = await self._aembed_batch(texts[start:end])
+            if batch_callback is not None:
+                await batch_callback(start, done[i])
+            if progress_callback is not None:
+                await progress_callback(len(done), len(batches))
+
+        with Timer(f"Batched embedding ({len(texts)} chunks, {len(batches)} batches)"):
+            tasks = [asyncio.create_task(run(i, start, end)) for i, (start, end) in enumerate(batches)]
+            try:
+                await asyncio.gather(*tasks)
+            except BaseException:
+                # One batch failed for good (or the job was cancelled): stop the others instead of leaving them
+                # holding the shared semaphore for a failed upload
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+                raise
+
+        return [vec for i in range(len(batches)) for vec in done[i]]
+
+class EmbeddingStore:
+    """Content-addressed chunk embeddings: one vector per (model, chunk text), reference-counted by vector_db documents."""
+
+    def __init__(self, mongo: "MongoConnection", model: str, storage_dtype: str | None = None):
+        self.mongo = mongo
+        self.model = model
+        self.storage_dtype = storage_dtype or Config.EMBEDDING_STORAGE_DTYPE
+        self.reused = 0
+        self.embedded = 0
+
+    @property
+    def collection(self):
+        return self.mongo.db[Config.EMBEDDINGS_COLLECTION]
+
+    def content_hash(self, text: str) -> str:
+        return content_hash(self.model, text)
+
+    async def aget_many(self, hashes: List[str]) -> dict[str, np.ndarray]:
+        vectors: dict[str, np.ndarray] = {}
+        unique = list(set(hashes))
+        for i in range(0, len(unique), 1000):
+            async for doc in self.collection.find({"_id": {"$in": unique[i:i + 1000]}}, {"embedding": 1, "dtype": 1, "scale": 1}):
+                vec = decode_embedding(doc)
+                if vec is not None:
+                    vectors[doc["_id"]] = vec
+        return vectors
+
+    async def aembed(self, texts: List[str], embedder: "BatchedEmbedder", progress_callback=None) -> Tuple[List[str], dict[str, np.ndarray]]:
+        """Hash texts and embed only the ones not stored yet. Returns (hashes, vectors by hash); nothing is referenced
+        until aretain, once the document using them is stored."""
+        hashes = [self.content_hash(t) for t in texts]
+        vectors = await self.aget_many(hashes)
+        missing = {h: t for h, t in zip(hashes, texts) if h not in vectors}
+        if missing:
+            missing_hashes = list(missing)
+
+            async def store_batch(start: int, batch: List[List[float]]):
+                # Persisted as soon as the batch is done, so a job resumed after a restart finds it with aget_many
+                try:
+                    await self.astore(dict(zip(missing_hashes[start:start + len(batch)], batch)))
+                except Exception as e:
+                    logger.warning(f"Could not store a batch of {len(batch)} chunk embeddings early: {e}")
+
+            new_vectors = await embedder.aembed_documents(list(missing.values()), progress_callback=progress_callback, batch_callback=store_batch)
+            vectors.update((h, np.asarray(v, dtype=np.float32)) for h, v in zip(missing.keys(), new_vectors))
+        self.reused += len(texts) - len(missing)
+        self.embedded += len(missing)
+        logger.info(f"Chunk embeddings: {len(texts) - len(missing)} reused, {len(missing)} embedded")
+        return hashes, vectors
+
+    async def astore(self, vectors: dict[str, List[float]]) -> None:
+        """Store vectors that are not referenced yet (refs 0); aretain takes the references later."""
+        now = datetime.datetime.utcnow()
+        await self.collection.bulk_write([
+            UpdateOne(
+                {"_id": h},
+                {"$setOnInsert": {"model": self.model, **encode_embedding(np.asarray(v, dtype=np.float32), self.storage_dtype), "refs": 0, "created_at": now}},
+                upsert=True,
+            )
+            for h, v in vectors.items()
+        ], ordered=False)
+
+    async def aretain(self, hashes: List[str], vectors: dict[str, np.ndarray]) -> None:
+        """Add one reference per hash, storing the vector if it is not there yet."""
+        # $setOnInsert carries the vector for every hash, so one collected by a concurrent release is simply re-created
+        now = datetime.datetime.utcnow()
+        await self.collection.bulk_write([
+            UpdateOne(
+                {"_id": h},
+                {"$inc": {"refs": n}, "$setOnInsert": {"model": self.model, **encode_embedding(vectors[h], self.storage_dtype), "created_at": now}},
+                upsert=True,
+            ) if h in vectors else UpdateOne({"_id": h}, {"$inc": {"refs": n}})
+            for h, n in Counter(hashes).items()
+        ], ordered=False)
+
+    async def arelease(self, hashes: List[str]) -> int:
+        """Drop one reference per hash and delete vectors nothing points to any more. Returns vectors deleted."""
+        counts = Counter(h for h in hashes if h)
+        if not counts:
+            return 0
+        await self.collection.bulk_write(
+            [UpdateOne({"_id": h}, {"$inc": {"refs": -n}}) for h, n in counts.items()], ordered=False
+        )
+        result = await self.collection.delete_many({"_id": {"$in": list(counts)}, "refs": {"$lte": 0}})
+        return result.deleted_count
+
+    async def ahydrate(self, docs: List[dict]) -> None:
+        """Set chunk["embedding"] to a float32 array for every chunk, from the store or from an older inline vector."""
+        hashes = [c["embedding_id"] for d in docs for c in (d.get("chunks") or []) if "embedding" not in c and c.get("embedding_id")]
+        vectors = await self.aget_many(hashes) if hashes else {}
+        for doc in docs:
+            for chunk in doc.get("chunks") or []:
+                if "embedding" in chunk:
+                    chunk["embedding"] = decode_embedding(chunk)  # inline list of doubles or Binary blob
+                elif chunk.get("embedding_id") in vectors:
+                    chunk["embedding"] = vectors[chunk["embedding_id"]]
+
+    def stats(self) -> dict:
+        total = self.reused + self.embedded
+        return {"reused": self.reused, "embedded": self.embedded, "reuse_rate": round(self.reused / total, 3) if total else 0.0}
+
+class MongoPoolMonitor(ConnectionPoolListener):
+    """Connection pool counters from PyMongo's monitoring events (called from driver threads, hence the lock)."""
 
-class MongoLogger:
     def __init__(self):
-        self.client = AsyncIOMotorClient(Config.MONGODB_URI)
-        self.db = self.client[Config.MONGODB_DBNAME]
-        self.collection = self.db[Config.MONGODB_COLLECTION]
+        self._lock = threading.Lock()
+        self._local = threading.local()  # checkout start time; started/finished events fire on the same thread
+        self.open = 0
+        self.in_use = 0
+        self.peak_in_use = 0
+        self.checkouts = 0
+        self.checkout_failures = 0
+        self.wait_ms_total = 0.0
+        self.wait_ms_max = 0.0
+        self.pool_clears = 0
+
+    # Events without a counter (the base class requires every handler)
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        with self._lock:
+            self.pool_clears += 1
+
+    def connection_created(self, event):
+        with self._lock:
+            self.open += 1
+
+    def connection_closed(self, event):
+        with self._lock:
+            self.open -= 1
+
+    def connection_check_out_started(self, event):
+        self._local.started = time.perf_counter()
+
+    def _waited_ms(self) -> float:
+        started = getattr(self._local, "started", None)
+        self._local.started = None
+        return (time.perf_counter() - started) * 1000 if started is not None else 0.0
+
+    def connection_check_out_failed(self, event):
+        waited = self._waited_ms()
+        with self._lock:
+            self.checkout_failures += 1
+            self.wait_ms_max = max(self.wait_ms_max, waited)
+
+    def connection_checked_out(self, event):
+        waited = self._waited_ms()
+        with self._lock:
+            self.checkouts += 1
+            self.in_use += 1
+            self.peak_in_use = max(self.peak_in_use, self.in_use)
+            self.wait_ms_total += waited
+            self.wait_ms_max = max(self.wait_ms_max, waited)
+
+    def connection_checked_in(self, event):
+        with self._lock:
+            self.in_use -= 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "open_connections": self.open,
+                "in_use": self.in_use,
+                "peak_in_use": self.peak_in_use,
+                "max_pool_size": Config.MONGODB_MAX_POOL_SIZE,
+                "utilization": round(self.in_use / Config.MONGODB_MAX_POOL_SIZE, 3) if Config.MONGODB_MAX_POOL_SIZE else None,
+                "checkouts": self.checkouts,
+                "checkout_failures": self.checkout_failures,
+                "avg_checkout_wait_ms": round(self.wait_ms_total / self.checkouts, 3) if self.checkouts else 0.0,
+                "max_checkout_wait_ms": round(self.wait_ms_max, 3),
+                "pool_clears": self.pool_clears,
+            }
+
+class MongoConnection:
+    """The process-wide AsyncIOMotorClient (one pool, one set of monitor threads), opened/closed with the Quart app."""
+
+    def __init__(self):
+        self.client: AsyncIOMotorClient | None = None
+        self.pool = MongoPoolMonitor()
+
+    def open(self) -> None:
+        if self.client is not None:
+            return
+        self.client = AsyncIOMotorClient(
+            Config.MONGODB_URI,
+            maxPoolSize=Config.MONGODB_MAX_POOL_SIZE,
+            minPoolSize=Config.MONGODB_MIN_POOL_SIZE,
+            maxIdleTimeMS=Config.MONGODB_MAX_IDLE_TIME_MS,
+            connectTimeoutMS=Config.MONGODB_CONNECT_TIMEOUT_MS,
+            serverSelectionTimeoutMS=Config.MONGODB_SERVER_SELECTION_TIMEOUT_MS,
+            socketTimeoutMS=Config.MONGODB_SOCKET_TIMEOUT_MS or None,
+            waitQueueTimeoutMS=Config.MONGODB_WAIT_QUEUE_TIMEOUT_MS or None,
+            readPreference=Config.MONGODB_READ_PREFERENCE,
+            event_listeners=[self.pool],
+        )
+        logger.info(f"MongoDB client opened (maxPoolSize={Config.MONGODB_MAX_POOL_SIZE}, readPreference={Config.MONGODB_READ_PREFERENCE})")
+
+    def close(self) -> None:
+        if self.client is not None:
+            self.client.close()
+            self.client = None
+            logger.info("MongoDB client closed")
+
+    @property
+    def db(self):
+        if self.client is None:
+            raise RuntimeError("MongoDB client is not open")
+        return self.client[Config.MONGODB_DBNAME]
+
+    def stats(self) -> dict:
+        return {"connected": self.client is not None, **self.pool.stats()}
+
+class MongoLogger:
+    """Buffers chat-log entries in a bounded queue; one background task writes them with insert_many and folds every
+    turn into the analytics rollups."""
+
+    def __init__(self, mongo: MongoConnection, max_queue: int = 1000, batch_size: int = 50, flush_interval: float = 2.0,
+                 overflow: str = "drop", block_timeout: float = 1.0):
+        self.mongo = mongo
+        self.batch_size = max(batch_size, 1)
+        self.flush_interval = flush_interval
+        self.overflow = overflow
+        self.block_timeout = block_timeout
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=max_queue)
+        self._flusher: asyncio.Task | None = None
+        self._closed = False
+        self.counts = {"queued": 0, "written": 0, "batches": 0, "dropped": 0, "failed": 0, "retries": 0, "rolled_up": 0, "rollup_failed": 0}
+        self.flush_ms_total = 0.0
+        self.flush_ms_max = 0.0
+
+    @property
+    def collection(self):
+        return self.mongo.db[Config.MONGODB_COLLECTION]
+
+    @property
+    def rollups(self):
+        return self.mongo.db[Config.CHAT_LOG_ROLLUP_COLLECTION]
+
+    def start(self) -> None:
+        self._closed = False
+        if self._flusher is None:
+            self._flusher = asyncio.create_task(self._aflush_loop())
+
+    async def astop(self) -> None:
+        """Stop accepting entries and write out everything still buffered."""
+        self._closed = True
+        if self._flusher is None:
+            return
+        await self._queue.put(None)  # sentinel: flush what is queued, then exit
+        await self._flusher
+        self._flusher = None
 
-    async def alog_interaction(self, question: str, answer: str, robot_id: str | None = None):
+    async def alog_interaction(self, question: str, answer: str, robot_id: str | None = None, intent: str | None = None,
+                               timings: dict | None = None) -> bool:
+        """Queue one entry; returns False when it was dropped (buffer full or writer stopped)."""
         # Get current time in Indonesian timezone (UTC+7)
         indonesia_tz = pytz.timezone('Asia/Jakarta')
         current_time = datetime.datetime.now(indonesia_tz)
         
+        from bson import ObjectId
         doc = {
+            "_id": ObjectId(),  # minted now rather than at flush, so _id order/time ranges match "time"
             "input": question,
             "response": answer,
             "time": current_time,
-            **({"robot_id": robot_id} if robot_id else {})
+            **({"robot_id": robot_id} if robot_id else {}),
+            **({"intent": intent} if intent else {}),
+            **({"latency_ms": dict(timings)} if timings else {}),
+        }
+        return await self._aenqueue(doc, True)
+
+    async def arecord_turn(self, robot_id: str | None, intent: str, timings: dict | None = None) -> bool:
+        """Count a turn that is not logged (non-talk intents) towards the analytics rollups only."""
+        doc = {
+            "time": datetime.datetime.now(datetime.timezone.utc),
+            **({"robot_id": robot_id} if robot_id else {}),
+            "intent": intent,
+            **({"latency_ms": dict(timings)} if timings else {}),
+        }
+        return await self._aenqueue(doc, False)
+
+    async def _aenqueue(self, doc: dict, persist: bool) -> bool:
+        robot_id = doc.get("robot_id")
+        if self._closed:
+            self.counts["dropped"] += 1
+            return False
+        try:
+            if self.overflow == "block":
+                # Backpressure: the request waits for room, but never longer than block_timeout
+                await asyncio.wait_for(self._queue.put((doc, persist)), self.block_timeout)
+            else:
+                self._queue.put_nowait((doc, persist))
+        except (asyncio.QueueFull, asyncio.TimeoutError):
+            self.counts["dropped"] += 1
+            logger.warning(f"Chat log buffer full ({self._queue.maxsize}); dropped entry for robot {robot_id}")
+            return False
+        self.counts["queued"] += 1
+        return True
+
+    async def aensure_indexes(self) -> None:
+        """Backs the per-robot, newest-first pagination of /api/chat-logs (time ranges are _id ranges) and the
+        per-robot rollup range reads."""
+        await self.collection.create_index([("robot_id", 1), ("_id", -1)])
+        await self.rollups.create_index([("robot_id", 1), ("kind", 1), ("bucket", 1)])
+
+    async def aanalytics(self, robot_id: str, start: datetime.datetime, end: datetime.datetime, granularity: str,
+                         tz: str, top: int) -> dict:
+        """Summary for [start, end) from the rollups; hourly buckets are UTC, so day totals hold for whole-hour offsets."""
+        first_hour = start.astimezone(datetime.timezone.utc).replace(minute=0, second=0, microsecond=0)
+        hours = self.rollups.find(
+            {"robot_id": robot_id, "kind": "hour", "bucket": {"$gte": first_hour, "$lt": end}},
+            {"_id": 0, "bucket": 1, "count": 1, "intents": 1, "latency": 1, "latency_sum": 1},
+        )
+        summary = summarize_hours(await hours.to_list(length=None), granularity, pytz.timezone(tz))
+        questions = await self.rollups.aggregate(top_questions_pipeline(robot_id, start, end, top)).to_list(length=None) if top else []
+        return {**summary, "top_questions": questions}
+
+    def iter_logs(self, robot_id: str, after: str | None = None, start: datetime.datetime | None = None,
+                  end: datetime.datetime | None = None, fields: List[str] | None = None, tz: str = "UTC", limit: int | None = None):
+        """Async cursor over a robot's logs, newest first, already projected and formatted by MongoDB."""
+        return self.collection.aggregate(chat_log_pipeline(robot_id, after, start, end, fields, tz, limit), batchSize=Config.CHAT_LOGS_PAGE_SIZE)
+
+    async def _aflush_loop(self) -> None:
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            first = await self._queue.get()
+            if first is None:
+                break
+            batch = [first]
+            deadline = loop.time() + self.flush_interval
+            # Fill the batch until it is full or the oldest entry has waited flush_interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+            try:
+                await self._awrite(batch)
+            except Exception as e:
+                # Keep the writer alive for the rest of the process; this batch is lost
+                self.counts["failed"] += len(batch)
+                logger.error(f"Chat log flush of {len(batch)} entries failed: {e}", exc_info=True)
+        # --- Shutdown: drain whatever is left (entries from blocked putters that got in after the sentinel) ---
+        rest = []
+        while not self._queue.empty():
+            item = self._queue.get_nowait()
+            if item is not None:
+                rest.append(item)
+        for i in range(0, len(rest), self.batch_size):
+            await self._awrite(rest[i:i + self.batch_size])
+
+    async def _awrite(self, batch: List[Tuple[dict, bool]]) -> None:
+        docs = [doc for doc, persist in batch if persist]
+        written = not docs or await self._ainsert(docs)
+        await self._arollup([doc for doc, persist in batch if written or not persist])
+
+    async def _ainsert(self, docs: List[dict], attempts: int = 3) -> bool:
+        for attempt in range(1, attempts + 1):
+            start = time.time()
+            try:
+                await self.collection.insert_many(docs, ordered=False)
+                error = None
+            except BulkWriteError as e:
+                # Entries an earlier attempt already wrote come back as duplicate _ids; any other error is retried
+                details = e.details or {}
+                duplicates_only = all(err.get("code") == 11000 for err in details.get("writeErrors", [])) and not details.get("writeConcernErrors")
+                error = None if duplicates_only else e
+            except Exception as e:
+                error = e
+            if error is None:
+                elapsed = (time.time() - start) * 1000
+                self.counts["written"] += len(docs)
+                self.counts["batches"] += 1
+                self.flush_ms_total += elapsed
+                self.flush_ms_max = max(self.flush_ms_max, elapsed)
+                return True
+            if attempt == attempts:
+                self.counts["failed"] += len(docs)
+                logger.error(f"Could not write {len(docs)} chat log entries: {error}")
+                return False
+            self.counts["retries"] += 1
+            logger.warning(f"Chat log write failed (attempt {attempt}/{attempts}): {error}")
+            await asyncio.sleep(0.5 * attempt)
+        return False
+
+    async def _arollup(self, events: List[dict]) -> None:
+        """Fold written turns into the analytics rollups. Not retried: $inc upserts are not idempotent."""
+        try:
+            updates = rollup_updates(events)  # inside the try: one malformed event must not end the flusher task
+            if not updates:
+                return
+            await self.rollups.bulk_write([UpdateOne(f, u, upsert=True) for f, u in updates], ordered=False)
+            self.counts["rolled_up"] += len(events)
+        except Exception as e:
+            self.counts["rollup_failed"] += len(events)
+            logger.warning(f"Could not update chat log rollups for {len(events)} turns: {e}")
+
+    def stats(self) -> dict:
+        batches = self.counts["batches"]
+        return {
+            **self.counts,
+            "buffered": self._queue.qsize(),
+            "max_queue": self._queue.maxsize,
+            "running": self._flusher is not None,
+            "avg_batch_size": round(self.counts["written"] / batches, 2) if batches else 0.0,
+            "avg_flush_ms": round(self.flush_ms_total / batches, 3) if batches else 0.0,
+            "max_flush_ms": round(self.flush_ms_max, 3),
         }
-        await self.collection.insert_one(doc)
+
+CHAT_LOG_FIELDS = ["input", "response", "time", "robot_id", "intent", "latency_ms"]
+
+def chat_log_pipeline(robot_id: str, after: str | None = None, start: datetime.datetime | None = None, end: datetime.datetime | None = None,
+                      fields: List[str] | None = None, tz: str = "UTC", limit: int | None = None) -> List[dict]:
+    """Newest-first page of chat logs: cursor and time range become one _id range on the (robot_id, _id) index,
+    and "time" is rendered as ISO-8601 in tz by $dateToString (legacy float timestamps included)."""
+    from bson import ObjectId
+    id_range = {}
+    upper = [ObjectId(after)] if after else []
+    if end is not None:
+        upper.append(ObjectId.from_datetime(end))
+    if upper:
+        id_range["$lt"] = min(upper)
+    if start is not None:
+        id_range["$gte"] = ObjectId.from_datetime(start)
+    match = {"robot_id": robot_id, **({"_id": id_range} if id_range else {})}
+
+    def iso(date):
+        # "+0700" -> "+07:00" so every browser parses it
+        offset = {"$dateToString": {"date": date, "format": "%z", "timezone": tz}}
+        return {"$concat": [
+            {"$dateToString": {"date": date, "format": "%Y-%m-%dT%H:%M:%S.%L", "timezone": tz}},
+            {"$substrCP": [offset, 0, 3]}, ":", {"$substrCP": [offset, 3, 2]},
+        ]}
+
+    projection: dict = {"_id": {"$toString": "$_id"}}
+    for field in fields or CHAT_LOG_FIELDS:
+        projection[field] = 1
+    if "time" in projection:
+        projection["time"] = {"$switch": {
+            "branches": [
+                {"case": {"$eq": [{"$type": "$time"}, "date"]}, "then": iso("$time")},
+                {"case": {"$isNumber": "$time"}, "then": iso({"$toDate": {"$multiply": ["$time", 1000]}})},
+            ],
+            "default": "$time",
+        }}
+    pipeline = [{"$match": match}, {"$sort": {"_id": -1}}]
+    if limit:
+        pipeline.append({"$limit": limit})
+    pipeline.append({"$project": projection})
+    return pipeline
 
 class VectorKnowledgeStore:
-    def __init__(self):
-        self.client = AsyncIOMotorClient(Config.MONGODB_URI)
-        self.db = self.client[Config.MONGODB_DBNAME]
-        self.collection = self.db[Config.VECTOR_DB_COLLECTION]
+    def __init__(self, mongo: MongoConnection):
+        self.mongo = mongo
+
+    @property
+    def db(self):
+        return self.mongo.db
+
+    @property
+    def collection(self):
+        return self.mongo.db[Config.VECTOR_DB_COLLECTION]
 
     async def ainsert_document(self, document: dict) -> str:
         result = await self.collection.insert_one(document)
@@ -151,107 +1209,740 @@ class VectorKnowledgeStore:
         result = await self.collection.delete_one({"_id": ObjectId(object_id)})
         return result.deleted_count
 
-    async def aget_document(self, object_id: str) -> dict | None:
+    async def aget_document(self, object_id: str, projection: dict | None = None) -> dict | None:
         from bson import ObjectId
-        doc = await self.collection.find_one({"_id": ObjectId(object_id)})
+        doc = await self.collection.find_one({"_id": ObjectId(object_id)}, projection)
         return doc
 
+    async def aensure_indexes(self) -> None:
+        """Indexes behind the per-robot index loads and the per-user/robot listings (newest first)."""
+        await self.collection.create_index([("robot_id", 1), ("uploaded_at", -1)])
+        await self.collection.create_index([("user_id", 1), ("uploaded_at", -1)])
+        await self.collection.create_index([("uploaded_at", -1)])
+        await self.collection.create_index("job_id", sparse=True)  # lets a resumed ingestion job find its stored document
+
     async def alist_documents(self, user_id: str | None = None, robot_id: str | None = None) -> List[dict]:
-        query = {**({"user_id": user_id} if user_id else {}), **({"robot_id": robot_id} if robot_id else {})}
-        cursor = self.collection.find(query).sort("uploaded_at", -1)
-        docs: List[dict] = []
-        async for doc in cursor:
-            doc["_id"] = str(doc["_id"])  # Convert ObjectId to string
-            if "chunks" in doc and isinstance(doc["chunks"], list):
-                doc["chunk_count"] = len(doc["chunks"])  # provide count only
-                doc.pop("chunks", None)  # remove heavy payload
-            docs.append(doc)
-        return docs
+        return await alist_knowledge_documents(self.collection, user_id, robot_id)
+
+async def alist_knowledge_documents(collection, user_id: str | None = None, robot_id: str | None = None) -> List[dict]:
+    """Listing metadata only: the chunk count is computed by MongoDB with $size, so neither chunks nor full_text leave the server."""
+    query = {**({"user_id": user_id} if user_id else {}), **({"robot_id": robot_id} if robot_id else {})}
+    pipeline = [
+        {"$match": query},
+        {"$sort": {"uploaded_at": -1}},
+        {"$project": {
+            "_id": {"$toString": "$_id"},
+            "user_id": 1,
+            "robot_id": 1,
+            "filename": 1,
+            "uploaded_at": 1,
+            "embedding_model": 1,
+            "embedding_dim": 1,
+            "chunk_count": {"$size": {"$ifNull": ["$chunks", []]}},
+        }},
+    ]
+    return [doc async for doc in collection.aggregate(pipeline)]
+
 class MongoEmbeddingRetriever:
-    def __init__(self, embeddings_model: OpenAIEmbeddings):
+    def __init__(self, mongo: MongoConnection, embeddings_model: "OpenAIEmbeddings | QueryEmbeddingCache", embedding_store: EmbeddingStore,
+                 dim: int | None = None, model: str | None = None):
+        self.mongo = mongo
         self.embeddings_model = embeddings_model
-        self.client = AsyncIOMotorClient(Config.MONGODB_URI)
-        self.db = self.client[Config.MONGODB_DBNAME]
-        self.collection = self.db[Config.VECTOR_DB_COLLECTION]
+        self.embedding_store = embedding_store
+        self.dim = dim  # query vector size; longer stored vectors are truncated to it, shorter ones left out
+        self.model = model  # base model of the query vectors; documents embedded with another model are left out
+        if dim is None:
+            logger.warning("Unknown embedding size for this model; set EMBEDDING_DIMENSIONS so indexes match the query vectors")
+        self.index_backend = Config.VECTOR_INDEX_BACKEND
+        self._indexes: dict[str, RobotVectorIndex] = {}  # robot_id -> resident index (MongoDB stays source of truth)
+        self._lexical: dict[str, BM25Index] = {}  # robot_id -> BM25 index over the same chunks (hybrid retrieval)
+        self.search_counts = {"vector": 0, "hybrid": 0, "keyword": 0}
+        self._index_locks: dict[str, asyncio.Lock] = {}
+        self._pending: dict[str, list] = {}  # writes seen while an index is loading, replayed once it is ready
+        self._watch_task: asyncio.Task | None = None
+
+    @property
+    def collection(self):
+        return self.mongo.db[Config.VECTOR_DB_COLLECTION]
+
+    async def aget_index(self, robot_id: str | None = None) -> RobotVectorIndex:
+        """Return the resident index for a robot, loading it from MongoDB on first use."""
+        key = robot_id or "__all__"
+        index = self._indexes.get(key)
+        if index is not None:
+            return index
+        lock = self._index_locks.setdefault(key, asyncio.Lock())
+        async with lock:
+            index = self._indexes.get(key)
+            if index is None:
+                self._pending[key] = []
+                try:
+                    with Timer(f"Vector index load ({key})"):
+                        docs = await self.aload_chunks(robot_id)
+                        await self.embedding_store.ahydrate(docs)
+                        index = await asyncio.to_thread(self._build_index, key, docs)
+                        await asyncio.to_thread(self._save_ann, key, index)
+                        lexical = await asyncio.to_thread(BM25Index.from_documents, docs) if Config.HYBRID_RETRIEVAL else None
+                    for op, doc_id, chunks in self._pending[key]:
+                        for target in (index, lexical):
+                            if target is None:
+                                continue
+                            if op == "add":
+                                target.add_document(doc_id, chunks)
+                            else:
+                                target.remove_document(doc_id)
+                finally:
+                    self._pending.pop(key, None)
+                if lexical is not None:
+                    self._lexical[key] = lexical
+                self._indexes[key] = index
+                logger.info(f"Loaded vector index for {key}: {len(index)} chunks")
+        return index
+
+    async def aload_chunks(self, robot_id: str | None = None) -> List[dict]:
+        """Index-load fetch: one small record per chunk via $unwind, with only the fields the indexes need
+        (full_text and the other chunks' payloads never travel), regrouped as {"_id", "chunks"} documents."""
+        match = {"robot_id": robot_id} if robot_id else {}
+        # Documents from another model, or embedded at a smaller size than the queries, live in a different vector
+        # space (older documents record neither and are kept)
+        compatible = []
+        if self.model is not None:
+            compatible.append({"$or": [{"embedding_model": {"$exists": False}}, {"embedding_model": {"$regex": f"^{re.escape(self.model)}(@|$)"}}]})
+        if self.dim is not None:
+            compatible.append({"$or": [{"embedding_dim": {"$exists": False}}, {"embedding_dim": {"$gte": self.dim}}]})
+        if compatible:
+            match["$and"] = compatible
+        pipeline = [
+            {"$match": match},
+            {"$project": {"chunks": 1}},
+            {"$unwind": "$chunks"},
+            {"$project": {
+                "chunk_id": "$chunks.chunk_id",
+                "content": "$chunks.content",
+                "embedding_id": "$chunks.embedding_id",
+                "embedding": "$chunks.embedding",  # only documents from before the embedding store have it
+                "dtype": "$chunks.dtype",
+                "scale": "$chunks.scale",
+            }},
+        ]
+        docs: dict[str, dict] = {}
+        async for chunk in self.collection.aggregate(pipeline, batchSize=1000):
+            doc_id = chunk.pop("_id")
+            docs.setdefault(doc_id, {"_id": doc_id, "chunks": []})["chunks"].append(chunk)
+        return list(docs.values())
+
+    def _ann_params(self) -> dict:
+        if self.index_backend == "hnsw":
+            return {"M": Config.HNSW_M, "ef_construction": Config.HNSW_EF_CONSTRUCTION, "ef_search": Config.HNSW_EF_SEARCH}
+        return {"nprobe": Config.IVF_NPROBE}
+
+    def _ann_path(self, key: str) -> str | None:
+        if not Config.VECTOR_INDEX_PATH:
+            return None
+        digest = hashlib.sha1(f"{key}\x00{self.embedding_store.model}".encode("utf-8")).hexdigest()[:8]
+        return os.path.join(Config.VECTOR_INDEX_PATH, f"{re.sub(r'[^A-Za-z0-9_.-]', '_', key)}-{digest}")
+
+    def _build_index(self, key: str, docs: List[dict]) -> RobotVectorIndex:
+        """Worker thread: stack the matrix and attach the ANN index, reusing the persisted one where possible."""
+        index = RobotVectorIndex.from_documents(docs, self.dim)
+        if self.index_backend == "exact" or index.dim is None:
+            return index
+        path = self._ann_path(key)
+        try:
+            ann, saved_keys = load_ann(self.index_backend, index.dim, path, **self._ann_params()) if path else (None, None)
+            if ann is None:
+                ann = make_ann(self.index_backend, index.dim, capacity=2 * len(index), **self._ann_params())
+            index.attach_ann(ann, saved_keys)
+        except ImportError as e:
+            logger.error(f"Vector index backend '{self.index_backend}' unavailable ({e}); using exact search")
+            self.index_backend = "exact"
+        index.ann_min_rows = Config.VECTOR_ANN_MIN_CHUNKS
+        return index
+
+    def _save_ann(self, key: str, index: RobotVectorIndex) -> None:
+        path = self._ann_path(key)
+        if index.ann is None or not index.ann_dirty or path is None:
+            return
+        try:
+            with Timer(f"ANN index save ({key})"):
+                save_ann(index.ann, path, index.ann_keys())
+            index.ann_dirty = False
+        except Exception as e:
+            logger.warning(f"Could not persist ANN index for {key}: {e}")
+
+    async def asave_indexes(self) -> None:
+        """Persist ANN indexes changed by uploads/deletes since they were loaded (call once writes have stopped)."""
+        for key, index in list(self._indexes.items()):
+            await asyncio.to_thread(self._save_ann, key, index)
+
+    def stats(self) -> dict:
+        return {
+            "backend": self.index_backend,
+            "hybrid": Config.HYBRID_RETRIEVAL,
+            "searches": dict(self.search_counts),
+            "indexes": {
+                key: {"chunks": len(index), "ann": index.ann is not None, "lexical_chunks": len(self._lexical[key]) if key in self._lexical else None}
+                for key, index in self._indexes.items()
+            },
+        }
+
+    def _clear_indexes(self) -> None:
+        self._indexes.clear()
+        self._lexical.clear()
+
+    def compatible(self, doc: dict) -> bool:
+        """Whether a document's vectors can be compared with the query vectors (same test as aload_chunks)."""
+        model, dim = doc.get("embedding_model"), doc.get("embedding_dim")
+        if self.model is not None and model is not None and str(model).split("@", 1)[0] != self.model:
+            return False
+        return self.dim is None or dim is None or dim >= self.dim
+
+    def add_document(self, doc: dict) -> None:
+        """Apply a newly stored vector_db document (chunks hydrated with embeddings) to the resident indexes it belongs to."""
+        if not self.compatible(doc):
+            logger.warning(f"Not indexing document {doc.get('_id')}: embedded with {doc.get('embedding_model')} ({doc.get('embedding_dim')} dims)")
+            return
+        doc_id = str(doc.get("_id"))
+        chunks = doc.get("chunks") or []
+        for key in {doc.get("robot_id"), "__all__"} - {None}:
+            if key in self._pending:
+                self._pending[key].append(("add", doc_id, chunks))
+            index = self._indexes.get(key)
+            if index is not None:
+                added = index.add_document(doc_id, chunks)
+                logger.debug(f"Vector index {key}: added {added} chunks from {doc_id}")
+            lexical = self._lexical.get(key)
+            if lexical is not None:
+                lexical.add_document(doc_id, chunks)
+
+    def remove_document(self, doc_id: str) -> None:
+        """Remove a document's chunks from every resident index (delete events carry no robot_id)."""
+        for pending in self._pending.values():
+            pending.append(("remove", doc_id, None))
+        for key, index in self._indexes.items():
+            removed = index.remove_document(doc_id)
+            if removed:
+                logger.debug(f"Vector index {key}: removed {removed} chunks from {doc_id}")
+        for lexical in self._lexical.values():
+            lexical.remove_document(doc_id)
+
+    async def _aapply_change(self, change: dict) -> None:
+        op = change.get("operationType")
+        if op in ("insert", "update", "replace", "delete"):
+            doc_id = str(change["documentKey"]["_id"])
+            doc = change.get("fullDocument") if op != "delete" else None
+            # Only robots with an index in memory (or loading) need the vectors; the others load from MongoDB later
+            if doc and not any(key in self._indexes or key in self._pending for key in {doc.get("robot_id"), "__all__"} - {None}):
+                doc = None
+            if doc:
+                await self.embedding_store.ahydrate([doc])
+            if op != "insert":
+                self.remove_document(doc_id)
+            if doc:
+                self.add_document(doc)
+        else:
+            # drop / rename / invalidate: nothing incremental to do, reload lazily
+            logger.info(f"Vector change stream event '{op}'; clearing resident indexes")
+            self._clear_indexes()
+
+    async def awatch_changes(self) -> None:
+        """Follow vector_db change events so every replica keeps its resident indexes current."""
+        resume_token = None
+        while True:
+            try:
+                # The indexes only need chunks; leave full_text out of every looked-up document
+                pipeline = [{"$project": {"fullDocument.full_text": 0}}]
+                async with self.collection.watch(pipeline, full_document="updateLookup", resume_after=resume_token) as stream:
+                    logger.info("Watching vector_db change stream")
+                    async for change in stream:
+                        await self._aapply_change(change)
+                        resume_token = stream.resume_token
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                if getattr(e, "code", None) == 40573:  # change streams need a replica set
+                    logger.error(f"Vector change stream unavailable: {e}")
+                    return
+                # Events may have been missed; start over from fresh loads
+                logger.warning(f"Vector change stream interrupted: {e}. Retrying in 5s")
+                self._clear_indexes()
+                resume_token = None
+                await asyncio.sleep(5)
+
+    def start_watching(self) -> None:
+        if self._watch_task is None:
+            self._watch_task = asyncio.create_task(self.awatch_changes())
+
+    async def astop_watching(self) -> None:
+        if self._watch_task is not None:
+            self._watch_task.cancel()
+            try:
+                await self._watch_task
+            except asyncio.CancelledError:
+                pass
+            self._watch_task = None
+
+    @staticmethod
+    def _document(row, retrieval: str) -> Document:
+        return Document(page_content=row.content, metadata={"chunk_id": row.chunk_id, "doc_id": row.doc_id, "retrieval": retrieval})
 
     async def asearch_with_scores(self, query: str, k: int = 3, robot_id: str | None = None) -> List[Tuple[Document, float]]:
-        import numpy as np
-        # Compute embedding for query
-        query_vec_list = await self.embeddings_model.aembed_query(query)
-        query_vec = np.array(query_vec_list, dtype=float)
-
-        # Fetch candidate chunks from MongoDB (filtered by robot_id if provided)
-        match_stage = {"$match": {**({"robot_id": robot_id} if robot_id else {})}}
-        project_stage = {"$project": {"chunks": 1, "_id": 0}}
-        pipeline = [match_stage, project_stage]
-        cursor = self.collection.aggregate(pipeline)
-
-        docs_with_scores: List[Tuple[Document, float]] = []
-        async for doc in cursor:
-            for chunk in (doc.get("chunks") or []):
-                emb = np.array(chunk.get("embedding") or [], dtype=float)
-                if emb.size == 0 or emb.shape != query_vec.shape:
-                    continue
-                # cosine similarity
-                denom = (np.linalg.norm(query_vec) * np.linalg.norm(emb))
-                if denom == 0:
-                    continue
-                score = float(np.dot(query_vec, emb) / denom)
-                docs_with_scores.append((Document(page_content=chunk.get("content", "")), score))
-
-        # Sort by score desc and take top k
-        docs_with_scores.sort(key=lambda t: t[1], reverse=True)
-        return docs_with_scores[:k]
+        """Top-k chunks with a relevance score; relevant_documents() applies the matching threshold.
+
+        The score is cosine similarity. In hybrid mode the order comes from reciprocal rank fusion of both rankings,
+        and chunks only BM25 found are scored with their exact cosine too. A short keyword query whose terms all occur
+        in one chunk is answered from BM25 alone, without embedding the query; those "keyword" hits are scored with
+        the idf-weighted share of query terms the chunk contains instead.
+        """
+        key = robot_id or "__all__"
+        terms = query_terms(query)
+        if Config.HYBRID_RETRIEVAL and 0 < len(terms) <= Config.HYBRID_KEYWORD_MAX_TERMS:
+            await self.aget_index(robot_id)
+            lexical = self._lexical.get(key)
+            if lexical is not None and all(lexical.knows(t) for t in terms):
+                hits = lexical.search(query, k)
+                if any(h.coverage >= 1.0 for h in hits):
+                    self.search_counts["keyword"] += 1
+                    return [(self._document(h.row, "keyword"), h.coverage) for h in hits]
+
+        # Compute embedding for query and load the robot index concurrently
+        query_vec, index = await asyncio.gather(
+            self.embeddings_model.aembed_query(query),
+            self.aget_index(robot_id),
+        )
+        lexical = self._lexical.get(key) if Config.HYBRID_RETRIEVAL else None
+        if lexical is None:
+            self.search_counts["vector"] += 1
+            return [(self._document(row, "vector"), score) for row, score in index.search(query_vec, k)]
+
+        self.search_counts["hybrid"] += 1
+        n = k * Config.HYBRID_CANDIDATES
+        fused: dict[Tuple[str, str], list] = {}  # (doc_id, chunk_id) -> [rrf score, row, cosine]
+        rankings = (
+            index.search(query_vec, n),
+            [(hit.row, None) for hit in lexical.search(query, n)],
+        )
+        for ranking in rankings:
+            for rank, (row, cosine) in enumerate(ranking):
+                entry = fused.setdefault((row.doc_id, row.chunk_id), [0.0, row, None])
+                entry[0] += 1.0 / (Config.HYBRID_RRF_K + rank + 1)
+                if cosine is not None:
+                    entry[2] = cosine
+        top = sorted(fused.values(), key=lambda e: e[0], reverse=True)[:k]
+        lexical_only = [entry for entry in top if entry[2] is None]
+        for entry, cosine in zip(lexical_only, index.similarities(query_vec, [entry[1] for entry in lexical_only])):
+            entry[2] = cosine if cosine is not None else 0.0  # chunk without a usable vector
+        return [(self._document(row, "hybrid"), cosine) for _, row, cosine in top]
 
     async def alist_documents(self, user_id: str | None = None, robot_id: str | None = None) -> List[dict]:
-        query = {**({"user_id": user_id} if user_id else {}), **({"robot_id": robot_id} if robot_id else {})}
-        cursor = self.collection.find(query).sort("uploaded_at", -1)
-        docs = []
-        async for doc in cursor:
-            doc["_id"] = str(doc["_id"])  # stringify for JSON
-            # reduce payload by excluding embeddings in list view
-            if "chunks" in doc and isinstance(doc["chunks"], list):
-                doc["chunk_count"] = len(doc["chunks"])
-                doc.pop("chunks", None)
-            docs.append(doc)
-        return docs
-
-def extract_text_from_pdf_bytes(pdf_bytes: bytes) -> str:
-    """Extract full text from PDF bytes using PyMuPDF."""
-    with Timer("PDF text extraction"):
+        return await alist_knowledge_documents(self.collection, user_id, robot_id)
+
+def relevant_documents(docs_with_scores: List[Tuple[Document, float]]) -> List[Document]:
+    """Retrieved chunks above their threshold: KEYWORD_RELEVANCE_THRESHOLD for keyword-only hits (query-term
+    coverage), RELEVANCE_THRESHOLD for everything else (cosine)."""
+    return [
+        doc for doc, score in docs_with_scores
+        if score > (Config.KEYWORD_RELEVANCE_THRESHOLD if doc.metadata.get("retrieval") == "keyword" else Config.RELEVANCE_THRESHOLD)
+    ]
+
+def build_knowledge_document(user_id: str, robot_id: str | None, filename: str, full_text: str, chunks: List[Chunk], embedding_ids: List[str],
+                             embedding_model: str, embedding_dim: int) -> dict:
+    """Shape of a vector_db document: one per uploaded PDF; chunks reference EmbeddingStore vectors (offsets index into full_text)."""
+    return {
+        "user_id": user_id,
+        **({"robot_id": robot_id} if robot_id else {}),
+        "filename": filename,
+        "full_text": full_text,
+        "embedding_model": embedding_model,
+        "embedding_dim": embedding_dim,
+        "chunks": [
+            {
+                "chunk_id": str(uuid.uuid4()),
+                "content": chunk.content,
+                "embedding_id": embedding_id,
+                "start": chunk.start,
+                "end": chunk.end,
+                "page_start": chunk.page_start,
+                "page_end": chunk.page_end,
+                "tokens": chunk.tokens,
+                **({"robot_id": robot_id} if robot_id else {}),
+            }
+            for chunk, embedding_id in zip(chunks, embedding_ids)
+        ],
+        "uploaded_at": datetime.datetime.utcnow(),
+    }
+
+class JobLeaseLost(Exception):
+    """Another replica took over a RAG ingestion job after this one missed its heartbeats."""
+
+class RagIngestionQueue:
+    """Runs PDF uploads as background jobs persisted in MongoDB (PDF bytes in GridFS) so they survive restarts.
+
+    Replicas share the jobs collection: a job is claimed atomically and its owner refreshes a heartbeat while it runs,
+    so only jobs that are queued or whose owner stopped heartbeating are picked up by another replica.
+    """
+
+    def __init__(self, knowledge_store: "VectorKnowledgeStore", embedder: BatchedEmbedder, embedding_store: EmbeddingStore,
+                 retriever: "MongoEmbeddingRetriever"):
+        self.knowledge_store = knowledge_store
+        self.embedder = embedder
+        self.embedding_store = embedding_store
+        self.retriever = retriever
+        self.owner = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self.files: AsyncIOMotorGridFSBucket | None = None  # created in astart, once the shared client is open
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._pending: set = set()  # job ids queued or running, so a late resume does not queue them twice
+        self._workers: List[asyncio.Task] = []
+        self._resumer: asyncio.Task | None = None
+        self._pool: ProcessPoolExecutor | None = None
+
+    @property
+    def jobs(self):
+        return self.knowledge_store.db[Config.RAG_JOBS_COLLECTION]
+
+    async def astart(self) -> None:
+        self.files = AsyncIOMotorGridFSBucket(self.knowledge_store.db, bucket_name="rag_uploads")
+        # Workers start lazily, once MQTT/motor/asyncio threads are running: forking then can copy held locks into the
+        # child, so they are spawned fresh (they re-import this module, which is why connections open in before_serving)
+        self._pool = ProcessPoolExecutor(max_workers=Config.PDF_PROCESS_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+        self._workers = [asyncio.create_task(self._aworker()) for _ in range(Config.RAG_INGEST_WORKERS)]
+        self._resumer = asyncio.create_task(self._aresume_loop())
+
+    def _claimable(self) -> dict:
+        """Jobs nobody is working on: queued, or running under an expired lease (or none, from before leases)."""
+        expired = datetime.datetime.utcnow() - datetime.timedelta(seconds=Config.RAG_JOB_LEASE_SECONDS)
+        return {"$or": [
+            {"status": "queued"},
+            {"status": "running", "$or": [{"heartbeat": {"$lt": expired}}, {"heartbeat": {"$exists": False}}]},
+        ]}
+
+    async def _aresume(self) -> None:
+        """Queue jobs left by a restart or by a replica that stopped heartbeating, oldest first."""
+        cursor = self.jobs.find(self._claimable(), {"_id": 1}).sort("created_at", 1)
+        resumed = 0
+        async for job in cursor:
+            if job["_id"] in self._pending:
+                continue
+            self._enqueue(job["_id"])
+            resumed += 1
+        if resumed:
+            logger.info(f"Resumed {resumed} unfinished RAG ingestion jobs")
+
+    async def _aresume_loop(self) -> None:
+        # Also keeps serving when MongoDB is unreachable at boot: the jobs are picked up once it is back
+        while True:
+            try:
+                await self._aresume()
+            except Exception as e:
+                logger.warning(f"Could not resume RAG ingestion jobs, retrying in {Config.RAG_JOB_LEASE_SECONDS}s: {e}")
+            await asyncio.sleep(Config.RAG_JOB_LEASE_SECONDS)
+
+    async def _aclaim(self, job_id: str) -> dict | None:
+        """Atomically take a claimable job for this process; None if another replica owns it or it is finished."""
+        now = datetime.datetime.utcnow()
+        return await self.jobs.find_one_and_update(
+            {"_id": job_id, **self._claimable()},
+            {"$set": {"status": "running", "stage": "queued", "owner": self.owner, "heartbeat": now, "updated_at": now}},
+            return_document=ReturnDocument.AFTER,
+        )
+
+    async def _aheartbeat(self, job_id: str) -> None:
+        while True:
+            await asyncio.sleep(Config.RAG_JOB_LEASE_SECONDS / 3)
+            try:
+                await self.jobs.update_one({"_id": job_id, "owner": self.owner}, {"$set": {"heartbeat": datetime.datetime.utcnow()}})
+            except Exception as e:
+                logger.warning(f"Could not refresh heartbeat of RAG ingestion job {job_id}: {e}")
+
+    def _enqueue(self, job_id: str) -> None:
+        self._pending.add(job_id)
+        self._queue.put_nowait(job_id)
+
+    async def astop(self) -> None:
+        tasks = self._workers + ([self._resumer] if self._resumer is not None else [])
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._workers = []
+        self._resumer = None
+        if self._pool is not None:
+            # Jobs still marked "running" are picked up again on the next start
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    async def asubmit(self, user_id: str, robot_id: str | None, filename: str, pdf_bytes: bytes) -> str:
+        job_id = uuid.uuid4().hex
+        file_id = await self.files.upload_from_stream(filename, pdf_bytes, metadata={"job_id": job_id})
+        now = datetime.datetime.utcnow()
+        await self.jobs.insert_one({
+            "_id": job_id,
+            "user_id": user_id,
+            **({"robot_id": robot_id} if robot_id else {}),
+            "filename": filename,
+            "file_id": file_id,
+            "status": "queued",
+            "stage": "queued",
+            "progress": {"done": 0, "total": 0},
+            "timings": {},
+            "created_at": now,
+            "updated_at": now,
+        })
+        self._enqueue(job_id)
+        return job_id
+
+    async def aget_job(self, job_id: str) -> dict | None:
+        job = await self.jobs.find_one({"_id": job_id}, {"file_id": 0})
+        if job is not None:
+            job["job_id"] = job.pop("_id")
+        return job
+
+    async def _aupdate(self, job_id: str, **fields) -> None:
+        await self.jobs.update_one({"_id": job_id}, {"$set": {**fields, "updated_at": datetime.datetime.utcnow()}})
+
+    async def _aupdate_owned(self, job_id: str, **fields) -> None:
+        """Update a job this process runs; raises JobLeaseLost once another replica has taken it over."""
+        now = datetime.datetime.utcnow()
+        result = await self.jobs.update_one({"_id": job_id, "owner": self.owner},
+                                            {"$set": {**fields, "heartbeat": now, "updated_at": now}})
+        if result.matched_count == 0:
+            raise JobLeaseLost(job_id)
+
+    async def _aworker(self) -> None:
+        while True:
+            job_id = await self._queue.get()
+            try:
+                await self._arun(job_id)
+            except asyncio.CancelledError:
+                raise
+            except JobLeaseLost:
+                logger.warning(f"RAG ingestion job {job_id} was taken over by another replica; abandoning it here")
+            except Exception as e:
+                logger.error(f"RAG ingestion job {job_id} failed: {e}", exc_info=True)
+                try:
+                    await self._aupdate(job_id, status="failed", error=str(e))
+                    # Failed jobs are not retried, so their PDF would never be read again
+                    job = await self.jobs.find_one({"_id": job_id}, {"file_id": 1})
+                    if job is not None:
+                        await self._adelete_upload(job_id, job["file_id"])
+                except Exception as e:
+                    logger.warning(f"Could not record failure of RAG ingestion job {job_id}: {e}")
+            finally:
+                self._pending.discard(job_id)
+                self._queue.task_done()
+
+    async def _arun(self, job_id: str) -> None:
+        job = await self._aclaim(job_id)
+        if job is None:
+            return
+        heartbeat = asyncio.create_task(self._aheartbeat(job_id))
+        try:
+            await self._aprocess(job_id, job)
+        finally:
+            heartbeat.cancel()
+
+    async def _aprocess(self, job_id: str, job: dict) -> None:
+        timings: dict = {}
+        started = time.time()
+
+        # Interrupted after the document was stored: finish the job instead of storing (and retaining) it twice
+        stored = await self.knowledge_store.collection.find_one({"job_id": job_id}, {"chunks.chunk_id": 1, "chunks.embedding_id": 1})
+        if stored is not None:
+            if not job.get("retained"):
+                hashes = [c["embedding_id"] for c in stored.get("chunks") or [] if c.get("embedding_id")]
+                await self.embedding_store.aretain(hashes, await self.embedding_store.aget_many(hashes))
+                await self._aupdate_owned(job_id, retained=True)
+            await self._aupdate(job_id, status="done", stage="done",
+                                result={"_id": str(stored["_id"]), "chunk_count": len(stored.get("chunks") or [])})
+            await self._adelete_upload(job_id, job["file_id"])
+            return
+
+        async def stage(name: str):
+            nonlocal started
+            now = time.time()
+            if job.get("stage") not in (None, "queued"):
+                timings[job["stage"]] = round(now - started, 3)
+            job["stage"], started = name, now
+            await self._aupdate_owned(job_id, status="running" if name != "done" else "done", stage=name, timings=timings)
+
+        with Timer(f"RAG ingestion job {job_id}"):
+            await stage("extracting")
+            stream = await self.files.open_download_stream(job["file_id"])
+            pdf_bytes = await stream.read()
+            # PyMuPDF is synchronous and CPU-bound: pages are parsed in parallel worker processes,
+            # and chunked here as they arrive in order
+            pages: List[str] = []
+            chunks: List[Chunk] = []
+            chunker = StreamingChunker(Config.CHUNK_MAX_TOKENS, Config.CHUNK_OVERLAP_TOKENS)
+            async for page_number, page_count, text in aiter_pdf_pages(pdf_bytes, self._pool, Config.PDF_PAGES_PER_TASK):
+                pages.append(text)
+                chunks.extend(chunker.feed(page_number, text))
+                if page_number % Config.PDF_PAGES_PER_TASK == 0 or page_number == page_count:
+                    await self._aupdate_owned(job_id, progress={"done": page_number, "total": page_count})
+            chunks.extend(chunker.finish())
+            full_text = "\n".join(pages)  # not stripped, so chunk offsets stay valid
+            if not full_text.strip():
+                raise ValueError("Could not extract any text from PDF")
+            if not chunks:
+                raise ValueError("No chunks generated from PDF text")
+            texts = [chunk.content for chunk in chunks]
+
+            await stage("embedding")
+
+            async def on_progress(done: int, total: int):
+                await self._aupdate_owned(job_id, progress={"done": done, "total": total})
+
+            # Chunks already embedded by any earlier upload (any robot) reuse the stored vector
+            embedding_ids, vectors = await self.embedding_store.aembed(texts, self.embedder, progress_callback=on_progress)
+
+            await stage("storing")
+            doc = build_knowledge_document(job["user_id"], job.get("robot_id"), job["filename"], full_text, chunks, embedding_ids,
+                                           self.embedding_store.model, len(vectors[embedding_ids[0]]))
+            doc["job_id"] = job_id
+            inserted_id = await self.knowledge_store.ainsert_document(doc)
+            # References are taken only once the document exists: a crash in between is finished by the resumed job
+            # above (a crash after retaining but before recording it over-counts, which only delays collection)
+            try:
+                await self.embedding_store.aretain(embedding_ids, vectors)
+            except Exception:
+                await self.knowledge_store.collection.delete_one({"_id": doc["_id"]})
+                raise
+            await self._aupdate_owned(job_id, retained=True)
+            for chunk in doc["chunks"]:
+                chunk["embedding"] = vectors[chunk["embedding_id"]]  # in-memory only, for the resident index
+            self.retriever.add_document(doc)  # insert_one sets doc['_id']
+
+            await stage("done")
+            await self._aupdate(job_id, result={"_id": inserted_id, "chunk_count": len(texts)})
+        await self._adelete_upload(job_id, job["file_id"])
+
+    async def _adelete_upload(self, job_id: str, file_id) -> None:
         try:
-            doc = fitz.open(stream=pdf_bytes, filetype="pdf")
-            texts: List[str] = []
-            for page in doc:
-                texts.append(page.get_text("text"))
-            return "\n".join(texts).strip()
+            await self.files.delete(file_id)
+        except NoFile:  # already removed by an earlier attempt
+            pass
         except Exception as e:
-            logger.error(f"Failed to extract text from PDF: {e}")
-            raise
-
-def chunk_text(text: str, chunk_size: int = 500, overlap: int = 100) -> List[str]:
-    """Naive text chunking by characters with overlap."""
-    if not text:
-        return []
-    chunks: List[str] = []
-    start = 0
-    text_len = len(text)
-    while start < text_len:
-        end = min(start + chunk_size, text_len)
-        chunks.append(text[start:end])
-        if end == text_len:
-            break
-        start = end - overlap
-        if start < 0:
-            start = 0
-    return chunks
+            logger.warning(f"Could not delete uploaded PDF for job {job_id}: {e}")
 
 # Intent Classifier Class
 class IntentClassifier:
-    def __init__(self, llm):
+    # Labels accepted from the classifier; anything else falls back to "talk"
+    INTENTS = ["dance", "mad", "sad", "sleep", "happy", "talk", "goodbye", "introduction", "deteksi"]
+
+    # Whole-utterance phrase tables for the local fast path (matched in the spirit of detect_wake_word_fuzzy).
+    # Keep out phrases one letter swap away from common questions ("who are you" / "how are you").
+    INTENT_PHRASES = {
+        "dance": ["dance", "do a dance", "do a little dance", "dance for me", "let's dance", "show me your moves", "can you dance", "ayo joget", "joget", "menari"],
+        "sleep": ["go to sleep", "sleep", "sleep now", "go to sleep now", "be quiet", "rest now", "take a rest", "standby", "tidur", "ayo tidur", "diam"],
+        "happy": ["you are amazing", "you're amazing", "you are great", "good job", "well done", "i love you", "you are so smart", "you are cute", "you're the best", "thank you", "thanks", "pintar", "keren"],
+        "mad": ["let's fight", "you are stupid", "you're stupid", "you are dumb", "shut up", "i hate you", "you are useless", "bodoh"],
+        "sad": ["i am sad", "i'm sad", "i feel sad", "i'm so sad", "i had a bad day", "i feel bad", "i'm disappointed", "sedih", "aku sedih"],
+        "goodbye": ["goodbye", "bye", "bye bye", "see you", "see you later", "see you next time", "good night", "dadah", "sampai jumpa"],
+        "introduction": ["introduce yourself", "what is your name", "what's your name", "tell me about yourself", "my name is", "hi my name is", "siapa kamu", "perkenalkan dirimu"],
+    }
+
+    # Example utterances whose embeddings form the optional nearest-centroid stage
+    INTENT_EXAMPLES = {
+        **INTENT_PHRASES,
+        "introduction": INTENT_PHRASES["introduction"] + ["who are you"],
+        "talk": [
+            "who invented the lightbulb", "what is the capital of indonesia", "how does this product work",
+            "tell me about the history of jakarta", "what are the features of this robot", "why is the sky blue",
+            "how much does it cost", "where is the nearest store", "what can you tell me about this company",
+        ],
+    }
+
+    FUZZY_WORD_CUTOFF = 85  # per-word fuzz.ratio for phrases of three or more words; words of up to 3 letters must be exact
+
+    def __init__(self, llm, embeddings_model: "QueryEmbeddingCache | None" = None):
         self.llm = llm
+        self.embeddings_model = embeddings_model
+        self._phrase_choices = [(phrase, intent) for intent, phrases in self.INTENT_PHRASES.items() for phrase in phrases]
+        self._centroids: Tuple[List[str], np.ndarray] | None = None
+        self._centroid_lock = asyncio.Lock()
+        self.counts = {"fuzzy": 0, "centroid": 0, "llm": 0}
+
+    @staticmethod
+    def _normalize(message: str) -> str:
+        return re.sub(r"[^\w\s']", " ", message.lower()).strip()
 
-    async def aclassify_intent(self, message: str) -> str: # ASYNC Method
+    def match_fuzzy(self, message: str) -> Tuple[str | None, float]:
+        """Best whole-utterance phrase match; (intent, confidence in 0..1).
+
+        One- and two-word phrases only match exactly ("dancer" is not "dance"). Longer ones tolerate typos word by
+        word (short words exactly), so a different word ("how" for "who") cannot ride on the rest of the phrase.
+        """
+        text = re.sub(r"\s+", " ", self._normalize(message))
+        if not text:
+            return None, 0.0
+        best = process.extractOne(text, [p for p, _ in self._phrase_choices], scorer=fuzz.ratio)
+        if best is None:
+            return None, 0.0
+        phrase, score, idx = best
+        intent = self._phrase_choices[idx][1]
+        if text == phrase:
+            return intent, 1.0
+        words, phrase_words = text.split(), phrase.split()
+        if len(phrase_words) <= 2 or len(words) != len(phrase_words):
+            return intent, 0.0
+        if any(w != p and (len(p) <= 3 or fuzz.ratio(w, p) < self.FUZZY_WORD_CUTOFF) for w, p in zip(words, phrase_words)):
+            return intent, 0.0
+        return intent, score / 100.0
+
+    async def _aget_centroids(self) -> Tuple[List[str], np.ndarray]:
+        if self._centroids is None:
+            async with self._centroid_lock:
+                if self._centroids is None:
+                    labels = list(self.INTENT_EXAMPLES)
+                    rows = []
+                    for label in labels:
+                        # Goes through the query cache, so examples are only embedded once per process (or once ever if persisted)
+                        vecs = await asyncio.gather(*(self.embeddings_model.aembed_query(e) for e in self.INTENT_EXAMPLES[label]))
+                        centroid = np.mean(np.asarray(vecs, dtype=np.float32), axis=0)
+                        rows.append(centroid / (np.linalg.norm(centroid) or 1.0))
+                    self._centroids = (labels, np.vstack(rows))
+        return self._centroids
+
+    async def amatch_centroid(self, message: str) -> Tuple[str | None, float]:
+        """Nearest intent centroid by cosine; confidence is 0 unless the top-2 margin is wide enough."""
+        labels, centroids = await self._aget_centroids()
+        q = np.asarray(await self.embeddings_model.aembed_query(message), dtype=np.float32)
+        scores = centroids @ (q / (np.linalg.norm(q) or 1.0))
+        order = np.argsort(scores)[::-1]
+        top, second = float(scores[order[0]]), float(scores[order[1]])
+        if top - second < Config.INTENT_CENTROID_MARGIN:
+            return labels[order[0]], 0.0
+        return labels[order[0]], top
+
+    async def aclassify_intent_with_confidence(self, message: str) -> Tuple[str, float, str]:
+        """Returns (intent, confidence, source) where source is "fuzzy", "centroid" or "llm"."""
+        if Config.INTENT_FAST_PATH:
+            intent, confidence = self.match_fuzzy(message)
+            if intent is not None and confidence >= Config.INTENT_FUZZY_THRESHOLD:
+                self.counts["fuzzy"] += 1
+                logger.info(f"Intent fast path (fuzzy): {intent} ({confidence:.2f})")
+                return intent, confidence, "fuzzy"
+            if Config.INTENT_CENTROID_ENABLED and self.embeddings_model is not None:
+                try:
+                    intent, confidence = await self.amatch_centroid(message)
+                    if intent is not None and confidence >= Config.INTENT_CENTROID_THRESHOLD:
+                        self.counts["centroid"] += 1
+                        logger.info(f"Intent fast path (centroid): {intent} ({confidence:.2f})")
+                        return intent, confidence, "centroid"
+                except OpenAIError as e:
+                    logger.warning(f"Intent centroid stage failed, using LLM: {e}")
+        self.counts["llm"] += 1
+        return await self.allm_classify_intent(message), 1.0, "llm"
+
+    async def aclassify_intent(self, message: str) -> str:
+        intent, _, _ = await self.aclassify_intent_with_confidence(message)
+        return intent
+
+    def stats(self) -> dict:
+        total = sum(self.counts.values())
+        fast = self.counts["fuzzy"] + self.counts["centroid"]
+        return {**self.counts, "fast_path_rate": round(fast / total, 4) if total else 0.0}
+
+    async def allm_classify_intent(self, message: str) -> str: # ASYNC Method
         with Timer("Intent classification"):
             prompt = f"""
             Classify the user's intent into one of the following categories, based on context and meaning:
@@ -306,7 +1997,7 @@ class IntentClassifier:
                 # --- ASYNC CHANGE: Use ainvoke for non-blocking LLM call ---
                 response = await self.llm.ainvoke(prompt)
                 content = response.content.strip().lower()
-                return content if content in ["dance", "mad", "sad", "sleep", "happy", "talk", "goodbye", "introduction", "deteksi"] else "talk"
+                return content if content in self.INTENTS else "talk"
             except OpenAIError as e:
                 logger.error(f"LLM intent classification failed: {e}")
                 return "talk"
@@ -345,51 +2036,273 @@ class MQTTClient:
             except Exception as e:
                 logger.error(f"MQTT publish failed: {e}")
 
-# Temporary audio file context manager
-@asynccontextmanager
-async def temp_audio_file(prefix: str) -> AsyncGenerator[str, None]:
-    """Async context manager for creating and cleaning up a temporary audio file."""
-    fd, path = tempfile.mkstemp(suffix=".mp3", prefix=prefix)
-    os.close(fd)
-    logger.debug(f"Temporary file created: {path}")
-    try:
-        yield path
-    finally:
+# In-memory audio ingestion shared by /detect_wakeword and /process_input
+async def aread_audio_body(max_size: int) -> io.BytesIO | None:
+    """Streams the request body into memory; returns None once it exceeds max_size (no disk I/O)."""
+    if request.content_length is not None and request.content_length > max_size:
+        logger.warning("Audio file too large: %d bytes", request.content_length)
+        return None
+    buffer = io.BytesIO()
+    async for chunk in request.body:
+        if buffer.tell() + len(chunk) > max_size:
+            logger.warning("Audio file too large: more than %d bytes", max_size)
+            return None
+        buffer.write(chunk)
+    buffer.seek(0)
+    return buffer
+
+async def atranscribe_audio(audio: io.BytesIO, filename: str = "audio.mp3") -> str:
+    """Sends in-memory audio to Whisper and returns the transcript text."""
+    with Timer("Audio transcription", "stt"):
+        # --- Pass the buffer (in a tuple) to the OpenAI client; it is read without copying to disk ---
+        transcript = await openai_client.audio.transcriptions.create(
+            model="whisper-1",
+            file=(filename, audio),
+            language="en"
+        )
+    logger.info("Transcription result: %s", transcript.text)
+    return transcript.text
+
+class AudioPreprocessor:
+    """Trims leading/trailing silence, downmixes to mono 16 kHz and re-encodes compactly before STT."""
+
+    def __init__(self):
+        self.counts = {"requests": 0, "failures": 0, "bytes_in": 0, "bytes_out": 0, "seconds_in": 0.0, "seconds_out": 0.0}
+
+    def _process(self, audio: io.BytesIO) -> Tuple[io.BytesIO, dict]:
+        raw_size = audio.getbuffer().nbytes
+        segment = AudioSegment.from_file(audio)
+        original_seconds = len(segment) / 1000.0
+
+        threshold = Config.AUDIO_PREPROCESS_SILENCE_DBFS
+        lead = detect_leading_silence(segment, silence_threshold=threshold)
+        trail = detect_leading_silence(segment.reverse(), silence_threshold=threshold)
+        start = max(lead - Config.AUDIO_PREPROCESS_PADDING_MS, 0)
+        end = min(len(segment) - trail + Config.AUDIO_PREPROCESS_PADDING_MS, len(segment))
+        if end > start:  # an all-silent clip is sent as is
+            segment = segment[start:end]
+
+        segment = segment.set_channels(1).set_frame_rate(16000)
+        out = io.BytesIO()
+        segment.export(out, format=Config.AUDIO_PREPROCESS_FORMAT, bitrate=Config.AUDIO_PREPROCESS_BITRATE)
+        out.seek(0)
+        report = {
+            "bytes_in": raw_size,
+            "bytes_out": out.getbuffer().nbytes,
+            "seconds_in": original_seconds,
+            "seconds_out": len(segment) / 1000.0,
+        }
+        return out, report
+
+    async def aprocess(self, audio: io.BytesIO) -> Tuple[io.BytesIO, str]:
+        """Returns (audio, filename for Whisper); the original audio is passed through if preprocessing fails or does not help."""
+        self.counts["requests"] += 1
         try:
-            os.remove(path)
-            logger.debug(f"Temporary file removed: {path}")
-        except OSError as e:
-            logger.error(f"Error removing temporary file {path}: {e}")
+            with Timer("Audio preprocessing"):
+                processed, report = await asyncio.to_thread(self._process, audio)
+        except Exception as e:
+            self.counts["failures"] += 1
+            logger.warning("Audio preprocessing failed, sending original audio: %s", e)
+            audio.seek(0)
+            return audio, "audio.mp3"
+        if report["bytes_out"] >= report["bytes_in"]:
+            # Re-encoding did not shrink it (e.g. already compact); keep the original
+            report["bytes_out"] = report["bytes_in"]
+            processed, filename = audio, "audio.mp3"
+            audio.seek(0)
+        else:
+            filename = f"audio.{Config.AUDIO_PREPROCESS_FORMAT}"
+        for key, value in report.items():
+            self.counts[key] += value
+        logger.info(
+            "Audio preprocessing saved %d bytes and %.2f s (%d -> %d bytes, %.2f -> %.2f s)",
+            report["bytes_in"] - report["bytes_out"], report["seconds_in"] - report["seconds_out"],
+            report["bytes_in"], report["bytes_out"], report["seconds_in"], report["seconds_out"],
+        )
+        return processed, filename
+
+    def stats(self) -> dict:
+        return {
+            **self.counts,
+            "seconds_in": round(self.counts["seconds_in"], 2),
+            "seconds_out": round(self.counts["seconds_out"], 2),
+            "bytes_saved": self.counts["bytes_in"] - self.counts["bytes_out"],
+            "seconds_saved": round(self.counts["seconds_in"] - self.counts["seconds_out"], 2),
+        }
 
 # Detecting wake words using fuzzy matching
-def detect_wake_word_fuzzy(text, threshold=85):
+def wake_word_score(text) -> float:
+    """Best fuzzy partial-match score (0-100) of any wake word in the text."""
     text = text.lower()
-    for wake in Config.WAKE_WORDS:
-        if fuzz.partial_ratio(wake, text) >= threshold:
+    return max((fuzz.partial_ratio(wake, text) for wake in Config.WAKE_WORDS), default=0.0)
+
+def detect_wake_word_fuzzy(text, threshold=85):
+    return wake_word_score(text) >= threshold
+
+# --- Offline wake-word detection ---
+class VoskBackend:
+    """Offline STT with a Vosk model directory (pip install vosk)."""
+
+    def __init__(self, model_path: str):
+        from vosk import Model  # optional dependency
+        self.model = Model(model_path)
+
+    def transcribe(self, samples: np.ndarray, sample_rate: int) -> str:
+        from vosk import KaldiRecognizer
+        recognizer = KaldiRecognizer(self.model, sample_rate)
+        recognizer.AcceptWaveform(samples.tobytes())
+        return json.loads(recognizer.FinalResult()).get("text", "")
+
+class FasterWhisperBackend:
+    """Small offline Whisper model on CPU (pip install faster-whisper)."""
+
+    def __init__(self, model_size: str):
+        from faster_whisper import WhisperModel  # optional dependency
+        self.model = WhisperModel(model_size, device="cpu", compute_type="int8")
+
+    def transcribe(self, samples: np.ndarray, sample_rate: int) -> str:
+        segments, _ = self.model.transcribe(samples.astype(np.float32) / 32768.0, language="en", beam_size=1, vad_filter=False)
+        return " ".join(segment.text for segment in segments)
+
+LOCAL_STT_BACKENDS = {"vosk": VoskBackend, "faster_whisper": FasterWhisperBackend}
+
+class LocalWakeWordDetector:
+    """pydub decode -> energy gate -> local STT backend -> wake-word score; None means "ask the cloud"."""
+    SAMPLE_RATE = 16000
+    FRAME_MS = 30
+
+    def __init__(self, backend_name: str, model: str):
+        self.backend = None
+        backend_cls = LOCAL_STT_BACKENDS.get(backend_name)
+        if backend_cls is None:
+            logger.warning(f"Unknown local wake-word backend '{backend_name}'; only the silence gate will run locally")
+        else:
+            try:
+                self.backend = backend_cls(model)
+            except Exception as e:
+                logger.warning(f"Could not load local wake-word backend '{backend_name}': {e}")
+        self.counts = {"silence": 0, "local_accept": 0, "local_reject": 0, "uncertain": 0}
+
+    def decode(self, audio: io.BytesIO) -> np.ndarray:
+        segment = AudioSegment.from_file(audio).set_channels(1).set_frame_rate(self.SAMPLE_RATE).set_sample_width(2)
+        return np.frombuffer(segment.raw_data, dtype=np.int16)
+
+    def speech_ms(self, samples: np.ndarray) -> int:
+        """Milliseconds of 30 ms frames whose RMS level is above the silence threshold."""
+        frame_len = self.SAMPLE_RATE * self.FRAME_MS // 1000
+        n_frames = len(samples) // frame_len
+        if n_frames == 0:
+            return 0
+        frames = samples[: n_frames * frame_len].astype(np.float32).reshape(n_frames, frame_len)
+        rms = np.sqrt(np.mean(frames ** 2, axis=1))
+        dbfs = 20 * np.log10(np.maximum(rms, 1e-9) / 32768.0)
+        return int(np.count_nonzero(dbfs > Config.WAKEWORD_SILENCE_DBFS)) * self.FRAME_MS
+
+    def _detect(self, audio: io.BytesIO) -> bool | None:
+        samples = self.decode(audio)
+        if self.speech_ms(samples) < Config.WAKEWORD_MIN_SPEECH_MS:
+            self.counts["silence"] += 1
+            return False
+        if self.backend is None:
+            self.counts["uncertain"] += 1
+            return None
+        text = self.backend.transcribe(samples, self.SAMPLE_RATE)
+        score = wake_word_score(text)
+        logger.info("Local wake-word transcript: %r (score %.0f)", text, score)
+        if score >= Config.WAKEWORD_LOCAL_ACCEPT:
+            self.counts["local_accept"] += 1
             return True
-    return False
+        if score < Config.WAKEWORD_LOCAL_REJECT:
+            self.counts["local_reject"] += 1
+            return False
+        self.counts["uncertain"] += 1
+        return None
+
+    async def adetect(self, audio: io.BytesIO) -> bool | None:
+        """True/False when the local stages are confident, None when cloud STT should decide."""
+        with Timer("Local wakeword detection"):
+            return await asyncio.to_thread(self._detect, audio)
+
+async def speculative_intent_and_retrieval(message: str, core: Main, robot_id: str | None = None, k: int = 3) -> Tuple[str, List[Tuple[Document, float]] | None]:
+    """Classifies intent while top-k retrieval runs; the retrieval is cancelled or discarded unless intent is 'talk'."""
+    stats = core.speculation_stats
+    elapsed = {"seconds": 0.0}  # time the retrieval ran, counted as waste only if it is not used
+
+    async def timed_search():
+        start = time.time()
+        try:
+            with Timer("Speculative retrieval", "retrieval"):
+                return await core.retriever.asearch_with_scores(query=message, k=k, robot_id=robot_id)
+        finally:
+            elapsed["seconds"] = time.time() - start
+
+    retrieval_task = asyncio.create_task(timed_search())
+    stats["started"] += 1
+    try:
+        with Timer("Intent routing", "intent"):
+            intent = await core.intent_classifier.aclassify_intent(message)
+    except BaseException:
+        retrieval_task.cancel()
+        raise
+
+    if intent == "talk":
+        stats["used"] += 1
+        return intent, await retrieval_task
+
+    if retrieval_task.done():
+        stats["discarded"] += 1
+    else:
+        stats["cancelled"] += 1
+        retrieval_task.cancel()
+    await asyncio.gather(retrieval_task, return_exceptions=True)  # consume result/exception
+    stats["wasted_seconds"] += elapsed["seconds"]
+    return intent, None
 
 # Generating response using OpenAI LLM
-async def concurrent_response_generation(message: str, core: Main, robot_id: str | None = None) -> Tuple[str, str]:
-    """Runs intent classification first, then fetches documents only if intent is 'talk'."""
+async def concurrent_response_generation(message: str, core: Main, robot_id: str | None = None, audio_stream: "StreamingAudioBuffer | None" = None) -> Tuple[str, str, CachedResponse | None]:
+    """Runs intent classification first, then fetches documents only if intent is 'talk'.
+
+    Returns (response, intent, cache entry); the entry is shared with the semantic response cache so TTS audio can be attached to it.
+    With audio_stream, a fresh LLM answer is spoken sentence by sentence into that buffer while it is generated.
+    """
     with Timer("Concurrent response generation"):
-        # --- First, classify the intent ---
-        intent = await core.intent_classifier.aclassify_intent(message)
-        
+        if Config.SPECULATIVE_RETRIEVAL:
+            # --- Speculatively embed + retrieve while the intent is classified ---
+            intent, docs_with_scores = await speculative_intent_and_retrieval(message, core, robot_id)
+        else:
+            with Timer("Intent routing", "intent"):
+                intent = await core.intent_classifier.aclassify_intent(message)
+            docs_with_scores = None
+
         if intent != "talk":
             logger.info("Intent is not 'talk'; skipping document retrieval and LLM response generation.")
-            return None, intent
+            return None, intent, None
 
         # --- Only fetch documents if intent is 'talk' ---
-        docs_with_scores = await core.retriever.asearch_with_scores(query=message, k=3, robot_id=robot_id)
+        if docs_with_scores is None:
+            with Timer("Document retrieval", "retrieval"):
+                docs_with_scores = await core.retriever.asearch_with_scores(query=message, k=3, robot_id=robot_id)
         
-        relevant_docs: List[Document] = [doc for doc, score in docs_with_scores if score > Config.RELEVANCE_THRESHOLD]
+        relevant_docs: List[Document] = relevant_documents(docs_with_scores)
         
         logger.info(f"Detected intent: {intent}")
         logger.info(f"Retrieved {len(docs_with_scores)} documents, found {len(relevant_docs)} to be relevant.")
 
         knowledge = "\n\n".join([doc.page_content for doc in relevant_docs])
 
+        # --- Reuse a cached answer for a near-identical question over the same context ---
+        cache_key = robot_id or "default"
+        chunk_ids = frozenset(doc.metadata.get("chunk_id") for doc in relevant_docs)
+        query_vec = None
+        if core.response_cache is not None:
+            if any(doc.metadata.get("retrieval") == "keyword" for doc, _ in docs_with_scores):
+                query_vec = core.query_cache.peek(message)  # keyword retrieval skipped the embedding; do not pay for it here
+            else:
+                query_vec = await core.query_cache.aembed_query(message)  # already cached by the retriever
+            cache_entry = core.response_cache.lookup(cache_key, query_vec, chunk_ids) if query_vec is not None else None
+            if cache_entry is not None:
+                return cache_entry.answer, intent, cache_entry
+
         prompt = f"""
 
         You are Michi, a super friendly and enthusiastic AI robot assistant.
@@ -415,13 +2328,23 @@ async def concurrent_response_generation(message: str, core: Main, robot_id: str
 
         """
 
-    with Timer("LLM response generation"):
-        # --- Use ainvoke for the final, non-blocking LLM call ---
-        response = await core.llm.ainvoke(prompt)
-        response_text = response.content.strip()
+    if audio_stream is not None:
+        audio_stream.started.set()
+        with Timer("Streaming LLM + TTS", "llm"):  # includes the sentence TTS it overlaps with
+            response_text = await astream_speech(prompt, core.llm, audio_stream)
+    else:
+        with Timer("LLM response generation", "llm"):
+            # --- Use ainvoke for the final, non-blocking LLM call ---
+            response = await core.llm.ainvoke(prompt)
+            response_text = response.content.strip()
 
     logger.info("Generated response: %s", response_text)
-    return response_text, intent
+    cache_entry = None
+    if core.response_cache is not None and query_vec is not None:
+        cache_entry = core.response_cache.store(cache_key, query_vec, chunk_ids, response_text)
+        if cache_entry is not None and audio_stream is not None and not audio_stream.fallback_used:
+            cache_entry.audio = audio_stream.getvalue()
+    return response_text, intent, cache_entry
 
 
 # Text-only response generation (without intent classification) for debugging
@@ -429,9 +2352,10 @@ async def text_response_generation(message: str, core: Main, robot_id: str | Non
     """Generates response from text input without intent classification or audio processing."""
     with Timer("Text response generation"):
         # --- Get relevant documents from vector store ---
-        docs_with_scores = await core.retriever.asearch_with_scores(query=message, k=5, robot_id=robot_id)
+        with Timer("Document retrieval", "retrieval"):
+            docs_with_scores = await core.retriever.asearch_with_scores(query=message, k=5, robot_id=robot_id)
         
-        relevant_docs: List[Document] = [doc for doc, score in docs_with_scores if score > Config.RELEVANCE_THRESHOLD]
+        relevant_docs: List[Document] = relevant_documents(docs_with_scores)
         
         logger.info(f"Retrieved {len(docs_with_scores)} documents, found {len(relevant_docs)} to be relevant.")
 
@@ -462,7 +2386,7 @@ async def text_response_generation(message: str, core: Main, robot_id: str | Non
 
         """
 
-    with Timer("LLM response generation"):
+    with Timer("LLM response generation", "llm"):
         # --- Use ainvoke for the final, non-blocking LLM call ---
         response = await core.llm.ainvoke(prompt)
         response_text = response.content.strip()
@@ -471,47 +2395,155 @@ async def text_response_generation(message: str, core: Main, robot_id: str | Non
     return response_text
 
 
+class StreamingAudioBuffer:
+    """Append-only MP3 buffer for one response; readers can stream it while TTS is still producing chunks."""
+
+    def __init__(self):
+        self.chunks: List[bytes] = []
+        self.closed = False
+        self.error: Exception | None = None
+        self.fallback_used = False  # gTTS audio is never cached
+        self.started = asyncio.Event()  # set once the intent is "talk" and generation begins
+        self._changed = asyncio.Condition()
+
+    async def aappend(self, chunk: bytes) -> None:
+        async with self._changed:
+            self.chunks.append(chunk)
+            self._changed.notify_all()
+
+    async def aclose(self, error: Exception | None = None) -> None:
+        async with self._changed:
+            self.closed = True
+            self.error = error
+            self._changed.notify_all()
+
+    def getvalue(self) -> bytes:
+        return b"".join(self.chunks)
+
+    async def aiter_chunks(self) -> AsyncIterator[bytes]:
+        """Yield every chunk from the start, waiting for new ones until the buffer is closed."""
+        sent = 0
+        while True:
+            async with self._changed:
+                await self._changed.wait_for(lambda: sent < len(self.chunks) or self.closed)
+                pending = self.chunks[sent:]
+                finished = self.closed
+            for chunk in pending:
+                yield chunk
+            sent += len(pending)
+            if finished and sent == len(self.chunks):
+                return
+
+SENTENCE_BOUNDARY = re.compile(r"[.!?…]+[\"')\]]*\s+")
+
+async def astream_sentences(llm, prompt: str, min_chars: int = 20) -> AsyncIterator[str]:
+    """Stream LLM tokens and yield complete sentences (short ones are merged with the next)."""
+    pending = ""
+    async for chunk in llm.astream(prompt):
+        pending += chunk.content or ""
+        while True:
+            cut = next((m.end() for m in SENTENCE_BOUNDARY.finditer(pending) if m.end() >= min_chars), None)
+            if cut is None:
+                break
+            sentence, pending = pending[:cut].strip(), pending[cut:]
+            yield sentence
+    if pending.strip():
+        yield pending.strip()
+
 # Generating speech using ElevenLabs TTS with Google TTS fallback
-async def agenerate_speech_elevenlabs(text: str, save_path: str) -> None:
-    """Generates speech audio from text using ElevenLabs TTS, with Google TTS as a fallback."""
-    with Timer("TTS generation"):
-        logger.debug("Generating TTS for text: %s", text)
-        try:
-            # --- Run blocking ElevenLabs call in a separate thread ---
-            audio_bytes = await asyncio.to_thread(
-                elevenlabs_client.generate,
-                text=text,
-                voice="iWydkXKoiVtvdn4vLKp9",
-                model="eleven_flash_v2_5",
-                optimize_streaming_latency=4
-            )
-            
-            # --- Write to file asynchronously ---
-            async with aiofiles.open(save_path, "wb") as f:
-                if isinstance(audio_bytes, Generator):
-                    for chunk in audio_bytes:
-                        await f.write(chunk)
-                else:
-                    await f.write(audio_bytes)
+async def asynthesize_speech_bytes(text: str) -> Tuple[bytes, bool]:
+    """Synthesizes one piece of text in memory; returns (mp3 bytes, used gTTS fallback)."""
+    try:
+        audio = await asyncio.to_thread(
+            elevenlabs_client.generate,
+            text=text,
+            voice="iWydkXKoiVtvdn4vLKp9",
+            model="eleven_flash_v2_5",
+            optimize_streaming_latency=4
+        )
+        if isinstance(audio, Generator):
+            audio = await asyncio.to_thread(b"".join, audio)
+        return audio, False
+    except Exception as e:
+        logger.error("ElevenLabs TTS failed: %s. Falling back to Google TTS.", e)
+        buf = io.BytesIO()
+        await asyncio.to_thread(gTTS(text=text, lang='en').write_to_fp, buf)
+        return buf.getvalue(), True
 
-            logger.info("Generated TTS audio and saved to %s", save_path)
-        except Exception as e:
-            logger.error("ElevenLabs TTS failed: %s. Falling back to Google TTS.", e)
-            # Fallback to Google TTS (gTTS)
-            try:
-                tts = gTTS(text=text, lang='en')
-                await asyncio.to_thread(tts.save, save_path)
-                logger.info("Generated TTS audio with gTTS and saved to %s", save_path)
-            except Exception as gtts_e:
-                logger.error("Google TTS (gTTS) also failed: %s", gtts_e)
-                raise
+async def astream_speech(prompt: str, llm, audio_stream: StreamingAudioBuffer) -> str:
+    """LLM -> sentence splitter -> TTS pipeline; TTS of one sentence overlaps generation of the next."""
+    sentences: List[str] = []
+    queue: asyncio.Queue = asyncio.Queue()
 
+    async def produce():
+        try:
+            async for sentence in astream_sentences(llm, prompt, Config.STREAMING_MIN_SENTENCE_CHARS):
+                sentences.append(sentence)
+                await queue.put(sentence)
+        finally:
+            await queue.put(None)
+
+    producer = asyncio.create_task(produce())
+    try:
+        first = True
+        while (sentence := await queue.get()) is not None:
+            with Timer("Sentence TTS", "tts"):
+                audio, used_fallback = await asynthesize_speech_bytes(sentence)
+            audio_stream.fallback_used |= used_fallback
+            await audio_stream.aappend(audio)
+            if first:
+                logger.info("First streamed audio chunk ready (%d bytes)", len(audio))
+                first = False
+        await producer  # surface LLM errors
+    except BaseException as e:
+        producer.cancel()
+        await audio_stream.aclose(e if isinstance(e, Exception) else None)
+        raise
+    await audio_stream.aclose()
+    return " ".join(sentences)
 
 # Initialize Quart app and CORS for different origins
 app = Quart(__name__)
 app = cors(app, allow_origin="*", allow_credentials=False)
 core = Main()
 
+@app.before_serving
+async def startup():
+    await asyncio.to_thread(core.mqtt_client.connect)
+    await asyncio.to_thread(core.query_cache.load)
+    core.mongo.open()
+    if core.db_logger is not None:
+        core.db_logger.start()
+    if Config.VECTOR_CHANGE_STREAM:
+        core.retriever.start_watching()
+    if core.knowledge_store is not None:
+        try:
+            await core.knowledge_store.aensure_indexes()
+        except Exception as e:
+            logger.warning(f"Could not create vector_db indexes: {e}")
+    if core.db_logger is not None:
+        try:
+            await core.db_logger.aensure_indexes()
+        except Exception as e:
+            logger.warning(f"Could not create chat log indexes: {e}")
+    if core.ingestion_queue is not None:
+        await core.ingestion_queue.astart()
+
+@app.after_serving
+async def shutdown():
+    await core.retriever.astop_watching()
+    if core.ingestion_queue is not None:
+        await core.ingestion_queue.astop()
+    await core.retriever.asave_indexes()
+    await core.audio_store.aclose()
+    try:
+        await asyncio.to_thread(core.query_cache.save)
+    except Exception as e:
+        logger.warning(f"Could not persist query embedding cache: {e}")
+    if core.db_logger is not None:
+        await core.db_logger.astop()  # flush buffered chat logs while the client is still open
+    core.mongo.close()
+
 @app.route('/', methods=['GET'])
 async def root():
     """Root endpoint to handle health checks and basic requests."""
@@ -524,7 +2556,9 @@ async def root():
             "detect_wakeword": "/detect_wakeword", 
             "process_input": "/process_input",
             "audio_response": "/audio_response",
-            "chat_logs": "/api/chat-logs"
+            "chat_logs": "/api/chat-logs",
+            "chat_log_analytics": "/api/chat-logs/analytics",
+            "metrics": "/metrics"
         }
     })
 
@@ -533,6 +2567,23 @@ async def health_check():
     """Health check endpoint for load balancers and monitoring."""
     return jsonify({"status": "healthy"}), 200
 
+@app.route('/metrics', methods=['GET'])
+async def metrics():
+    """Cache and pipeline counters for monitoring."""
+    return jsonify({
+        "query_embedding_cache": core.query_cache.stats(),
+        "chunk_embeddings": core.embedding_store.stats(),
+        "vector_index": core.retriever.stats(),
+        "mongodb": core.mongo.stats(),
+        "chat_log_writer": core.db_logger.stats() if core.db_logger is not None else None,
+        "response_cache": core.response_cache.stats() if core.response_cache is not None else None,
+        "intent_classifier": core.intent_classifier.stats(),
+        "audio_store": core.audio_store.stats(),
+        "audio_preprocessing": core.audio_preprocessor.stats() if core.audio_preprocessor is not None else None,
+        "wakeword_local": core.wakeword_detector.counts if core.wakeword_detector is not None else None,
+        "speculative_retrieval": {**core.speculation_stats, "wasted_seconds": round(core.speculation_stats["wasted_seconds"], 3)},
+    })
+
 @app.route('/text_chat', methods=['POST'])
 async def text_chat():
     """Endpoint to process text input and generate response without audio processing."""
@@ -552,6 +2603,7 @@ async def text_chat():
             if not message or not message.strip():
                 return jsonify({"error": "Message cannot be empty"}), 400
             
+            begin_turn()
             # Generate response using text-only function
             response = await text_response_generation(message.strip(), core, robot_id)
             
@@ -562,9 +2614,9 @@ async def text_chat():
                 "time": datetime.datetime.now().isoformat()
             }
             
-            # Log to MongoDB in the background
+            # Queue for the batched MongoDB writer
             if core.db_logger is not None:
-                asyncio.create_task(core.db_logger.alog_interaction(message.strip(), response, robot_id))
+                await core.db_logger.alog_interaction(message.strip(), response, robot_id, timings=turn_latency())
             
             logger.info(f"Text chat processed - Input: {message.strip()}, Output: {response}")
             
@@ -578,201 +2630,358 @@ async def text_chat():
 async def detect_wakeword():
     """Endpoint to detect wake word from uploaded audio using speech-to-text and fuzzy matching."""
     with Timer("Full wakeword detection"):
-        request_data = await request.get_data()
-        # Ensure request_data is bytes
-        if isinstance(request_data, str):
-            request_data = request_data.encode()
-        if len(request_data) > Config.MAX_AUDIO_SIZE:
-            logger.warning("Audio file too large: %d bytes", len(request_data))
+        audio = await aread_audio_body(Config.MAX_AUDIO_SIZE)
+        if audio is None:
             return jsonify({"error": "Audio file too large"}), 413
 
-        async with temp_audio_file("wakeword_") as wav_path:
-            async with aiofiles.open(wav_path, "wb") as f:
-                await f.write(request_data)
-
-            try:
-                async with aiofiles.open(wav_path, "rb") as audio_file:
-                    audio_data = await audio_file.read()
-                with Timer("Audio transcription"):
-                    transcript = await openai_client.audio.transcriptions.create(
-                        model="whisper-1",
-                        file=("audio.mp3", audio_data),
-                        language="en"
-                    )
-                text = transcript.text
-                logger.info("Transcription result: %s", text)
-
+        try:
+            wakeword_detected = None
+            if core.wakeword_detector is not None:
+                try:
+                    wakeword_detected = await core.wakeword_detector.adetect(audio)
+                except Exception as e:
+                    logger.warning("Local wakeword detection failed: %s", e)
+                if wakeword_detected is None and not Config.WAKEWORD_CLOUD_FALLBACK:
+                    wakeword_detected = False
+                audio.seek(0)
+
+            if wakeword_detected is None:
+                # --- Cloud STT: default mode, or the local scorer was uncertain ---
+                text = await atranscribe_audio(audio)
                 wakeword_detected = detect_wake_word_fuzzy(text)
-                logger.info("Wake word detected: %s", wakeword_detected)
+            logger.info("Wake word detected: %s", wakeword_detected)
 
-                return jsonify({"wakeword_detected": wakeword_detected})
-            except OpenAIError as e:
-                logger.error("Transcription failed: %s", e)
-                return jsonify({"error": f"Transcription failed: {str(e)}"}), 500
-            except Exception as e:
-                logger.error("Unexpected error in wakeword detection: %s", e)
-                return jsonify({"error": f"Unexpected error: {str(e)}"}), 500
+            return jsonify({"wakeword_detected": wakeword_detected})
+        except OpenAIError as e:
+            logger.error("Transcription failed: %s", e)
+            return jsonify({"error": f"Transcription failed: {str(e)}"}), 500
+        except Exception as e:
+            logger.error("Unexpected error in wakeword detection: %s", e)
+            return jsonify({"error": f"Unexpected error: {str(e)}"}), 500
 
 # Receiving audio input
 @app.route('/process_input', methods=['POST'])
 async def process_input():
     """Endpoint to process user audio input, transcribe, generate response, intent, and TTS if needed."""
     with Timer("Full input processing"):
-        request_data = await request.get_data()
         robot_id = request.args.get('robot_id') or request.headers.get('X-Robot-Id')
         if not robot_id or not str(robot_id).strip():
             return jsonify({"error": "robot_id is required"}), 400
-        # Ensure request_data is bytes
-        if isinstance(request_data, str):
-            request_data = request_data.encode()
-        if len(request_data) > Config.MAX_AUDIO_SIZE:
+        audio = await aread_audio_body(Config.MAX_AUDIO_SIZE)
+        if audio is None:
             return jsonify({"error": "Audio file too large"}), 413
 
-        async with temp_audio_file("upload_") as wav_path:
-            async with aiofiles.open(wav_path, "wb") as f:
-                await f.write(request_data)
-            
-            try:
-                # --- Read the file's bytes asynchronously first ---
-                async with aiofiles.open(wav_path, "rb") as f:
-                    audio_data = await f.read()
-
-                with Timer("Audio transcription"):
-                    # --- Pass the raw bytes (in a tuple) to the OpenAI client ---
-                    transcript = await openai_client.audio.transcriptions.create(
-                        model="whisper-1",
-                        file=("audio.mp3", audio_data), 
-                        language="en"
-                    )
-                
-                transcribed_text = transcript.text
-                logger.info("Transcription result: %s", transcribed_text)
-
-                response, intent = await concurrent_response_generation(transcribed_text, core, robot_id)
-
-                # Send Q n A to the database logger only when there's a response (intent is "talk")
-                if core.db_logger is not None and intent == "talk" and response:
-                    asyncio.create_task(core.db_logger.alog_interaction(transcribed_text, response, robot_id))
-                
-                # Publish to MQTT in the background
-                asyncio.create_task(core.mqtt_client.apublish_command(intent, robot_id))
-
-                # Clean previous per-robot audio file
-                if robot_id and robot_id in core.current_audio_files:
-                    old_path = core.current_audio_files.get(robot_id)
-                    if old_path and os.path.exists(old_path):
-                        try:
-                            os.remove(old_path)
-                            logger.debug(f"Deleted previous audio file for {robot_id}: {old_path}")
-                        except OSError as e:
-                            logger.warning(f"Failed to delete previous audio file for {robot_id}: {e}")
-                    core.current_audio_files.pop(robot_id, None)
-
-                if intent == "talk":
-                    persistent_path = os.path.join(Config.UPLOAD_FOLDER, f"response_{robot_id or 'default'}_{int(time.time())}.mp3")
-                    await agenerate_speech_elevenlabs(response, persistent_path)
-                    if robot_id:
-                        core.current_audio_files[robot_id] = persistent_path
-                    else:
-                        core.current_audio_files["default"] = persistent_path
-                    
-                    return jsonify({
-                        "intent": intent,
-                        "response": response,
-                        "audio_url": f"/audio_response{f'?robot_id={robot_id}' if robot_id else ''}"
-                    })
+        begin_turn()
+        try:
+            filename = "audio.mp3"
+            if core.audio_preprocessor is not None:
+                audio, filename = await core.audio_preprocessor.aprocess(audio)
+            transcribed_text = await atranscribe_audio(audio, filename)
+
+            if Config.STREAMING_TTS:
+                return await astart_streaming_turn(transcribed_text, robot_id)
+
+            response, intent, cache_entry = await concurrent_response_generation(transcribed_text, core, robot_id)
+
+            # Publish to MQTT in the background
+            asyncio.create_task(core.mqtt_client.apublish_command(intent, robot_id))
+
+            # Clean previous per-robot audio
+            await aclear_robot_audio(robot_id)
+
+            if intent == "talk":
+                if cache_entry is not None and cache_entry.audio is not None:
+                    # Cached answer: reuse the audio synthesized the first time
+                    audio_bytes = cache_entry.audio
                 else:
-                    return jsonify({"intent": intent})
+                    with Timer("TTS generation", "tts"):
+                        audio_bytes, used_fallback = await asynthesize_speech_bytes(response)
+                    if cache_entry is not None and not used_fallback:
+                        core.response_cache.attach_audio(cache_entry, audio_bytes)
+                await core.audio_store.aput(robot_id or "default", audio_bytes)
+
+                # Send Q n A to the database logger only when there's a response (intent is "talk"), once TTS is timed
+                if core.db_logger is not None and response:
+                    await core.db_logger.alog_interaction(transcribed_text, response, robot_id, intent, turn_latency())
+
+                return jsonify({
+                    "intent": intent,
+                    "response": response,
+                    "audio_url": f"/audio_response{f'?robot_id={robot_id}' if robot_id else ''}"
+                })
+            else:
+                # Not logged, but counted in the analytics rollups
+                if core.db_logger is not None:
+                    await core.db_logger.arecord_turn(robot_id, intent, turn_latency())
+                return jsonify({"intent": intent})
+
+        except OpenAIError as e:
+            logger.error("Transcription failed: %s", e)
+            return jsonify({"error": f"Transcription failed: {str(e)}"}), 500
+        except Exception as e:
+            logger.error("Unexpected error in upload: %s", e, exc_info=True)
+            return jsonify({"error": f"Unexpected error: {str(e)}"}), 500
 
-            except OpenAIError as e:
-                logger.error("Transcription failed: %s", e)
-                return jsonify({"error": f"Transcription failed: {str(e)}"}), 500
-            except Exception as e:
-                logger.error("Unexpected error in upload: %s", e, exc_info=True)
-                return jsonify({"error": f"Unexpected error: {str(e)}"}), 500
+async def aclear_robot_audio(robot_id: str | None) -> None:
+    """Drop the previous response audio (stored or streaming) for a robot."""
+    await core.audio_store.aremove(robot_id or "default")
+    core.audio_streams.pop(robot_id or "default", None)
+
+async def afinish_streaming_turn(task: asyncio.Task, audio_stream: StreamingAudioBuffer, transcribed_text: str, robot_id: str | None) -> None:
+    """Waits for a streamed turn to finish in the background, then logs it."""
+    key = robot_id or "default"
+    try:
+        response, intent, _ = await task
+    except Exception as e:
+        logger.error("Streaming response failed: %s", e, exc_info=True)
+        return
+    finally:
+        # Hand the finished audio to the store (Range/ETag support) unless a newer turn replaced the stream
+        if core.audio_streams.get(key) is audio_stream and audio_stream.closed and task.done() and not task.cancelled() and task.exception() is None:
+            await core.audio_store.aput(key, audio_stream.getvalue())
+            core.audio_streams.pop(key, None)
+    if core.db_logger is not None and response:
+        await core.db_logger.alog_interaction(transcribed_text, response, robot_id, intent, turn_latency())
+
+async def astart_streaming_turn(transcribed_text: str, robot_id: str | None):
+    """Answers as soon as the intent is known; for 'talk', audio is streamed from /audio_response while it is synthesized."""
+    audio_stream = StreamingAudioBuffer()
+    task = asyncio.create_task(concurrent_response_generation(transcribed_text, core, robot_id, audio_stream))
+    started = asyncio.create_task(audio_stream.started.wait())
+    try:
+        await asyncio.wait([task, started], return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        started.cancel()
+
+    audio_url = f"/audio_response{f'?robot_id={robot_id}' if robot_id else ''}"
+    if not task.done():
+        # --- LLM + TTS are still running: hand out the stream right away ---
+        await aclear_robot_audio(robot_id)
+        core.audio_streams[robot_id or "default"] = audio_stream
+        asyncio.create_task(core.mqtt_client.apublish_command("talk", robot_id))
+        asyncio.create_task(afinish_streaming_turn(task, audio_stream, transcribed_text, robot_id))
+        return jsonify({"intent": "talk", "audio_url": audio_url, "streaming": True})
+
+    response, intent, cache_entry = task.result()
+    asyncio.create_task(core.mqtt_client.apublish_command(intent, robot_id))
+    if intent != "talk":
+        if core.db_logger is not None:
+            await core.db_logger.arecord_turn(robot_id, intent, turn_latency())
+        return jsonify({"intent": intent})
+
+    # --- Response cache hit: the whole answer is known, store its audio directly ---
+    await aclear_robot_audio(robot_id)
+    if cache_entry is not None and cache_entry.audio is not None:
+        audio = cache_entry.audio
+    else:
+        with Timer("TTS generation", "tts"):
+            audio, used_fallback = await asynthesize_speech_bytes(response)
+        if cache_entry is not None and not used_fallback:
+            core.response_cache.attach_audio(cache_entry, audio)
+    await core.audio_store.aput(robot_id or "default", audio)
+    if core.db_logger is not None and response:
+        await core.db_logger.alog_interaction(transcribed_text, response, robot_id, intent, turn_latency())
+    return jsonify({"intent": intent, "response": response, "audio_url": audio_url})
 
 # Sending audio response
 @app.route('/audio_response')
 async def audio_response():
-    """Endpoint to stream the generated audio response file to the client."""
+    """Endpoint to serve the generated audio response to the client (supports Range requests and ETags)."""
     with Timer("Audio response streaming"):
         robot_id = request.args.get('robot_id')
         if not robot_id or not str(robot_id).strip():
             return Response("robot_id is required", status=400)
-        audio_file = None
-        if robot_id:
-            audio_file = core.current_audio_files.get(robot_id)
-        else:
-            audio_file = core.current_audio_files.get("default")
-        if audio_file and os.path.exists(audio_file):
-            
-            async def generate():
-                async with aiofiles.open(audio_file, "rb") as f:
-                    while chunk := await f.read(4096):
-                        yield chunk
 
-            return Response(generate(), mimetype="audio/mpeg", headers={"Content-Disposition": "inline"})
-        
-        return Response("No audio available or file not found.", status=404)
+        # A streamed response is served as it grows
+        audio_stream = core.audio_streams.get(robot_id)
+        if audio_stream is not None:
+            if audio_stream.closed and not audio_stream.chunks:
+                return Response("No audio available or file not found.", status=404)
+            return Response(audio_stream.aiter_chunks(), mimetype="audio/mpeg", headers={"Content-Disposition": "inline"})
+
+        entry = await core.audio_store.aget(robot_id)
+        if entry is None:
+            return Response("No audio available or file not found.", status=404)
+
+        headers = {"Content-Disposition": "inline", "Accept-Ranges": "bytes", "ETag": entry.etag, "Cache-Control": "no-cache"}
+        if request.headers.get("If-None-Match") == entry.etag:
+            return Response("", status=304, headers=headers)
+
+        byte_range = parse_byte_range(request.headers.get("Range"), entry.size)
+        if byte_range is False:
+            return Response("", status=416, headers={**headers, "Content-Range": f"bytes */{entry.size}"})
+        start, end = byte_range if byte_range is not None else (0, entry.size - 1)
+        try:
+            body = await core.audio_store.aread(entry, start, end + 1)
+        except FileNotFoundError:
+            # Spill file removed underneath us: same as an expired response
+            await core.audio_store.aremove(robot_id)
+            return Response("No audio available or file not found.", status=404)
+        if byte_range is None:
+            return Response(body, status=200, mimetype="audio/mpeg", headers=headers)
+        return Response(body, status=206, mimetype="audio/mpeg", headers={**headers, "Content-Range": f"bytes {start}-{end}/{entry.size}"})
+
+def parse_byte_range(header: str | None, size: int) -> Tuple[int, int] | None | bool:
+    """Parses a single-range "bytes=" header into inclusive (start, end); None = no/ignored range, False = unsatisfiable."""
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    start_s, _, end_s = header[len("bytes="):].strip().partition("-")
+    try:
+        if start_s == "":
+            # Suffix range: the last N bytes
+            length = int(end_s)
+            if length <= 0:
+                return False
+            return max(size - length, 0), size - 1
+        start = int(start_s)
+        end = int(end_s) if end_s else size - 1
+    except ValueError:
+        return None
+    if start >= size or end < start:
+        return False
+    return start, min(end, size - 1)
 
 # Database history endpoint
 @app.route('/api/chat-logs', methods=['GET'])
 async def get_chat_logs():
-    """Endpoint to fetch all chat logs from the database."""
+    """Endpoint to fetch a robot's chat logs, newest first, one page at a time.
+
+    Query: robot_id (required), limit, after (the "next_after" of the previous page), from/to (ISO date or datetime,
+    read in tz when naive), fields (comma-separated subset), tz. format=ndjson streams every match as an export.
+    """
     with Timer("Fetch chat logs from DB"):
         if core.db_logger is None:
             return jsonify({"error": "Database logger is not available. Cannot fetch chat logs."}), 503
 
+        # Require filter by robot_id
+        robot_id = request.args.get('robot_id')
+        if not robot_id or not str(robot_id).strip():
+            return jsonify({"error": "robot_id is required"}), 400
+
+        from bson import ObjectId
+        args = request.args
+        tz = args.get("tz") or Config.CHAT_LOGS_TIMEZONE
         try:
-            # Require filter by robot_id
-            robot_id = request.args.get('robot_id')
-            if not robot_id or not str(robot_id).strip():
-                return jsonify({"error": "robot_id is required"}), 400
-            query = {"robot_id": robot_id}
-            # Use ObjectId for more reliable sorting by insertion order
-            cursor = core.db_logger.collection.find(query).sort("_id", -1)
-            chat_logs = []
-            async for doc in cursor:
-                doc["_id"] = str(doc["_id"])  # Convert ObjectId to string for JSON
-                
-                # Format time to Indonesian timezone
-                if "time" in doc:
-                    try:
-                        # Handle different time formats
-                        if isinstance(doc["time"], float):
-                            # Convert float timestamp to datetime
-                            utc_time = datetime.datetime.fromtimestamp(doc["time"], pytz.utc)
-                        elif isinstance(doc["time"], datetime.datetime):
-                            # Handle datetime objects
-                            if doc["time"].tzinfo is None:
-                                utc_time = pytz.utc.localize(doc["time"])
-                            else:
-                                utc_time = doc["time"]
-                        else:
-                            # Skip if time format is unknown
-                            continue
-                        
-                        # Convert to Indonesian timezone
-                        indonesia_time = utc_time.astimezone(pytz.timezone('Asia/Jakarta'))
-                        doc["time"] = indonesia_time.isoformat()  # ISO format for frontend Date parsing
-                    except Exception as e:
-                        logger.warning(f"Could not format time for document {doc.get('_id')}: {e}")
-                        # Keep original time if formatting fails
-                        pass
-                
-                chat_logs.append(doc)
-            
-            logger.info(f"Retrieved {len(chat_logs)} chat logs from database")
-            return jsonify(chat_logs)
-            
+            pytz.timezone(tz)
+            start = parse_log_time(args.get("from"), tz)
+            end = parse_log_time(args.get("to"), tz, end=True)
+            limit = int(args["limit"]) if args.get("limit") else None
+        except (ValueError, pytz.UnknownTimeZoneError) as e:
+            return jsonify({"error": f"Invalid query parameter: {e}"}), 400
+        if limit is not None and limit < 1:
+            # Checked before an export starts streaming: MongoDB would only reject it after the 200 is sent
+            return jsonify({"error": "limit must be at least 1"}), 400
+        after = args.get("after")
+        if after and not ObjectId.is_valid(after):
+            return jsonify({"error": "after must be a chat log _id"}), 400
+        fields = [f.strip() for f in args["fields"].split(",") if f.strip()] if args.get("fields") else None
+        unknown = set(fields or []) - set(CHAT_LOG_FIELDS)
+        if unknown:
+            return jsonify({"error": f"Unknown fields: {', '.join(sorted(unknown))}", "fields": CHAT_LOG_FIELDS}), 400
+
+        if args.get("format") == "ndjson":
+            # --- Export: stream the whole range (or the first `limit`) without building it in memory ---
+            cursor = core.db_logger.iter_logs(robot_id, after, start, end, fields, tz, limit)
+            response = Response(aexport_chat_logs(cursor), mimetype="application/x-ndjson",
+                                headers={"Content-Disposition": f'attachment; filename="chat_logs_{robot_id}.ndjson"'})
+            response.timeout = None  # large exports outlive the default response timeout
+            return response
+
+        limit = min(limit or Config.CHAT_LOGS_PAGE_SIZE, Config.CHAT_LOGS_MAX_PAGE_SIZE)
+        try:
+            # One extra row tells whether another page exists
+            chat_logs = await core.db_logger.iter_logs(robot_id, after, start, end, fields, tz, limit + 1).to_list(length=None)
         except Exception as e:
             logger.error(f"Error fetching chat logs: {e}")
             return jsonify({"error": f"Database error: {str(e)}"}), 500
+        has_more = len(chat_logs) > limit
+        chat_logs = chat_logs[:limit]
+        next_after = chat_logs[-1]["_id"] if has_more and chat_logs else None
+        logger.info(f"Retrieved {len(chat_logs)} chat logs from database")
+
+        # Logs are append-only: a page is unchanged while its query and first/last entries are
+        etag = '"' + hashlib.md5(
+            f"{request.query_string!r}|{len(chat_logs)}|{chat_logs[0]['_id'] if chat_logs else ''}|{next_after}".encode()
+        ).hexdigest() + '"'
+        headers = {"ETag": etag, "Cache-Control": "private, max-age=60" if after else "no-cache"}
+        if request.headers.get("If-None-Match") == etag:
+            return Response("", status=304, headers=headers)
+        response = jsonify({"logs": chat_logs, "next_after": next_after})
+        response.headers.update(headers)
+        return response
+
+def parse_log_time(value: str | None, tz: str, end: bool = False) -> datetime.datetime | None:
+    """ISO date or datetime ("Z" allowed); naive values are in tz. A bare date as the end bound includes that whole day."""
+    if not value:
+        return None
+    value = value.strip()
+    parsed = datetime.datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if end and len(value) == 10:
+        parsed += datetime.timedelta(days=1)
+    if parsed.tzinfo is None:
+        parsed = pytz.timezone(tz).localize(parsed)
+    return parsed
+
+async def aexport_chat_logs(cursor) -> AsyncIterator[bytes]:
+    try:
+        async for doc in cursor:
+            yield (json.dumps(doc, ensure_ascii=False, default=str) + "\n").encode("utf-8")
+    except Exception as e:
+        # Headers are already sent; end the stream early and leave a trace
+        logger.error(f"Chat log export failed: {e}")
+
+@app.route('/api/chat-logs/analytics', methods=['GET'])
+async def get_chat_log_analytics():
+    """Endpoint to summarize a robot's turns from the precomputed rollups: counts per hour or day, intent distribution,
+    top questions and per-stage latency percentiles.
+
+    Query: robot_id (required), granularity (hour | day), from/to (as for /api/chat-logs; default: the last
+    CHAT_ANALYTICS_DEFAULT_DAYS days up to now), tz, top (number of questions, 0 to skip).
+    """
+    with Timer("Chat log analytics"):
+        if core.db_logger is None:
+            return jsonify({"error": "Database logger is not available. Cannot compute analytics."}), 503
+
+        robot_id = request.args.get('robot_id')
+        if not robot_id or not str(robot_id).strip():
+            return jsonify({"error": "robot_id is required"}), 400
+
+        args = request.args
+        tz = args.get("tz") or Config.CHAT_LOGS_TIMEZONE
+        granularity = args.get("granularity", "day")
+        if granularity not in ("hour", "day"):
+            return jsonify({"error": "granularity must be 'hour' or 'day'"}), 400
+        try:
+            zone = pytz.timezone(tz)
+            end = parse_log_time(args.get("to"), tz, end=True) or datetime.datetime.now(datetime.timezone.utc)
+            start = parse_log_time(args.get("from"), tz)
+            if start is None:
+                first_day = end.astimezone(zone).date() - datetime.timedelta(days=Config.CHAT_ANALYTICS_DEFAULT_DAYS - 1)
+                start = zone.localize(datetime.datetime.combine(first_day, datetime.time.min))
+            top = min(max(int(args.get("top", 10)), 0), 100)
+        except (ValueError, pytz.UnknownTimeZoneError) as e:
+            return jsonify({"error": f"Invalid query parameter: {e}"}), 400
+        if start >= end or end - start > datetime.timedelta(days=Config.CHAT_ANALYTICS_MAX_DAYS):
+            return jsonify({"error": f"from must be before to, at most {Config.CHAT_ANALYTICS_MAX_DAYS} days apart"}), 400
+
+        try:
+            summary = await core.db_logger.aanalytics(robot_id, start, end, granularity, tz, top)
+        except Exception as e:
+            logger.error(f"Error computing chat log analytics: {e}")
+            return jsonify({"error": f"Database error: {str(e)}"}), 500
+        return jsonify({
+            "robot_id": robot_id,
+            "granularity": granularity,
+            "tz": tz,
+            "from": start.isoformat(),
+            "to": end.isoformat(),
+            **summary,
+        })
 
 # RAG Knowledge Endpoints
 @app.route('/rag/knowledge', methods=['POST'])
 async def upload_rag_knowledge():
-    """Upload a PDF, generate embeddings per chunk, and store in MongoDB vector_db."""
+    """Queue a PDF upload; a background job extracts, chunks, embeds and stores it in MongoDB vector_db."""
     if core.knowledge_store is None:
         return jsonify({"error": "Knowledge store is not available"}), 503
 
@@ -792,46 +3001,29 @@ async def upload_rag_knowledge():
             return jsonify({"error": "Only PDF files are supported"}), 400
 
         pdf_bytes = file.read()
-        full_text = extract_text_from_pdf_bytes(pdf_bytes)
-        if not full_text:
-            return jsonify({"error": "Could not extract any text from PDF"}), 400
-
-        texts = chunk_text(full_text, chunk_size=500, overlap=100)
-        if not texts:
-            return jsonify({"error": "No chunks generated from PDF text"}), 400
-
-        with Timer("Embedding generation"):
-            embeddings: List[List[float]] = await core.embeddings_model.aembed_documents(texts)
-
-        now_utc = datetime.datetime.utcnow()
-        doc = {
-            "user_id": user_id,
-            **({"robot_id": robot_id} if robot_id else {}),
-            "filename": filename_override or (file.filename or 'document.pdf'),
-            "full_text": full_text,
-            "chunks": [
-                {
-                    "chunk_id": str(uuid.uuid4()),
-                    "content": content,
-                    "embedding": embedding,
-                    **({"robot_id": robot_id} if robot_id else {}),
-                }
-                for content, embedding in zip(texts, embeddings)
-            ],
-            "uploaded_at": now_utc,
-        }
-
-        inserted_id = await core.knowledge_store.ainsert_document(doc)
+        job_id = await core.ingestion_queue.asubmit(user_id, robot_id, filename_override or (file.filename or 'document.pdf'), pdf_bytes)
 
-        return jsonify({"_id": inserted_id, "chunk_count": len(texts)}), 201
-    except OpenAIError as e:
-        logger.error(f"Embedding generation failed: {e}")
-        return jsonify({"error": f"Embedding generation failed: {str(e)}"}), 500
+        return jsonify({"job_id": job_id, "status": "queued", "status_url": f"/rag/knowledge/jobs/{job_id}"}), 202
     except Exception as e:
         logger.error(f"Unexpected error in RAG upload: {e}")
         return jsonify({"error": f"Unexpected error: {str(e)}"}), 500
 
 
+@app.route('/rag/knowledge/jobs/<job_id>', methods=['GET'])
+async def get_rag_ingestion_job(job_id: str):
+    """Report stage, progress and per-stage timings of a background RAG upload."""
+    if core.ingestion_queue is None:
+        return jsonify({"error": "Knowledge store is not available"}), 503
+    try:
+        job = await core.ingestion_queue.aget_job(job_id)
+        if job is None:
+            return jsonify({"error": "Job not found"}), 404
+        return jsonify(job)
+    except Exception as e:
+        logger.error(f"Error fetching RAG ingestion job: {e}")
+        return jsonify({"error": f"Database error: {str(e)}"}), 500
+
+
 @app.route('/rag/knowledge', methods=['GET'])
 async def list_rag_knowledge():
     """List knowledge documents for a user (no embeddings in response)."""
@@ -847,18 +3039,37 @@ async def list_rag_knowledge():
         return jsonify({"error": f"Database error: {str(e)}"}), 500
 
 
+@app.route('/rag/knowledge/<object_id>', methods=['GET'])
+async def get_rag_knowledge(object_id: str):
+    """One knowledge document with its full text (for preview); chunks and embeddings are left out."""
+    if core.knowledge_store is None:
+        return jsonify({"error": "Knowledge store is not available"}), 503
+    try:
+        doc = await core.knowledge_store.aget_document(object_id, {"chunks": 0})
+        if doc is None:
+            return jsonify({"error": "Document not found"}), 404
+        doc["_id"] = str(doc["_id"])
+        return jsonify(doc)
+    except Exception as e:
+        logger.error(f"Error fetching RAG knowledge: {e}")
+        return jsonify({"error": f"Database error: {str(e)}"}), 500
+
+
 @app.route('/rag/knowledge/<object_id>', methods=['DELETE'])
 async def delete_rag_knowledge(object_id: str):
-    """Delete a knowledge document by its _id and all its vectors (embedded in doc)."""
+    """Delete a knowledge document by its _id and release its chunk embeddings."""
     if core.knowledge_store is None:
         return jsonify({"error": "Knowledge store is not available"}), 503
     try:
-        # Fetch the document to get chroma ids for cleanup
-        doc = await core.knowledge_store.aget_document(object_id)
+        # Only the embedding references are needed for cleanup
+        doc = await core.knowledge_store.aget_document(object_id, {"chunks.embedding_id": 1})
         if doc is None:
             return jsonify({"error": "Document not found"}), 404
 
         deleted = await core.knowledge_store.adelete_document(object_id)
+        core.retriever.remove_document(object_id)
+        if deleted:
+            await core.embedding_store.arelease([c.get("embedding_id") for c in doc.get("chunks") or []])
         return jsonify({"deleted": True})
     except Exception as e:
         logger.error(f"Error deleting RAG knowledge: {e}")
@@ -0,0 +1,128 @@
+# --- Chat-log rollups behind /api/chat-logs/analytics ---
+# The chat-log writer folds every turn into hourly rollup documents (count, intents, latency histograms) and per-day
+# question counters, so dashboards read a few hundred small documents instead of rescanning chat_logs.
+import bisect
+import datetime
+import hashlib
+import re
+from collections import Counter
+from typing import Dict, Iterable, List, Tuple
+
+# Upper bin edges (ms); a bin holds (previous edge, edge], the last bin everything slower
+LATENCY_BUCKETS_MS = [25, 50, 100, 150, 200, 300, 400, 500, 750, 1000, 1500, 2000, 3000, 4000, 5000, 7500, 10000, 15000, 20000, 30000, 60000]
+PERCENTILES = (50, 90, 95, 99)
+UNCLASSIFIED = "unclassified"  # turns logged without an intent (e.g. /text_chat)
+
+_PUNCT_RE = re.compile(r"[^\w\s]")
+_SPACE_RE = re.compile(r"\s+")
+
+
+def event_time(value) -> datetime.datetime | None:
+    """UTC datetime from a log "time": aware or naive-UTC datetime (as read back from MongoDB) or a float timestamp."""
+    if isinstance(value, datetime.datetime):
+        return value.astimezone(datetime.timezone.utc) if value.tzinfo else value.replace(tzinfo=datetime.timezone.utc)
+    if isinstance(value, (int, float)):
+        return datetime.datetime.fromtimestamp(value, datetime.timezone.utc)
+    return None
+
+
+def normalize_question(text: str) -> str:
+    """Case, punctuation and spacing folded, so "What is Extra Joss?" and "what is extra joss" count together."""
+    return _SPACE_RE.sub(" ", _PUNCT_RE.sub(" ", text.lower())).strip()
+
+
+def latency_bin(ms: float) -> int:
+    return bisect.bisect_left(LATENCY_BUCKETS_MS, ms)
+
+
+def rollup_updates(events: Iterable[dict]) -> List[Tuple[dict, dict]]:
+    """(filter, update) upserts for a batch of turns, merged per rollup document.
+
+    A turn is a chat-log document ({"input", "time", "robot_id", "intent", "latency_ms"}); turns that are not logged
+    (non-talk intents) carry no "input" and only count towards volume, intents and latency.
+    """
+    docs: Dict[str, Tuple[dict, Counter]] = {}
+    for event in events:
+        when = event_time(event.get("time"))
+        if when is None:
+            continue
+        robot_id = event.get("robot_id") or "default"
+        hour = when.replace(minute=0, second=0, microsecond=0, tzinfo=None)
+        _, inc = docs.setdefault(f"{robot_id}|hour|{hour:%Y%m%d%H}", ({"robot_id": robot_id, "kind": "hour", "bucket": hour}, Counter()))
+        inc["count"] += 1
+        inc[f"intents.{event.get('intent') or UNCLASSIFIED}"] += 1
+        for stage, ms in (event.get("latency_ms") or {}).items():
+            inc[f"latency.{stage}.{latency_bin(ms)}"] += 1
+            inc[f"latency_sum.{stage}"] += ms
+
+        question = normalize_question(event.get("input") or "")
+        if question:
+            day = hour.replace(hour=0)
+            key = hashlib.sha1(question.encode("utf-8")).hexdigest()[:16]
+            _, inc = docs.setdefault(f"{robot_id}|question|{day:%Y%m%d}|{key}", (
+                {"robot_id": robot_id, "kind": "question", "bucket": day, "key": key, "question": event["input"].strip()}, Counter()
+            ))
+            inc["count"] += 1
+    return [({"_id": _id}, {"$setOnInsert": fields, "$inc": dict(inc)}) for _id, (fields, inc) in docs.items()]
+
+
+def histogram_percentile(histogram: Dict[int, int], q: float) -> float | None:
+    """q-th percentile (0..100) from binned counts, interpolated linearly inside the bin."""
+    total = sum(histogram.values())
+    if not total:
+        return None
+    target = q / 100 * total
+    seen = 0
+    for b in sorted(histogram):
+        n = histogram[b]
+        if n and seen + n >= target:
+            lower = LATENCY_BUCKETS_MS[b - 1] if b > 0 else 0.0
+            if b >= len(LATENCY_BUCKETS_MS):
+                return float(lower)  # open-ended last bin: report its lower edge
+            return round(lower + (target - seen) / n * (LATENCY_BUCKETS_MS[b] - lower), 1)
+        seen += n
+    return float(LATENCY_BUCKETS_MS[-1])
+
+
+def summarize_hours(hour_docs: Iterable[dict], granularity: str, tz: datetime.tzinfo) -> dict:
+    """Counts per hour/day in tz, intent distribution and per-stage latency percentiles from hourly rollups."""
+    series: Counter = Counter()
+    intents: Counter = Counter()
+    histograms: Dict[str, Counter] = {}
+    sums: Counter = Counter()
+    for doc in hour_docs:
+        local = event_time(doc["bucket"]).astimezone(tz)
+        if granularity == "day":
+            local = local.replace(hour=0)
+        series[local.replace(minute=0, second=0, microsecond=0)] += doc.get("count", 0)
+        intents.update(doc.get("intents") or {})
+        for stage, bins in (doc.get("latency") or {}).items():
+            histograms.setdefault(stage, Counter()).update({int(b): n for b, n in bins.items()})
+        sums.update(doc.get("latency_sum") or {})
+
+    latency = {}
+    for stage, histogram in sorted(histograms.items()):
+        count = sum(histogram.values())
+        latency[stage] = {
+            "count": count,
+            "mean": round(sums[stage] / count, 1) if count else None,
+            **{f"p{p}": histogram_percentile(histogram, p) for p in PERCENTILES},
+        }
+    return {
+        "total": sum(series.values()),
+        "series": [{"bucket": bucket.isoformat(), "count": series[bucket]} for bucket in sorted(series)],
+        "intents": dict(intents.most_common()),
+        "latency_ms": latency,
+    }
+
+
+def top_questions_pipeline(robot_id: str, start: datetime.datetime, end: datetime.datetime, limit: int) -> List[dict]:
+    """Most frequent normalized questions between start and end, summed over the daily (UTC) question counters."""
+    first_day = event_time(start).replace(hour=0, minute=0, second=0, microsecond=0)
+    return [
+        {"$match": {"robot_id": robot_id, "kind": "question", "bucket": {"$gte": first_day, "$lt": end}}},
+        {"$group": {"_id": "$key", "count": {"$sum": "$count"}, "question": {"$first": "$question"}}},
+        {"$sort": {"count": -1, "_id": 1}},
+        {"$limit": limit},
+        {"$project": {"_id": 0, "question": 1, "count": 1}},
+    ]
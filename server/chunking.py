@@ -0,0 +1,164 @@
+# --- Shared token-aware chunker for RAG ingestion ---
+# Used by the HTTP upload path (beta.py) and the offline ingest_database.py script,
+# so the same corpus always produces the same chunks.
+import re
+from typing import Callable, Iterable, Iterator, List, NamedTuple, Tuple
+
+DEFAULT_MAX_TOKENS = 128
+DEFAULT_OVERLAP_TOKENS = 32
+
+# A segment runs from a non-space character to a sentence end, a paragraph break, or the end of the page
+SEGMENT_RE = re.compile(r"\S.*?(?:[.!?…](?=\s)|(?=\n[ \t]*\n)|\Z)", re.S)
+WORD_RE = re.compile(r"\S+")
+
+_encoding = None
+
+
+def count_tokens(text: str) -> int:
+    """Tokens under the cl100k_base encoding used by the OpenAI embedding models (len/4 estimate without tiktoken)."""
+    global _encoding
+    if _encoding is None:
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding("cl100k_base")
+        except Exception:
+            _encoding = False
+    if _encoding is False:
+        return len(text) // 4 + 1
+    return len(_encoding.encode(text, disallowed_special=()))
+
+
+class Chunk(NamedTuple):
+    """One chunk; start/end are character offsets into the pages joined with "\\n", pages are 1-based."""
+    content: str
+    start: int
+    end: int
+    page_start: int
+    page_end: int
+    tokens: int
+
+
+class _Segment(NamedTuple):
+    text: str
+    start: int
+    end: int
+    page: int
+    tokens: int
+
+
+class StreamingChunker:
+    """Feed pages one at a time and receive chunks as soon as they are complete.
+
+    Chunks are packed from whole sentences/paragraphs up to max_tokens; only a segment longer than
+    max_tokens is split at word boundaries. Consecutive chunks share up to overlap_tokens of trailing segments.
+    """
+
+    def __init__(self, max_tokens: int = DEFAULT_MAX_TOKENS, overlap_tokens: int = DEFAULT_OVERLAP_TOKENS,
+                 token_counter: Callable[[str], int] = count_tokens):
+        if overlap_tokens >= max_tokens:
+            raise ValueError("overlap_tokens must be smaller than max_tokens")
+        self.max_tokens = max_tokens
+        self.overlap_tokens = overlap_tokens
+        self.count_tokens = token_counter
+        self._offset = 0  # start of the next page in the joined document text
+        self._pages_seen = 0
+        self._buffer: List[_Segment] = []
+        self._buffer_tokens = 0
+        self._fresh = 0  # segments in the buffer not yet emitted in any chunk
+
+    def _word_spans(self, text: str) -> Iterator[Tuple[int, int, int]]:
+        """(start, end, tokens) per word; a single word over max_tokens (e.g. an encoded blob) is cut by characters."""
+        for w in WORD_RE.finditer(text):
+            tokens = self.count_tokens(w.group(0)) + 1
+            if tokens <= self.max_tokens:
+                yield w.start(), w.end(), tokens
+                continue
+            step = max(1, len(w.group(0)) * self.max_tokens // (2 * tokens))
+            for start in range(w.start(), w.end(), step):
+                end = min(start + step, w.end())
+                yield start, end, self.count_tokens(text[start:end]) + 1
+
+    def _segments(self, page_number: int, text: str) -> Iterator[_Segment]:
+        for m in SEGMENT_RE.finditer(text):
+            seg_text = m.group(0)
+            tokens = self.count_tokens(seg_text)
+            if tokens <= self.max_tokens:
+                yield _Segment(seg_text, self._offset + m.start(), self._offset + m.end(), page_number, tokens)
+                continue
+            # Over-long sentence: fall back to word boundaries
+            piece_start = piece_end = None
+            piece_tokens = 0
+            for w_start, w_end, w_tokens in self._word_spans(seg_text):
+                if piece_start is not None and piece_tokens + w_tokens > self.max_tokens:
+                    yield _Segment(seg_text[piece_start:piece_end], self._offset + m.start() + piece_start,
+                                   self._offset + m.start() + piece_end, page_number, piece_tokens)
+                    piece_start, piece_tokens = None, 0
+                if piece_start is None:
+                    piece_start = w_start
+                piece_end = w_end
+                piece_tokens += w_tokens
+            if piece_start is not None:
+                yield _Segment(seg_text[piece_start:piece_end], self._offset + m.start() + piece_start,
+                               self._offset + m.start() + piece_end, page_number, piece_tokens)
+
+    def _emit(self) -> Chunk:
+        segs = self._buffer
+        content = re.sub(r"\s+", " ", " ".join(s.text for s in segs)).strip()
+        chunk = Chunk(content, segs[0].start, segs[-1].end, segs[0].page, segs[-1].page, self._buffer_tokens)
+        # Carry trailing segments (up to overlap_tokens) into the next chunk
+        carry: List[_Segment] = []
+        carry_tokens = 0
+        for seg in reversed(segs[1:]):
+            if carry_tokens + seg.tokens > self.overlap_tokens:
+                break
+            carry.insert(0, seg)
+            carry_tokens += seg.tokens
+        self._buffer, self._buffer_tokens, self._fresh = carry, carry_tokens, 0
+        return chunk
+
+    def feed(self, page_number: int, text: str) -> List[Chunk]:
+        """Add one page of text; returns every chunk that is now complete."""
+        chunks: List[Chunk] = []
+        if self._pages_seen:
+            self._offset += 1  # the "\n" joining pages
+        for seg in self._segments(page_number, text):
+            if self._fresh and self._buffer_tokens + seg.tokens > self.max_tokens:
+                chunks.append(self._emit())
+            while self._buffer and self._buffer_tokens + seg.tokens > self.max_tokens:
+                # Overlap alone does not leave room for this segment
+                self._buffer_tokens -= self._buffer.pop(0).tokens
+            self._buffer.append(seg)
+            self._buffer_tokens += seg.tokens
+            self._fresh += 1
+        self._offset += len(text)
+        self._pages_seen += 1
+        return chunks
+
+    def finish(self) -> List[Chunk]:
+        """Flush the final partial chunk."""
+        return [self._emit()] if self._fresh else []
+
+
+def iter_chunks(pages: Iterable[Tuple[int, str]], max_tokens: int = DEFAULT_MAX_TOKENS,
+                overlap_tokens: int = DEFAULT_OVERLAP_TOKENS) -> Iterator[Chunk]:
+    """Chunk a stream of (page_number, text) pairs lazily."""
+    chunker = StreamingChunker(max_tokens, overlap_tokens)
+    for page_number, text in pages:
+        yield from chunker.feed(page_number, text)
+    yield from chunker.finish()
+
+
+def chunk_text_by_chars(text: str, chunk_size: int = 500, overlap: int = 100) -> List[str]:
+    """Legacy character-window chunking, kept only as a baseline for benchmark_chunking.py."""
+    if not text:
+        return []
+    chunks: List[str] = []
+    start = 0
+    text_len = len(text)
+    while start < text_len:
+        end = min(start + chunk_size, text_len)
+        chunks.append(text[start:end])
+        if end == text_len:
+            break
+        start = max(end - overlap, 0)
+    return chunks
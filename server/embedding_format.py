@@ -0,0 +1,55 @@
+# --- Embedding storage format ---
+# Vectors are stored as packed little-endian Binary blobs instead of BSON arrays of doubles.
+import hashlib
+
+import numpy as np
+from bson.binary import Binary
+
+STORAGE_DTYPES = {"float32": np.dtype("<f4"), "float16": np.dtype("<f2"), "int8": np.dtype("i1")}
+# Vector size each OpenAI model returns when no reduced size is requested
+NATIVE_DIMENSIONS = {"text-embedding-3-large": 3072, "text-embedding-3-small": 1536, "text-embedding-ada-002": 1536}
+
+
+def model_key(model: str, dimensions: int | None = None) -> str:
+    """Identifies an embedding space; the same model at reduced dimensions is stored under its own key."""
+    return f"{model}@{dimensions}" if dimensions else model
+
+
+def query_dimensions(model: str, dimensions: int | None = None) -> int | None:
+    """Size of the query vectors the retriever compares against: the requested reduced size, else the model's native
+    size (None for models not in NATIVE_DIMENSIONS)."""
+    return dimensions or NATIVE_DIMENSIONS.get(model)
+
+
+def content_hash(model: str, text: str) -> str:
+    """Key of a chunk vector in the embeddings collection."""
+    return hashlib.sha256(f"{model}\x00{text}".encode("utf-8")).hexdigest()
+
+
+def encode_embedding(vector, dtype: str = "float32") -> dict:
+    """Fields to store for one vector: {"embedding": Binary, "dtype", "dim"} plus "scale" for int8."""
+    if dtype not in STORAGE_DTYPES:
+        raise ValueError(f"Unsupported embedding storage dtype: {dtype}")
+    vec = np.asarray(vector, dtype=np.float32)
+    fields = {"dtype": dtype, "dim": int(vec.shape[0])}
+    if dtype == "int8":
+        # Symmetric per-vector quantization; cosine scoring only needs the direction
+        scale = float(np.abs(vec).max()) / 127 or 1.0
+        vec = np.clip(np.rint(vec / scale), -127, 127)
+        fields["scale"] = scale
+    fields["embedding"] = Binary(vec.astype(STORAGE_DTYPES[dtype]).tobytes())
+    return fields
+
+
+def decode_embedding(record: dict) -> np.ndarray | None:
+    """float32 vector from either storage format: a Binary blob with "dtype", or a legacy list of doubles."""
+    value = record.get("embedding")
+    if value is None or len(value) == 0:
+        return None
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        dtype = record.get("dtype", "float32")
+        vec = np.frombuffer(value, dtype=STORAGE_DTYPES[dtype])  # zero-copy view for float32
+        if dtype == "int8":
+            return vec.astype(np.float32) * np.float32(record.get("scale", 1.0))
+        return vec if dtype == "float32" else vec.astype(np.float32)
+    return np.asarray(value, dtype=np.float32)
@@ -1,9 +1,12 @@
 import os
 from langchain_community.document_loaders import PyPDFDirectoryLoader
-from langchain_text_splitters import RecursiveCharacterTextSplitter
+from langchain_core.documents import Document
 from langchain_openai.embeddings import OpenAIEmbeddings
 from langchain_chroma import Chroma
 from uuid import uuid4
+from itertools import groupby
+
+from chunking import iter_chunks
 
 # import the .env file
 from dotenv import find_dotenv, load_dotenv
@@ -37,16 +40,27 @@ loader = PyPDFDirectoryLoader(DATA_PATH)
 
 raw_documents = loader.load()
 
-# splitting the document
-text_splitter = RecursiveCharacterTextSplitter(
-    chunk_size=500,
-    chunk_overlap=150,
-    length_function=len,
-    is_separator_regex=False,
-)
+# splitting the document with the same token-aware chunker as the /rag/knowledge upload path
+CHUNK_MAX_TOKENS = int(os.getenv("CHUNK_MAX_TOKENS", 128))
+CHUNK_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", 32))
 
-# creating the chunks
-chunks = text_splitter.split_documents(raw_documents)
+# creating the chunks, one chunker per source PDF (the loader returns one document per page, in order)
+chunks = []
+for source, pages in groupby(raw_documents, key=lambda d: d.metadata.get("source")):
+    pages = list(pages)
+    page_texts = ((d.metadata.get("page", i) + 1, d.page_content) for i, d in enumerate(pages))
+    for chunk in iter_chunks(page_texts, CHUNK_MAX_TOKENS, CHUNK_OVERLAP_TOKENS):
+        chunks.append(Document(
+            page_content=chunk.content,
+            metadata={
+                "source": source,
+                "start": chunk.start,
+                "end": chunk.end,
+                "page_start": chunk.page_start,
+                "page_end": chunk.page_end,
+                "tokens": chunk.tokens,
+            },
+        ))
 
 # creating unique ID's
 uuids = [str(uuid4()) for _ in range(len(chunks))]
@@ -0,0 +1,134 @@
+# --- In-process BM25 index used next to the vector index for hybrid retrieval ---
+# Scores chunks with BM25 and reports how much of the query each chunk covers.
+import math
+import re
+from collections import Counter
+from typing import Dict, Iterable, List, NamedTuple
+
+from vector_index import ChunkRow
+
+# Words plus compounds such as model numbers ("xr-200", "v2.1"); compounds are also indexed split and joined
+TOKEN_RE = re.compile(r"\w+(?:[-./]\w+)*")
+COMPOUND_SEP_RE = re.compile(r"[-./]")
+
+
+def query_terms(text: str) -> List[str]:
+    """Terms as the user typed them (compounds kept whole); used to tell short keyword queries apart."""
+    return TOKEN_RE.findall(text.lower())
+
+
+def tokenize(text: str) -> List[str]:
+    tokens: List[str] = []
+    for term in query_terms(text):
+        tokens.append(term)
+        parts = [p for p in COMPOUND_SEP_RE.split(term) if p]
+        if len(parts) > 1:
+            tokens.extend(parts)
+            tokens.append("".join(parts))  # "xr-200" also matches "XR200"
+    return tokens
+
+
+class LexicalHit(NamedTuple):
+    row: ChunkRow
+    score: float  # BM25
+    coverage: float  # idf-weighted share of the query terms known to the index that the chunk contains, 0..1
+
+
+class BM25Index:
+    """Inverted index over chunk text for one robot, patched in place on upload/delete like RobotVectorIndex."""
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.postings: Dict[str, Dict[int, int]] = {}  # term -> {row id: term frequency}
+        self.rows: Dict[int, ChunkRow] = {}
+        self.lengths: Dict[int, int] = {}
+        self.row_terms: Dict[int, List[str]] = {}
+        self.by_document: Dict[str, List[int]] = {}
+        self.total_length = 0
+        self._next_row = 0
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    @classmethod
+    def from_documents(cls, documents: Iterable[dict]) -> "BM25Index":
+        """Build from vector_db documents ({"_id", "chunks": [{"chunk_id", "content"}]})."""
+        index = cls()
+        for doc in documents:
+            index.add_document(str(doc.get("_id")), doc.get("chunks") or [])
+        return index
+
+    def add_document(self, doc_id: str, chunks: Iterable[dict]) -> int:
+        """Index a document's chunks; no-op if it is already indexed. Returns rows added."""
+        if doc_id in self.by_document:
+            return 0
+        row_ids: List[int] = []
+        for chunk in chunks:
+            content = chunk.get("content") or ""
+            counts = Counter(tokenize(content))
+            if not counts:
+                continue
+            row_id = self._next_row
+            self._next_row += 1
+            for term, tf in counts.items():
+                self.postings.setdefault(term, {})[row_id] = tf
+            length = sum(counts.values())
+            self.rows[row_id] = ChunkRow(doc_id, str(chunk.get("chunk_id", "")), content)
+            self.lengths[row_id] = length
+            self.row_terms[row_id] = list(counts)
+            self.total_length += length
+            row_ids.append(row_id)
+        self.by_document[doc_id] = row_ids
+        return len(row_ids)
+
+    def remove_document(self, doc_id: str) -> int:
+        """Drop every row belonging to a document. Returns rows removed."""
+        row_ids = self.by_document.pop(doc_id, None) or []
+        for row_id in row_ids:
+            for term in self.row_terms.pop(row_id):
+                postings = self.postings[term]
+                del postings[row_id]
+                if not postings:
+                    del self.postings[term]
+            self.total_length -= self.lengths.pop(row_id)
+            del self.rows[row_id]
+        return len(row_ids)
+
+    def knows(self, term: str) -> bool:
+        """Whether any chunk contains the query term, as typed or (for compounds) joined."""
+        return term in self.postings or "".join(COMPOUND_SEP_RE.split(term)) in self.postings
+
+    def idf(self, term: str) -> float:
+        df = len(self.postings.get(term, ()))
+        return math.log(1 + (len(self.rows) - df + 0.5) / (df + 0.5))
+
+    def search(self, query: str, k: int = 3) -> List[LexicalHit]:
+        """BM25 top-k. Coverage is per query term as typed (a compound matches as written or joined), so split
+        compound parts add to the score without inflating coverage."""
+        if not self.rows or k <= 0:
+            return []
+        whole_terms = set(query_terms(query))
+        aliases = {t: t for t in whole_terms}  # token -> query term it stands for
+        for term in whole_terms:
+            parts = [p for p in COMPOUND_SEP_RE.split(term) if p]
+            if len(parts) > 1:
+                aliases.setdefault("".join(parts), term)
+        avg_length = self.total_length / len(self.rows)
+        scores: Dict[int, float] = {}
+        matched: Dict[int, set] = {}
+        for term in set(tokenize(query)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = self.idf(term)
+            for row_id, tf in postings.items():
+                norm = self.k1 * (1 - self.b + self.b * self.lengths[row_id] / avg_length)
+                scores[row_id] = scores.get(row_id, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+                if term in aliases:
+                    matched.setdefault(row_id, set()).add(aliases[term])
+        # Terms no chunk contains (filler words, typos) cannot tell chunks apart and are left out of coverage
+        weights = {t: self.idf(t) for t in whole_terms if self.knows(t)}
+        total = sum(weights.values()) or 1.0
+        top = sorted(scores, key=scores.get, reverse=True)[:k]
+        return [LexicalHit(self.rows[r], scores[r], sum(weights[t] for t in matched.get(r, ())) / total) for r in top]
@@ -0,0 +1,102 @@
+# --- Embedding storage migration ---
+# Moves vectors stored as BSON arrays of doubles into the packed Binary format of embedding_format.py:
+#   1. re-encodes chunk_embeddings entries that are not in the target dtype yet
+#   2. moves inline vector_db chunk embeddings into chunk_embeddings and replaces them with an embedding_id
+# The server reads both formats, so this can run while it is serving.
+#
+#   python migrate_embeddings.py [--dtype float16] [--dry-run]
+import argparse
+import datetime
+import os
+from collections import Counter
+
+from dotenv import find_dotenv, load_dotenv
+from pymongo import MongoClient, UpdateOne
+
+from embedding_format import STORAGE_DTYPES, content_hash, decode_embedding, encode_embedding
+
+load_dotenv(find_dotenv(), override=True)
+
+
+def migrate_store(store, dtype: str, batch_size: int, dry_run: bool) -> int:
+    converted = 0
+    ops = []
+    for doc in store.find({"dtype": {"$ne": dtype}}, {"embedding": 1, "dtype": 1, "scale": 1}):
+        vec = decode_embedding(doc)
+        if vec is None:
+            continue
+        update = {"$set": encode_embedding(vec, dtype)}
+        if dtype != "int8":
+            update["$unset"] = {"scale": ""}
+        ops.append(UpdateOne({"_id": doc["_id"]}, update))
+        converted += 1
+        if len(ops) >= batch_size:
+            if not dry_run:
+                store.bulk_write(ops, ordered=False)
+            ops = []
+    if ops and not dry_run:
+        store.bulk_write(ops, ordered=False)
+    return converted
+
+
+def migrate_documents(vector_db, store, model: str, dtype: str, dry_run: bool) -> tuple[int, int]:
+    documents = chunks_moved = 0
+    now = datetime.datetime.utcnow()
+    for doc in vector_db.find({"chunks.embedding": {"$exists": True}}, {"chunks": 1}):
+        refs = Counter()
+        vectors = {}
+        for chunk in doc.get("chunks") or []:
+            if "embedding" not in chunk:
+                continue
+            vec = decode_embedding(chunk)
+            chunk.pop("embedding")
+            chunk.pop("dtype", None)
+            chunk.pop("scale", None)
+            if vec is None:
+                continue
+            h = content_hash(model, chunk.get("content", ""))
+            chunk["embedding_id"] = h
+            refs[h] += 1
+            vectors[h] = vec
+            chunks_moved += 1
+        documents += 1
+        if dry_run:
+            continue
+        # Store references first: a crash before the document update leaves an extra reference, never a dangling one
+        if refs:
+            store.bulk_write([
+                UpdateOne(
+                    {"_id": h},
+                    {"$inc": {"refs": n}, "$setOnInsert": {"model": model, **encode_embedding(vectors[h], dtype), "created_at": now}},
+                    upsert=True,
+                )
+                for h, n in refs.items()
+            ], ordered=False)
+        vector_db.update_one({"_id": doc["_id"]}, {"$set": {"chunks": doc["chunks"]}})
+    return documents, chunks_moved
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert stored embeddings to the packed Binary format")
+    parser.add_argument("--dtype", choices=list(STORAGE_DTYPES), default=os.getenv("EMBEDDING_STORAGE_DTYPE", "float32").lower())
+    parser.add_argument("--model", default="text-embedding-3-large", help="model the existing inline embeddings were created with")
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--dry-run", action="store_true", help="count what would change without writing")
+    args = parser.parse_args()
+
+    client = MongoClient(os.getenv("MONGODB_URI"))
+    db = client[os.getenv("MONGODB_DBNAME", "michi_robot")]
+    store = db[os.getenv("EMBEDDINGS_COLLECTION", "chunk_embeddings")]
+    vector_db = db[os.getenv("VECTOR_DB_COLLECTION", "vector_db")]
+
+    converted = migrate_store(store, args.dtype, args.batch_size, args.dry_run)
+    print(f"chunk_embeddings: {converted} vectors re-encoded as {args.dtype}")
+    documents, chunks_moved = migrate_documents(vector_db, store, args.model, args.dtype, args.dry_run)
+    print(f"vector_db: {chunks_moved} inline embeddings in {documents} documents moved to the embedding store")
+    if args.dry_run:
+        print("Dry run: nothing was written")
+    client.close()
+
+
+if __name__ == "__main__":
+    main()
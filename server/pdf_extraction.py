@@ -0,0 +1,57 @@
+# --- PDF text extraction ---
+# PyMuPDF parses page ranges in worker processes; the text comes back in page order.
+import asyncio
+import logging
+import os
+import tempfile
+from concurrent.futures import Executor
+from typing import AsyncIterator, List, Tuple
+
+import fitz  # PyMuPDF for PDF text extraction
+
+logger = logging.getLogger(__name__)
+
+
+def _write_file(fd: int, data: bytes) -> None:
+    with os.fdopen(fd, "wb") as f:
+        f.write(data)
+
+
+def _page_count(path: str) -> int:
+    with fitz.open(path) as doc:
+        return doc.page_count
+
+
+def _extract_page_range(path: str, start: int, end: int) -> List[str]:
+    """Worker: text of pages [start, end). MuPDF memory-maps/reads the shared file lazily, so only these pages are parsed."""
+    with fitz.open(path) as doc:
+        return [doc[i].get_text("text") for i in range(start, end)]
+
+
+async def aiter_pdf_pages(pdf_bytes: bytes, executor: Executor, pages_per_task: int = 8) -> AsyncIterator[Tuple[int, int, str]]:
+    """Yield (page_number, page_count, text) in page order while later pages are still being parsed in the pool.
+
+    The PDF is written once to a temp file that every worker opens by path, instead of pickling the bytes per task.
+    """
+    loop = asyncio.get_running_loop()
+    fd, path = tempfile.mkstemp(suffix=".pdf", prefix="rag_")
+    futures: List[asyncio.Future] = []
+    try:
+        await asyncio.to_thread(_write_file, fd, pdf_bytes)  # large uploads would stall the event loop
+        page_count = await loop.run_in_executor(executor, _page_count, path)
+        futures = [
+            loop.run_in_executor(executor, _extract_page_range, path, start, min(start + pages_per_task, page_count))
+            for start in range(0, page_count, pages_per_task)
+        ]
+        page_number = 0
+        for future in futures:
+            for text in await future:
+                page_number += 1
+                yield page_number, page_count, text
+    finally:
+        for future in futures:
+            future.cancel()
+        try:
+            os.remove(path)
+        except OSError as e:
+            logger.warning(f"Could not remove temporary PDF {path}: {e}")
@@ -0,0 +1,58 @@
+# --- Chat-log rollup backfill ---
+# Rebuilds the analytics rollups of chat_analytics.py from the chat_logs collection, e.g. for history written before
+# the rollups existed. --reset first deletes the existing rollups in scope; turns that were never logged (non-talk
+# intents) only live in the rollups and are lost by a reset. Run it while no robots are talking: turns logged during
+# the rebuild may be counted twice.
+#
+#   python rebuild_chat_rollups.py [--robot-id ROBOT] [--reset] [--dry-run]
+import argparse
+import os
+
+from dotenv import find_dotenv, load_dotenv
+from pymongo import MongoClient, UpdateOne
+
+from chat_analytics import rollup_updates
+
+load_dotenv(find_dotenv(), override=True)
+
+
+def flush(rollups, events: list[dict], dry_run: bool) -> None:
+    updates = rollup_updates(events)
+    if updates and not dry_run:
+        rollups.bulk_write([UpdateOne(f, u, upsert=True) for f, u in updates], ordered=False)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rebuild chat-log analytics rollups from chat_logs")
+    parser.add_argument("--robot-id", help="only this robot (default: all)")
+    parser.add_argument("--reset", action="store_true", help="delete existing rollups in scope first")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+
+    client = MongoClient(os.getenv("MONGODB_URI"))
+    db = client[os.getenv("MONGODB_DBNAME", "michi_robot")]
+    logs = db[os.getenv("MONGODB_COLLECTION", "chat_logs")]
+    rollups = db[os.getenv("CHAT_LOG_ROLLUP_COLLECTION", "chat_log_rollups")]
+    scope = {"robot_id": args.robot_id} if args.robot_id else {}
+
+    if args.reset and not args.dry_run:
+        deleted = rollups.delete_many(scope).deleted_count
+        print(f"Deleted {deleted} rollup documents")
+
+    processed = 0
+    events = []
+    for doc in logs.find(scope, {"input": 1, "time": 1, "robot_id": 1, "intent": 1, "latency_ms": 1}).sort("_id", 1):
+        events.append(doc)
+        if len(events) >= args.batch_size:
+            flush(rollups, events, args.dry_run)
+            processed += len(events)
+            events = []
+    flush(rollups, events, args.dry_run)
+    processed += len(events)
+    client.close()
+    print(f"{'Would roll up' if args.dry_run else 'Rolled up'} {processed} chat logs")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,230 @@
+# --- In-process vector index used by the RAG retriever ---
+# Rows are pre-normalized float32 vectors, so a cosine top-k is one matrix-vector product.
+import logging
+from typing import Dict, Iterable, List, NamedTuple, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_rows(matrix: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """L2-normalize rows in place; returns (matrix, mask of non-zero rows)."""
+    norms = np.linalg.norm(matrix, axis=1)
+    keep = norms > 0
+    matrix[keep] /= norms[keep, None]
+    return matrix, keep
+
+
+class ChunkRow(NamedTuple):
+    """Metadata for one row of the index matrix."""
+    doc_id: str
+    chunk_id: str
+    content: str
+
+
+class RobotVectorIndex:
+    """Contiguous pre-normalized float32 matrix plus parallel chunk rows for one robot.
+
+    An optional ANN index (ann_index.py) proposes candidates that are re-scored exactly; rows carry stable integer
+    labels so the ANN index survives compaction on delete.
+    """
+    ANN_OVERSAMPLE = 4  # candidates requested per result from the ANN index
+
+    def __init__(self, dim: int | None = None):
+        self.dim = dim
+        self.matrix = np.empty((0, dim or 0), dtype=np.float32)
+        self.rows: List[ChunkRow] = []  # parallel to matrix rows; doc_id lets uploads/deletes patch the index in place
+        self.labels = np.empty(0, dtype=np.int64)  # parallel to matrix rows; stable ids for the ANN index
+        self.documents: set[str] = set()
+        self.ann = None
+        self.ann_min_rows = 0  # below this many rows search stays exact even with an ANN index attached
+        self.ann_dirty = False  # ANN changed since it was last persisted
+        self._positions: Dict[int, int] = {}
+        self._row_positions: Dict[str, int] | None = None  # row_key -> position, built on first similarities() call
+        self._next_label = 0
+
+    def __len__(self) -> int:
+        return self.matrix.shape[0]
+
+    @staticmethod
+    def _stack_chunks(items: Iterable[Tuple[str, dict]], dim: int | None) -> Tuple[np.ndarray, List[ChunkRow], int | None]:
+        """Stack (doc_id, chunk) embeddings into a normalized float32 matrix, skipping empty or too-short ones.
+
+        Longer vectors are truncated to dim (Matryoshka-style); renormalizing keeps them comparable.
+        """
+        rows: List[ChunkRow] = []
+        vectors: List[np.ndarray] = []
+        skipped = 0
+        for doc_id, chunk in items:
+            emb = chunk.get("embedding")
+            if emb is None or len(emb) == 0:
+                continue
+            vec = np.asarray(emb, dtype=np.float32)
+            if dim is None:
+                dim = vec.shape[0]
+            if vec.ndim == 1 and vec.shape[0] > dim:
+                vec = vec[:dim]
+            if vec.shape != (dim,):
+                skipped += 1
+                continue
+            vectors.append(vec)
+            rows.append(ChunkRow(doc_id, str(chunk.get("chunk_id", "")), chunk.get("content", "")))
+        if skipped:
+            logger.warning(f"Skipped {skipped} chunks with embeddings shorter than {dim} dimensions")
+        if not vectors:
+            return np.empty((0, dim or 0), dtype=np.float32), [], dim
+        matrix, keep = normalize_rows(np.vstack(vectors))
+        return np.ascontiguousarray(matrix[keep]), [r for r, k in zip(rows, keep) if k], dim
+
+    @classmethod
+    def from_documents(cls, documents: Iterable[dict], dim: int | None = None) -> "RobotVectorIndex":
+        """Build from vector_db documents ({"_id", "chunks": [{"chunk_id", "content", "embedding"}]}).
+
+        dim fixes the index dimension; by default it is taken from the first embedding.
+        """
+        index = cls(dim)
+        items = ((str(doc.get("_id")), chunk) for doc in documents for chunk in (doc.get("chunks") or []))
+        index.matrix, index.rows, index.dim = index._stack_chunks(items, dim)
+        index.documents = {r.doc_id for r in index.rows}
+        index.labels = index._new_labels(len(index.rows))
+        index._positions = {label: i for i, label in enumerate(index.labels.tolist())}
+        return index
+
+    @staticmethod
+    def row_key(row: ChunkRow) -> str:
+        return f"{row.doc_id}/{row.chunk_id}"
+
+    def _new_labels(self, n: int) -> np.ndarray:
+        labels = np.arange(self._next_label, self._next_label + n, dtype=np.int64)
+        self._next_label += n
+        return labels
+
+    def attach_ann(self, ann, saved_keys: Dict[str, int] | None = None) -> None:
+        """Attach an ANN index. With saved_keys (chunk key -> label of a persisted ANN index) only the difference
+        is applied: rows already in it keep their label, new rows are added and vanished ones removed."""
+        if saved_keys:
+            self._next_label = max(saved_keys.values()) + 1
+            labels = np.empty(len(self.rows), dtype=np.int64)
+            new_positions: List[int] = []
+            for i, row in enumerate(self.rows):
+                label = saved_keys.pop(self.row_key(row), None)
+                if label is None:
+                    new_positions.append(i)
+                else:
+                    labels[i] = label
+            labels[new_positions] = self._new_labels(len(new_positions))
+            stale = np.fromiter(saved_keys.values(), dtype=np.int64, count=len(saved_keys))
+            if len(stale):
+                ann.remove(stale)
+            ann.add(self.matrix[new_positions], labels[new_positions])
+            logger.info(f"ANN index reconciled: {len(new_positions)} rows added, {len(stale)} removed")
+            self.ann_dirty = bool(new_positions) or bool(len(stale))
+        else:
+            labels = self._new_labels(len(self.rows))
+            ann.add(self.matrix, labels)
+            self.ann_dirty = True
+        self.labels = labels
+        self._positions = {label: i for i, label in enumerate(labels.tolist())}
+        self.ann = ann
+
+    def ann_keys(self) -> Dict[int, str]:
+        """label -> chunk key manifest for persisting the ANN index."""
+        return {label: self.row_key(row) for label, row in zip(self.labels.tolist(), self.rows)}
+
+    def add_document(self, doc_id: str, chunks: Iterable[dict]) -> int:
+        """Append a document's chunks; no-op if it is already indexed. Returns rows added."""
+        if doc_id in self.documents:
+            return 0
+        matrix, rows, dim = self._stack_chunks(((doc_id, c) for c in chunks), self.dim)
+        if not rows:
+            return 0
+        if self.dim is None:
+            self.dim = dim
+            self.matrix = np.empty((0, dim), dtype=np.float32)
+        # Build the new arrays first, then swap them in together
+        new_matrix = np.ascontiguousarray(np.vstack([self.matrix, matrix]))
+        labels = self._new_labels(len(rows))
+        if self.ann is not None:
+            self.ann.add(matrix, labels)
+            self.ann_dirty = True
+        self._positions.update((label, len(self.rows) + i) for i, label in enumerate(labels.tolist()))
+        self.rows, self.matrix, self.labels = self.rows + rows, new_matrix, np.concatenate([self.labels, labels])
+        self._row_positions = None
+        self.documents.add(doc_id)
+        return len(rows)
+
+    def remove_document(self, doc_id: str) -> int:
+        """Drop every row belonging to a document. Returns rows removed."""
+        if doc_id not in self.documents:
+            return 0
+        self.documents.discard(doc_id)
+        keep = np.fromiter((r.doc_id != doc_id for r in self.rows), dtype=bool, count=len(self.rows))
+        removed = int(len(keep) - keep.sum())
+        if removed:
+            if self.ann is not None:
+                self.ann.remove(self.labels[~keep])
+                self.ann_dirty = True
+            new_matrix = np.ascontiguousarray(self.matrix[keep])
+            self.rows = [r for r, k in zip(self.rows, keep) if k]
+            self.matrix, self.labels = new_matrix, self.labels[keep]
+            self._positions = {label: i for i, label in enumerate(self.labels.tolist())}
+            self._row_positions = None
+        return removed
+
+    def _ann_positions(self, q: np.ndarray, k: int) -> np.ndarray | None:
+        """Row positions proposed by the ANN index, or None to fall back to exact search."""
+        if self.ann is None or len(self) < self.ann_min_rows:
+            return None
+        try:
+            labels = self.ann.candidates(q, k * self.ANN_OVERSAMPLE)
+        except Exception as e:  # e.g. hnswlib cannot fill k results after many deletions
+            logger.warning(f"ANN search failed ({e}); using exact search")
+            return None
+        if labels is None:
+            return None
+        positions = [self._positions[label] for label in labels.tolist() if label in self._positions]
+        return np.fromiter(positions, dtype=np.int64, count=len(positions))
+
+    def _unit_query(self, query_vec) -> np.ndarray | None:
+        q = np.asarray(query_vec, dtype=np.float32)
+        if q.shape != (self.dim,):
+            return None
+        q_norm = float(np.linalg.norm(q))
+        if q_norm == 0:
+            return None
+        return q / q_norm
+
+    def search(self, query_vec, k: int = 3) -> List[Tuple[ChunkRow, float]]:
+        """Cosine top-k via one matrix-vector product and argpartition (over ANN candidates when attached)."""
+        n = len(self)
+        if n == 0 or k <= 0:
+            return []
+        q = self._unit_query(query_vec)
+        if q is None:
+            return []
+        positions = self._ann_positions(q, k)
+        if positions is None:
+            positions = np.arange(n)
+            scores = self.matrix @ q
+        else:
+            scores = self.matrix[positions] @ q
+        if k < len(positions):
+            top = np.argpartition(scores, -k)[-k:]
+        else:
+            top = np.arange(len(positions))
+        top = top[np.argsort(scores[top])[::-1]]
+        return [(self.rows[positions[i]], float(scores[i])) for i in top]
+
+    def similarities(self, query_vec, rows: Iterable[ChunkRow]) -> List[float | None]:
+        """Exact cosine of the query against the given rows (e.g. BM25 hits); None for rows not in the index."""
+        rows = list(rows)
+        q = self._unit_query(query_vec)
+        if q is None:
+            return [None] * len(rows)
+        if self._row_positions is None:
+            self._row_positions = {self.row_key(r): i for i, r in enumerate(self.rows)}
+        positions = [self._row_positions.get(self.row_key(r)) for r in rows]
+        found = [p for p in positions if p is not None]
+        scores = iter((self.matrix[found] @ q).tolist()) if found else iter(())
+        return [next(scores) if p is not None else None for p in positions]